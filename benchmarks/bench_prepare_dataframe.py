@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmark of logstar.prepare_dataframe against the previous object-dtype implementation.
+
+Builds a synthetic logstar response (default: 50 measurement columns, 500k rows of 10 minute data
+with 5% no-values, plus an integer counter channel) and reports rows/sec for both implementations.
+Both results, including the dtypes, are compared to make sure the fast path returns the same data.
+
+    python benchmarks/bench_prepare_dataframe.py --rows 500000 --columns 50
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import logstar_stream.logstar as logstar
+
+
+def legacy_prepare_dataframe(data, datetime_column):
+    """prepare_dataframe before the fast path, Datetime branch only"""
+    df = pd.DataFrame(data["data"])
+    df = df.rename(columns=data["header"])
+
+    df.rename(columns={"Datetime": datetime_column}, inplace=True)
+    cols = df.columns.tolist()
+    df[datetime_column] = pd.to_datetime(df[datetime_column], errors="raise")
+    cols.insert(0, cols.pop(cols.index(datetime_column)))
+    df = df[cols]
+    cols.remove(datetime_column)
+
+    df.replace("#", pd.NA, inplace=True)
+    for col in cols:
+        df[col] = pd.to_numeric(df[col], errors="raise")
+    return df
+
+
+def synthetic_payload(rows, columns, no_value_ratio=0.05, seed=0):
+    """logstar like response with a Datetime column, string encoded measurements and an integer counter"""
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.uniform(-10, 100, (rows, columns)), 2).astype(str)
+    values[rng.random((rows, columns)) < no_value_ratio] = "#"
+    timestamps = pd.date_range("2021-01-01", periods=rows, freq="10min").strftime(
+        logstar.LOGSTAR_DATETIME_FORMAT
+    )
+
+    counter = (np.arange(rows) % 1000).astype(str)
+
+    keys = [str(i) for i in range(columns + 2)]
+    header = {"0": "Datetime"}
+    header.update({key: f"WS1_LT_{key} - °C" for key in keys[1:-1]})
+    header[keys[-1]] = "WS1_counter"
+    data = [
+        dict(zip(keys, [t, *row, n]))
+        for t, row, n in zip(timestamps, values.tolist(), counter.tolist())
+    ]
+    return {"header": header, "data": data}
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--columns", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"building payload with {args.rows} rows and {args.columns} columns ...")
+    data = synthetic_payload(args.rows, args.columns)
+
+    legacy_time, legacy_df = measure(
+        lambda: legacy_prepare_dataframe(data, "Datetime"), args.repeat
+    )
+    fast_time, fast_df = measure(
+        lambda: logstar.prepare_dataframe(data, "Datetime"), args.repeat
+    )
+
+    pd.testing.assert_frame_equal(fast_df, legacy_df, check_exact=True)
+
+    print(f"legacy: {legacy_time:8.2f} s {args.rows / legacy_time:12.0f} rows/sec")
+    print(f"fast:   {fast_time:8.2f} s {args.rows / fast_time:12.0f} rows/sec")
+    print(f"speedup: {legacy_time / fast_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
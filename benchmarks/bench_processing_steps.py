@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Benchmark and golden comparison of the processing step engines.
+
+Runs engine=rowwise and engine=vectorized of each processing step on the same synthetic data, split into
+chunks to exercise the state kept between calls, and fails if the resulting dataframes or changelogs differ.
+
+    python benchmarks/bench_processing_steps.py --rows 52560 --chunks 4
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logstar_stream.processing_steps.BulkConductivityDriftPS import (
+    BulkConductivityDriftPS,
+)
+from logstar_stream.processing_steps.JumpCheckPS import JumpCheckPS
+
+
+def synthetic_water_content(rows, rng):
+    """water content with jumps up/down of random duration and missing values"""
+    data = {}
+    for column in JumpCheckPS.JUMP_CHECK_COLUMN_NAMES:
+        values = 25 + np.cumsum(rng.normal(0, 0.3, rows))
+        for start in np.flatnonzero(rng.random(rows) < 0.01):
+            values[start : start + rng.integers(1, 15)] += rng.choice([6.0, 9.0, -7.0])
+        values[rng.random(rows) < 0.01] = np.nan
+        data[column] = values
+    return data
+
+
+def synthetic_bulk_conductivity(rows, rng):
+    """bulk conductivity with drifting values and missing values"""
+    data = {}
+    for column in (
+        BulkConductivityDriftPS.ELEMENT_ORDER_LEFT
+        + BulkConductivityDriftPS.ELEMENT_ORDER_RIGHT
+    ):
+        values = rng.normal(120, 40, rows)
+        drift = rng.random(rows) < 0.02
+        values[drift] += rng.uniform(50, 400, drift.sum())
+        values[rng.random(rows) < 0.01] = np.nan
+        data[column] = values
+    return data
+
+
+def synthetic_station(rows, seed=0):
+    """10 minute data of a station with water content and bulk conductivity sensors"""
+    rng = np.random.default_rng(seed)
+    data = {"Datetime": pd.date_range("2021-01-01", periods=rows, freq="10min")}
+    data.update(synthetic_water_content(rows, rng))
+    data.update(synthetic_bulk_conductivity(rows, rng))
+    return pd.DataFrame(data)
+
+
+# processing step, arguments of the reference engine, arguments of the engine to compare
+CASES = [
+    (
+        JumpCheckPS,
+        {"engine": "rowwise"},
+        {"engine": "vectorized", "changelog": "text"},
+    ),
+    (
+        BulkConductivityDriftPS,
+        {"engine": "rowwise"},
+        {"engine": "vectorized", "changelog": "text"},
+    ),
+]
+
+
+def run(step_class, kwargs, chunks, station="station"):
+    """runs the processing step on all chunks, returns result, changelog and duration"""
+    step = step_class(dict(kwargs))
+    changelog = []
+    step.write_log = lambda station: changelog.extend(step.changed)
+
+    start = time.perf_counter()
+    results = [step.process(chunk.copy(), station) for chunk in chunks]
+    duration = time.perf_counter() - start
+
+    # columnar changelog, not flushed
+    for changes in step.change_log.values():
+        for change in changes:
+            changelog.extend(
+                {"messurement": change["messurement"], "old_value": old_value}
+                for old_value in change["old_value"]
+            )
+    return pd.concat(results), changelog, duration
+
+
+def same_entry(a, b):
+    return a.keys() == b.keys() and all(
+        (pd.isnull(a[k]) and pd.isnull(b[k])) or a[k] == b[k] for k in a
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rows", type=int, default=52560, help="default: one year of 10 minute data"
+    )
+    parser.add_argument("--chunks", type=int, default=4)
+    args = parser.parse_args()
+
+    df = synthetic_station(args.rows)
+    bounds = np.linspace(0, args.rows, args.chunks + 1).astype(int)
+    chunks = [
+        df.iloc[start:stop].reset_index(drop=True)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+
+    for step_class, reference_kwargs, kwargs in CASES:
+        reference_df, reference_log, reference_time = run(
+            step_class, reference_kwargs, chunks
+        )
+        result_df, result_log, result_time = run(step_class, kwargs, chunks)
+
+        pd.testing.assert_frame_equal(reference_df, result_df)
+        if len(reference_log) != len(result_log) or not all(
+            same_entry(a, b) for a, b in zip(reference_log, result_log)
+        ):
+            raise AssertionError(
+                f"changelogs of {step_class.ps_name} {reference_kwargs} and {kwargs} differ"
+            )
+
+        print(
+            f"{step_class.ps_name}: identical output, {len(result_log)} changed values"
+        )
+        print(
+            f"\t{reference_kwargs}: {reference_time:8.3f} s {args.rows / reference_time:12.0f} rows/sec"
+        )
+        print(
+            f"\t{kwargs}: {result_time:8.3f} s {args.rows / result_time:12.0f} rows/sec"
+        )
+        print(f"\tspeedup: {reference_time / result_time:.1f}x")
+
+        columnar_kwargs = dict(kwargs, changelog="csv")
+        columnar_df, columnar_log, columnar_time = run(
+            step_class, columnar_kwargs, chunks
+        )
+        pd.testing.assert_frame_equal(reference_df, columnar_df)
+        if len(columnar_log) != len(reference_log):
+            raise AssertionError(
+                f"columnar changelog of {step_class.ps_name} has {len(columnar_log)} instead of {len(reference_log)} entries"
+            )
+        print(
+            f"\t{columnar_kwargs}: {columnar_time:8.3f} s {args.rows / columnar_time:12.0f} rows/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
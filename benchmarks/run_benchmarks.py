@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the receiver against the local mock api (see logstar_stream/mock_api.py).
+
+For every combination of stations x days x columns the stages of a run are measured one by one:
+download, column mapping, prepare_dataframe, each processing step, write_to_database and csv output,
+followed by a whole manage_dl_db run and optionally a run of logstar-receiver.py. Durations are the best
+of --repeat runs, peak memory is measured with tracemalloc in a separate run so it does not slow down
+the timing. Results are written as JSON, a previous result can be passed with --compare to report
+regressions.
+
+    python benchmarks/run_benchmarks.py --stations 4 --days 30 365 --columns 20 --output result.json
+    python benchmarks/run_benchmarks.py --database postgresql+psycopg2://postgres@localhost/logstar --cli
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+import sqlalchemy as sq
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import logstar_stream.logstar as logstar
+import logstar_stream.processing_steps.ProcessingStep as ps
+from logstar_stream.mock_api import MockLogstarServer
+from logstar_stream.processing_steps.BulkConductivityDriftPS import (
+    BulkConductivityDriftPS,
+)
+from logstar_stream.processing_steps.JumpCheckPS import JumpCheckPS
+
+# mapped names of the synthetic channels, the first channels feed the processing steps
+STEP_COLUMNS = (
+    JumpCheckPS.JUMP_CHECK_COLUMN_NAMES
+    + BulkConductivityDriftPS.ELEMENT_ORDER_LEFT
+    + BulkConductivityDriftPS.ELEMENT_ORDER_RIGHT
+)
+
+DEFAULT_STEPS = ["JumpCheckPS", "BulkConductivityDriftPS"]
+
+TABLE_PREFIX = "bench_"
+
+# relative slowdown reported as regression by --compare
+REGRESSION_THRESHOLD = 0.1
+# smaller differences in seconds are noise
+REGRESSION_MIN_SECONDS = 0.005
+
+
+def bench_sensor_mapping(stations, columns):
+    """maps the mock channels to the column names read by the processing steps"""
+    names = list(STEP_COLUMNS[:columns]) + [
+        f"channel_{i}" for i in range(len(STEP_COLUMNS) + 1, columns + 1)
+    ]
+    return {
+        "sensor-mapping": {
+            station: {"values": [station], "measurement-class": "bench"}
+            for station in stations
+        },
+        "measurement-classes": {
+            "bench": {
+                "regex": ".*",
+                "mapping": {
+                    name: {
+                        "abbreviation": f"_CH_{i} -",
+                        "only_includes_abbreviation": True,
+                    }
+                    for i, name in enumerate(names, start=1)
+                },
+            }
+        },
+    }
+
+
+def load_steps(names, log_dir):
+    return [ps.load_class([name, f"PS_LOGGING_DIR={log_dir}"]) for name in names]
+
+
+class StageTimer(object):
+    """accumulates duration, peak memory and counters per stage"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak_bytes = {}
+        self.rows = {}
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            self.rows[name] = self.rows.get(name, 0) + rows
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), peak)
+
+
+def run_stages(conf, mapping, steps, engine, csv_folder, timer, write_method):
+    """runs the stages of manage_dl_db one by one for every station"""
+    for station in conf["stationlist"]:
+        with timer.stage("download"):
+            data = logstar.download_data(conf, station)
+        if data is None:
+            raise RuntimeError(f"download of {station} failed")
+
+        with timer.stage("column_mapping", len(data["data"])):
+            data["header"] = logstar.do_column_name_mapping(
+                station, data["header"], mapping
+            )
+            name = logstar.do_station_name_mapping(station, mapping)
+
+        with timer.stage("prepare_dataframe", len(data["data"])):
+            df = logstar.prepare_dataframe(data, "Datetime")
+        del data
+
+        for step in steps:
+            with timer.stage(f"ps:{step.ps_name}", len(df)):
+                df = step.process(df, name)
+        for step in steps:
+            with timer.stage(f"ps:{step.ps_name}"):
+                step.flush_change_log()
+
+        if engine is not None:
+            with timer.stage("write_to_database", len(df)):
+                logstar.write_to_database(
+                    name, df, engine, None, TABLE_PREFIX, "Datetime", write_method
+                )
+        with timer.stage("csv", len(df)):
+            logstar.write_station(name, df, csv_folder=csv_folder)
+
+
+def drop_tables(engine, stations):
+    if engine is None:
+        return
+    with engine.begin() as conn:
+        for station in stations:
+            conn.execute(sq.text(f'DROP TABLE IF EXISTS "{TABLE_PREFIX}{station}"'))
+    logstar.invalidate_table_metadata()
+
+
+def measure(func, repeat, before=None):
+    """best duration of repeat runs and tracemalloc peak of an additional run"""
+    best = float("inf")
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_cli(server, stations, days_conf, mapping_path, steps, database, csv_folder, log_dir):
+    """runs logstar-receiver.py in a subprocess, returns duration and maximum rss"""
+    env = dict(
+        os.environ,
+        LOGSTAR_API_URL=server.url,
+        LOGSTAR_APIKEY="bench",
+        LOGSTAR_STATIONS=" ".join(stations),
+        LOGSTAR_STARTDATE=days_conf["startdate"],
+        LOGSTAR_ENDDATE=days_conf["enddate"],
+        LOGSTAR_DAYTIME="0",
+    )
+    cmd = [
+        sys.executable,
+        os.path.join(ROOT, "logstar-receiver.py"),
+        "-m",
+        mapping_path,
+        "-co",
+        csv_folder,
+        "--db_table_prefix",
+        TABLE_PREFIX,
+    ]
+    for step in steps:
+        cmd += ["-ps", step, f"PS_LOGGING_DIR={log_dir}"]
+    if database:
+        url = sq.engine.make_url(database)
+        env.update(
+            LOGSTAR_DB_HOST=url.host or url.query.get("host", "localhost"),
+            LOGSTAR_DB_PORT=str(url.port or 5432),
+            LOGSTAR_DB_DBNAME=url.database or "postgres",
+            LOGSTAR_DB_USER=url.username or "postgres",
+            LOGSTAR_DB_PASS=url.password or "",
+        )
+    else:
+        cmd.append("-nodb")
+
+    start = time.perf_counter()
+    # processing steps are loaded relative to the repository
+    process = subprocess.run(cmd, env=env, cwd=ROOT, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"logstar-receiver.py failed:\n{process.stderr}")
+    duration = time.perf_counter() - start
+    # maximum over all children so far, kb on linux
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return duration, max_rss
+
+
+def clear_folder(folder):
+    for f in os.listdir(folder):
+        os.remove(os.path.join(folder, f))
+
+
+def run_case(args, n_stations, days, columns, engine):
+    stations = [f"BENCH{i}" for i in range(n_stations)]
+    enddate = pd.Timestamp(args.startdate) + pd.Timedelta(days=days - 1)
+    conf = {
+        "apikey": "bench",
+        "stationlist": stations,
+        "startdate": args.startdate,
+        "enddate": enddate.strftime("%Y-%m-%d"),
+        "datetime": "0",
+        "geodata": "0",
+    }
+    mapping = logstar.compile_sensor_mapping(bench_sensor_mapping(stations, columns))
+    rows = n_stations * days * 24 * 60 // args.interval
+    result = {
+        "stations": n_stations,
+        "days": days,
+        "columns": columns,
+        "rows": rows,
+        "stages": {},
+    }
+
+    with MockLogstarServer(
+        columns=columns, interval_minutes=args.interval, latency=args.latency
+    ) as server, tempfile.TemporaryDirectory() as tmp:
+        logstar.LOGSTAR_API_URL = server.url
+        csv_folder = os.path.join(tmp, "csv")
+        log_dir = os.path.join(tmp, "logs") + "/"
+        os.makedirs(csv_folder)
+        os.makedirs(log_dir)
+
+        def reset():
+            clear_folder(csv_folder)
+            drop_tables(engine, stations)
+
+        # the mock generates every payload once, keep that out of the download stage
+        for station in stations:
+            logstar.download_data(conf, station)
+
+        # stages one by one, timing and memory in separate runs
+        timers = []
+        for trace_memory in [False] * args.repeat + [True]:
+            reset()
+            timer = StageTimer(trace_memory)
+            steps = load_steps(args.steps, log_dir)
+            sent = server.bytes_sent
+            if trace_memory:
+                tracemalloc.start()
+            try:
+                run_stages(conf, mapping, steps, engine, csv_folder, timer, args.db_write_method)
+            finally:
+                if trace_memory:
+                    tracemalloc.stop()
+            timer.bytes = server.bytes_sent - sent
+            timers.append(timer)
+
+        for name in timers[0].seconds:
+            seconds = min(timer.seconds[name] for timer in timers[:-1])
+            stage_rows = timers[0].rows[name]
+            result["stages"][name] = {
+                "seconds": seconds,
+                "rows_per_sec": stage_rows / seconds if stage_rows and seconds else None,
+                "peak_bytes": timers[-1].peak_bytes[name],
+            }
+        download = result["stages"]["download"]
+        download["bytes"] = timers[0].bytes
+        download["mb_per_sec"] = timers[0].bytes / download["seconds"] / 1e6
+
+        # whole runs
+        def manage_dl_db(**kwargs):
+            logstar.manage_dl_db(
+                conf,
+                engine,
+                processing_steps=load_steps(args.steps, log_dir),
+                sensor_mapping=mapping,
+                csv_folder=csv_folder,
+                db_table_prefix=TABLE_PREFIX,
+                db_write_method=args.db_write_method,
+                **kwargs,
+            )
+
+        seconds, peak = measure(manage_dl_db, args.repeat, reset)
+        result["manage_dl_db"] = {
+            "seconds": seconds,
+            "rows_per_sec": rows / seconds,
+            "peak_bytes": peak,
+        }
+        seconds, peak = measure(
+            lambda: manage_dl_db(pipeline=True, download_workers=args.download_workers),
+            args.repeat,
+            reset,
+        )
+        result["manage_dl_db_pipeline"] = {
+            "seconds": seconds,
+            "rows_per_sec": rows / seconds,
+            "peak_bytes": peak,
+        }
+
+        if args.cli:
+            mapping_path = os.path.join(tmp, "sensor_mapping.json")
+            with open(mapping_path, "w") as f:
+                json.dump(bench_sensor_mapping(stations, columns), f)
+            reset()
+            seconds, max_rss = run_cli(
+                server, stations, conf, mapping_path, args.steps, args.database, csv_folder, log_dir
+            )
+            result["cli"] = {
+                "seconds": seconds,
+                "rows_per_sec": rows / seconds,
+                "max_rss_bytes": max_rss,
+            }
+        reset()
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+    }
+
+
+def case_key(case):
+    return (case["stations"], case["days"], case["columns"])
+
+
+def compare(previous, current, threshold=REGRESSION_THRESHOLD):
+    """prints the relative change of every stage, returns the number of regressions"""
+    previous_cases = {case_key(case): case for case in previous["results"]}
+    regressions = 0
+    for case in current["results"]:
+        old = previous_cases.get(case_key(case))
+        if old is None:
+            continue
+        print(f"stations={case['stations']} days={case['days']} columns={case['columns']}:")
+        measured = dict(case["stages"])
+        measured.update({k: case[k] for k in ("manage_dl_db", "manage_dl_db_pipeline", "cli") if k in case})
+        old_measured = dict(old["stages"])
+        old_measured.update({k: old[k] for k in ("manage_dl_db", "manage_dl_db_pipeline", "cli") if k in old})
+        for name, values in measured.items():
+            if name not in old_measured:
+                continue
+            old_seconds = old_measured[name]["seconds"]
+            change = values["seconds"] / old_seconds - 1
+            flag = ""
+            if change > threshold and values["seconds"] - old_seconds > REGRESSION_MIN_SECONDS:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"\t{name:40s} {old_seconds:8.3f} s -> {values['seconds']:8.3f} s ({change:+.0%}){flag}")
+    return regressions
+
+
+def print_case(case):
+    print(f"stations={case['stations']} days={case['days']} columns={case['columns']} rows={case['rows']}:")
+    for name, values in case["stages"].items():
+        rate = f"{values['rows_per_sec']:12.0f} rows/sec" if values["rows_per_sec"] else " " * 21
+        print(f"\t{name:40s} {values['seconds']:8.3f} s {rate} {values['peak_bytes'] / 1e6:8.1f} MB peak")
+    for name in ("manage_dl_db", "manage_dl_db_pipeline", "cli"):
+        if name in case:
+            values = case[name]
+            memory = values.get("peak_bytes", values.get("max_rss_bytes"))
+            print(f"\t{name:40s} {values['seconds']:8.3f} s {values['rows_per_sec']:12.0f} rows/sec {memory / 1e6:8.1f} MB peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--stations", type=int, nargs="+", default=[4])
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365])
+    parser.add_argument("--columns", type=int, nargs="+", default=[20])
+    parser.add_argument("--interval", type=int, default=10, help="minutes in between two rows")
+    parser.add_argument("--startdate", default="2021-01-01")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of api latency per request")
+    parser.add_argument("--steps", nargs="*", default=DEFAULT_STEPS, help="processing steps to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--download-workers", type=int, dest="download_workers", default=4)
+    parser.add_argument(
+        "--database",
+        default=None,
+        help="sqlalchemy url of a PostgreSQL database, write_to_database is skipped if not set",
+    )
+    parser.add_argument(
+        "--db-write-method",
+        dest="db_write_method",
+        choices=logstar.DB_WRITE_METHODS,
+        default="insert",
+    )
+    parser.add_argument("--cli", action="store_true", help="also run logstar-receiver.py")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="JSON result of a previous run to compare with")
+    args = parser.parse_args()
+
+    engine = sq.create_engine(args.database) if args.database else None
+    results = {"environment": environment(), "arguments": vars(args), "results": []}
+    try:
+        for n_stations in args.stations:
+            for days in args.days:
+                for columns in args.columns:
+                    case = run_case(args, n_stations, days, columns, engine)
+                    print_case(case)
+                    results["results"].append(case)
+    finally:
+        if engine is not None:
+            engine.dispose()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(json.load(f), results)
+        if regressions:
+            print(f"{regressions} stage(s) slower by more than {REGRESSION_THRESHOLD:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import logstar_stream.logstar as logstar
+import logstar_stream.mock_api as mock_api
+
+
+def record_fixtures(fixtures_dir, timeout):
+    """downloads LOGSTAR_STATIONS from LOGSTAR_STARTDATE to LOGSTAR_ENDDATE into fixtures_dir"""
+    conf = {
+        "apikey": os.environ.get("LOGSTAR_APIKEY"),
+        "geodata": os.environ.get("LOGSTAR_GEODATA", True),
+        "datetime": os.environ.get("LOGSTAR_DAYTIME", 0),
+        "startdate": os.environ.get("LOGSTAR_STARTDATE", "2021-01-01"),
+        "enddate": os.environ.get("LOGSTAR_ENDDATE", "2022-01-01"),
+    }
+    stations = os.environ.get("LOGSTAR_STATIONS", "").split()
+    if not conf["apikey"] or not stations:
+        logging.error("LOGSTAR_APIKEY and LOGSTAR_STATIONS are needed to record fixtures, bye ...")
+        sys.exit(1)
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    for station in stations:
+        logging.info(
+            f"recording station {station} from {conf['startdate']} to {conf['enddate']} ..."
+        )
+        data = logstar.download_data(conf, station, timeout)
+        if data is None or "data" not in data:
+            logging.error(f"could not download data for station {station}\n {data}")
+            continue
+        mock_api.save_fixture(os.path.join(fixtures_dir, station + ".json"), data)
+    return logstar.report_failed_downloads()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Local stand-in for the logstar-online api to run logstar-receiver.py and the benchmarks offline.
+
+    Stations with a recorded response <fixtures>/<station>.json are served from it, all other stations
+    get synthetic data. Point the receiver at the server with LOGSTAR_API_URL=http://HOST:PORT/api
+    or --api-url.
+    """
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument(
+        "--apikey", default=None, help="only accept this api key, any key if not set"
+    )
+    parser.add_argument(
+        "--stations",
+        nargs="+",
+        default=None,
+        help="known stations, other stations get 404, any station if not set",
+    )
+    parser.add_argument(
+        "--columns",
+        type=int,
+        default=mock_api.MOCK_COLUMNS,
+        help="measurement channels of synthetic stations",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=mock_api.MOCK_INTERVAL_MINUTES,
+        help="minutes in between two rows of synthetic stations",
+    )
+    parser.add_argument(
+        "--gap-ratio",
+        type=float,
+        dest="gap_ratio",
+        default=mock_api.MOCK_GAP_RATIO,
+        help="share of missing values (#) of synthetic stations",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds every response is delayed"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        dest="error_rate",
+        default=0.0,
+        help="share of requests answered with one of --error-status",
+    )
+    parser.add_argument(
+        "--error-status",
+        type=int,
+        nargs="+",
+        dest="error_status",
+        default=[503],
+        help="status codes of failing requests",
+    )
+    parser.add_argument(
+        "--fixtures", default=None, help="directory with recorded responses <station>.json"
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="record LOGSTAR_STATIONS from logstar-online into --fixtures using the LOGSTAR_* env vars and exit",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="do not serve rows after the current time, new rows show up like on a live station",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Enable verbose logging"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(message)s",
+        level=logging.DEBUG if args.verbose else logging.INFO,
+    )
+
+    if args.record:
+        if not args.fixtures:
+            logging.error("--record needs --fixtures, bye ...")
+            sys.exit(1)
+        failed = record_fixtures(args.fixtures, timeout=60)
+        sys.exit(1 if failed else 0)
+
+    server = mock_api.MockLogstarServer(
+        host=args.host,
+        port=args.port,
+        apikey=args.apikey,
+        stations=args.stations,
+        columns=args.columns,
+        interval_minutes=args.interval,
+        gap_ratio=args.gap_ratio,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        fixtures_dir=args.fixtures,
+        realtime=args.realtime,
+        seed=args.seed,
+    )
+    server.start()
+    logging.info(f'export LOGSTAR_API_URL="{server.url}" to use it ...')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logging.info(f"{server}, bye ...")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 import argparse
+import contextlib
 import logging
 import json
 import sys
+import threading
 import os
 import datetime
 import time
@@ -12,7 +14,19 @@ from sqlalchemy import create_engine
 from sqlalchemy.engine import URL
 
 import logstar_stream.logstar as logstar
-import logstar_stream.processing_steps.ProcessingStep as ps
+import logstar_stream.backfill as backfill
+import logstar_stream.ongoing as ongoing
+import logstar_stream.scheduler as scheduler
+import logstar_stream.client as client
+import logstar_stream.metrics as metrics
+import logstar_stream.profiling as profiling
+import logstar_stream.planner as planner
+from logstar_stream.sensor_mapping import compile_sensor_mapping
+from logstar_stream.fingerprint import FingerprintCache
+from logstar_stream.projection import ChannelProjection
+from logstar_stream.parallel import ProcessingPool
+from logstar_stream.streaming import StreamState
+from logstar_stream.reprocess import RAW_TABLE_PREFIX, RawStore
 
 DB_RECONNECT_TIMEOUT = 3  # time in between reconnect attempts
 
@@ -73,6 +87,59 @@ def main():
         "-i", "--interval", type=int, default=20, help="sampling interval in minutes"
     )
 
+    parser.add_argument(
+        "--no-watermark",
+        dest="no_watermark",
+        action="store_true",
+        help="ongoing mode downloads yesterday to tomorrow for every station instead of starting at the last stored timestamp",
+    )
+
+    parser.add_argument(
+        "--ongoing-lookback-days",
+        type=int,
+        dest="lookback_days",
+        default=ongoing.ONGOING_LOOKBACK_DAYS,
+        help="days downloaded in ongoing mode for stations without stored data (default: 1)",
+    )
+
+    parser.add_argument(
+        "--no-skip-unchanged",
+        dest="no_skip_unchanged",
+        action="store_true",
+        help="ongoing mode processes and writes every payload, even if it did not change since the last poll",
+    )
+
+    parser.add_argument(
+        "--scheduler",
+        dest="scheduler",
+        action="store_true",
+        help="ongoing mode polls every station on its own interval, see --station-interval",
+    )
+
+    parser.add_argument(
+        "--station-interval",
+        dest="station_intervals",
+        action="append",
+        metavar="STATION[,STATION...]=MINUTES",
+        help="polling interval of single stations or groups of stations with --scheduler, can be given multiple times (default: --interval)",
+    )
+
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        dest="jitter",
+        default=30.0,
+        help="maximum random delay in seconds added to every poll with --scheduler, spreads the load on logstar-online (default: 30)",
+    )
+
+    parser.add_argument(
+        "--max-concurrent-stations",
+        type=int,
+        dest="max_concurrent_stations",
+        default=scheduler.MAX_CONCURRENT_STATIONS,
+        help="number of stations polled at the same time with --scheduler (default: 4)",
+    )
+
     parser.add_argument(
         "-c",
         "--chunk-delta",
@@ -82,6 +149,38 @@ def main():
         help="chunk duration in days for start and endtime of data download (default: 90 days), to disable set to: 0"
     )
 
+    parser.add_argument(
+        "--backfill",
+        dest="backfill",
+        action="store_true",
+        help="download all stations in windows of --chunk-delta days in parallel, completed windows are skipped on a rerun with --checkpoint",
+    )
+
+    parser.add_argument(
+        "--backfill-workers",
+        type=int,
+        dest="backfill_workers",
+        default=4,
+        help="number of stations downloaded in parallel with --backfill (default: 4)",
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        dest="checkpoint",
+        default=None,
+        help="path to the checkpoint file of --backfill, created if it does not exist",
+    )
+
+    parser.add_argument(
+        "--state-dir",
+        type=str,
+        dest="state_dir",
+        default=None,
+        help="folder the held back rows and the state of the processing steps are stored in between chunks, "
+        "continues --backfill and --ongoing after a restart like a single run (default: <checkpoint>.state with --checkpoint)",
+    )
+
     parser.add_argument(
         "-m",
         "--sensor_mapping_file",
@@ -90,6 +189,14 @@ def main():
         help="path to json file for raw sensor name to tablename mapping",
     )
 
+    parser.add_argument(
+        "--api-url",
+        type=str,
+        dest="api_url",
+        help="base url of the logstar api, e.g. of a local mock server, defaults to env LOGSTAR_API_URL or logstar-online.de ...",
+        default=None,
+    )
+
     parser.add_argument(
         "--timeout",
         type=int,
@@ -98,6 +205,61 @@ def main():
         default=15,
     )
 
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        dest="download_workers",
+        default=1,
+        help="number of stations downloaded in parallel (default: 1, sequential download)",
+    )
+
+    parser.add_argument(
+        "--max-connections-per-host",
+        type=int,
+        dest="max_connections_per_host",
+        default=None,
+        help="maximum number of parallel requests against the logstar host (default: number of download workers)",
+    )
+
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        dest="max_retries",
+        default=5,
+        help="number of retries for failed requests against the logstar server (default: 5)",
+    )
+
+    parser.add_argument(
+        "--backoff-factor",
+        type=float,
+        dest="backoff_factor",
+        default=1.0,
+        help="base delay in seconds between retries, doubled with every retry (default: 1.0)",
+    )
+
+    parser.add_argument(
+        "--stream-decode",
+        dest="stream_decode",
+        action="store_true",
+        help="decode responses while downloading straight into typed columns, lowers peak memory for large downloads. In ongoing mode responses are buffered and only decoded if they changed since the last poll, see --no-skip-unchanged",
+    )
+
+    parser.add_argument(
+        "--float-dtype",
+        dest="float_dtype",
+        choices=["float64", "float32"],
+        default="float64",
+        help="dtype of measurement columns (default: float64)",
+    )
+
+    parser.add_argument(
+        "--json-decoder",
+        dest="json_decoder",
+        choices=["auto", "builtin", "ijson"],
+        default="auto",
+        help="json decoder used with --stream-decode, auto uses ijson if installed (default: auto)",
+    )
+
     parser.add_argument(
         "--rename-datetime-column",
         type=str,
@@ -107,6 +269,44 @@ def main():
         help="change name of the Datetime column in the csv files or database tables",
     )
 
+    parser.add_argument(
+        "--pipeline",
+        dest="pipeline",
+        action="store_true",
+        help="download, process and write stations concurrently in separate stages, busy and idle time of the stages is logged",
+    )
+
+    parser.add_argument(
+        "--pipeline-queue-size",
+        type=int,
+        dest="queue_size",
+        default=2,
+        help="number of stations buffered in between two pipeline stages (default: 2)",
+    )
+
+    parser.add_argument(
+        "--process-workers",
+        type=int,
+        dest="process_workers",
+        default=1,
+        help="number of processes running the processing steps of several stations at once, replaces --pipeline (default: 1, processing steps run in this process)",
+    )
+
+    parser.add_argument(
+        "--columns",
+        dest="columns",
+        nargs="+",
+        default=None,
+        help="columns (after sensor mapping and processing steps) kept in the output, only the channels needed for them are requested",
+    )
+
+    parser.add_argument(
+        "--project-channels",
+        dest="project_channels",
+        action="store_true",
+        help="request only the channels needed by the processing steps and the sensor mapping, e.g. with WhitelistFilterColumnsPS",
+    )
+
     # csv
     parser.add_argument(
         "-co",
@@ -118,6 +318,26 @@ def main():
         help="path to the folder where csv file are stored, if set",
     )
 
+    # raw data
+    parser.add_argument(
+        "--store-raw",
+        dest="store_raw",
+        action="store_true",
+        help="store the data before the processing steps run in raw tables and|or raw csv files, to reprocess it with logstar-reprocess.py",
+    )
+    parser.add_argument(
+        "--raw-table-prefix",
+        dest="raw_table_prefix",
+        default=RAW_TABLE_PREFIX,
+        help=f"prefix of the tables the raw data is stored in with --store-raw (default: {RAW_TABLE_PREFIX})",
+    )
+    parser.add_argument(
+        "--raw-csv-dir",
+        dest="raw_csv_folder",
+        default=None,
+        help="folder the raw csv files are stored in with --store-raw (default: <csv-outdir>/raw)",
+    )
+
     # plugins
     parser.add_argument(
         "-ps",
@@ -154,6 +374,14 @@ def main():
         help="Prefix set for tables in Database",
     )
 
+    parser.add_argument(
+        "--db-write-method",
+        dest="db_write_method",
+        choices=logstar.DB_WRITE_METHODS,
+        default="insert",
+        help="insert: multi row INSERT statements, copy: COPY into a staging table and a single INSERT ... SELECT, faster for large downloads (default: insert)",
+    )
+
     parser.add_argument(
         "-dbs",
         "--db_schema",
@@ -164,6 +392,38 @@ def main():
         help="Database schema",
     )
 
+    # instrumentation
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        dest="metrics_port",
+        default=None,
+        help="serve durations and counters per stage and station in the prometheus text format on this port, e.g. in ongoing mode",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        dest="metrics_json",
+        default=None,
+        help="write a json summary of durations and counters per stage and station to this file at the end of the run",
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        dest="profile",
+        default=None,
+        metavar="DIR",
+        help="profile every stage of every station with cProfile and tracemalloc, reports are written to DIR",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        dest="profile_top",
+        default=profiling.PROFILE_TOP_N,
+        help="number of functions and allocation sites listed in the profiling reports",
+    )
+
     # logging
     parser.add_argument(
         "-l",
@@ -228,7 +488,7 @@ def main():
         if os.path.exists(args.sensor_mapping):
             with open(args.sensor_mapping, "r") as jsonfile:
                 jsonfile_contents = jsonfile.read()
-                sensor_mapping = json.loads(jsonfile_contents)
+                sensor_mapping = compile_sensor_mapping(json.loads(jsonfile_contents))
             logging.info(f"Found sensor mapping json under: {args.sensor_mapping}")
         else:
             logging.warning(
@@ -255,11 +515,60 @@ def main():
         logging.info("found csv folder: %s ..." % args.csv_outfolder)
 
     processing_steps = None
-    # check and init processing steps
+    # check and init processing steps, the chain is validated and planned once
     if args.ps:
-        processing_steps = [
-            ps.load_class(ps_step_and_args) for ps_step_and_args in args.ps
-        ]
+        try:
+            processing_steps = planner.load_processing_steps(args.ps)
+        except ValueError as e:
+            logging.error(f"{e}, bye ...")
+            sys.exit(1)
+
+    # processing steps of several stations run in worker processes
+    process_pool = None
+    if processing_steps and args.process_workers > 1:
+        process_pool = ProcessingPool(processing_steps, args.process_workers)
+
+    if args.metrics_port is not None:
+        metrics_server = metrics.start_metrics_server(args.metrics_port)
+
+    # stages are profiled through the metrics registry
+    if args.profile:
+        metrics.get_metrics().profiler = profiling.StageProfiler(
+            args.profile, top_n=args.profile_top
+        )
+        if process_pool is not None:
+            logging.warning(
+                "the processing steps run in --process-workers worker processes and are not profiled, "
+                "use --process-workers 1 to profile them ..."
+            )
+
+    # point the receiver at another api, e.g. logstar-mock-server.py
+    if args.api_url:
+        logstar.LOGSTAR_API_URL = args.api_url.rstrip("/")
+    if logstar.LOGSTAR_API_URL != logstar.LOGSTAR_DEFAULT_API_URL:
+        logging.info(f"using logstar api at {logstar.LOGSTAR_API_URL} ...")
+
+    # shared http client with connection pool large enough for all download workers
+    client.configure_client(
+        max_retries=args.max_retries,
+        backoff_factor=args.backoff_factor,
+        pool_maxsize=max(10, args.download_workers, args.backfill_workers),
+    )
+
+    # only request the channels needed for the output, the first download of a station requests all
+    projection = None
+    if args.columns or args.project_channels:
+        projection = ChannelProjection(processing_steps, sensor_mapping, args.columns)
+
+    # arguments controlling how data is downloaded and decoded
+    download_args = {
+        "download_workers": args.download_workers,
+        "max_connections_per_host": args.max_connections_per_host,
+        "stream_decode": args.stream_decode,
+        "float_dtype": args.float_dtype,
+        "json_decoder": args.json_decoder,
+        "projection": projection,
+    }
 
     # set db schema
     db_schema = args.db_schema
@@ -267,6 +576,33 @@ def main():
     # set db table prefix
     db_table_prefix = args.db_table_prefix if args.db_table_prefix is not None else ""
 
+    # chunks of a longer period are processed like a single download, rows whose values may still
+    # change with the next chunk are held back. A single download does not need it, its stations are
+    # processed in the process pool at once.
+    chunked = (
+        not args.ongoing
+        and not args.backfill
+        and args.chunk_delta > 0
+        and calc_diff_days(conf["startdate"], conf["enddate"]) > args.chunk_delta
+    )
+    stream_state = None
+    if processing_steps and (args.ongoing or args.backfill or chunked):
+        state_dir = args.state_dir
+        if state_dir is None and args.backfill and args.checkpoint:
+            state_dir = args.checkpoint + ".state"
+        stream_state = StreamState(processing_steps, args.rename_datetime, state_dir)
+        if state_dir:
+            logging.info(f"storing the state of the processing steps in {state_dir} ...")
+
+    # arguments controlling how data is processed and written
+    write_args = {
+        "db_write_method": args.db_write_method,
+        "pipeline": args.pipeline,
+        "queue_size": args.queue_size,
+        "process_pool": process_pool,
+        "stream_state": stream_state,
+    }
+
     database_engine = None
     # skip database driver evaluation if -nodb set
     if not args.disable_database:
@@ -293,8 +629,40 @@ def main():
             else:
                 break
 
+    # mapped data is stored before the processing steps run, see logstar-reprocess.py
+    if args.store_raw:
+        if str(conf["datetime"]) != "0":
+            logging.warning(
+                "raw data with Date and Time columns (LOGSTAR_DAYTIME is not 0) can not be reprocessed by logstar-reprocess.py ..."
+            )
+        raw_csv_folder = args.raw_csv_folder
+        if raw_csv_folder is None and args.csv_outfolder is not None:
+            raw_csv_folder = os.path.join(args.csv_outfolder, "raw")
+        if database_engine is None and raw_csv_folder is None:
+            logging.error("--store-raw needs the database or a csv folder, bye ...")
+            sys.exit(1)
+        if projection is not None:
+            logging.warning(
+                "raw data only holds the channels requested for --columns or --project-channels ..."
+            )
+        write_args["raw_store"] = RawStore(
+            database_engine,
+            raw_csv_folder,
+            db_schema,
+            args.raw_table_prefix,
+            args.rename_datetime,
+            args.db_write_method,
+        )
+        if database_engine is not None:
+            logging.info(f"storing raw data in tables {args.raw_table_prefix}<station> ...")
+        if raw_csv_folder is not None:
+            logging.info(f"storing raw data in {raw_csv_folder} ...")
+
     # if ongoing is set logstar constantly looks for new data
     if args.ongoing:
+        if args.interval <= 0:
+            logging.error(f"--interval must be a positive number of minutes, got {args.interval}, bye ...")
+            sys.exit(1)
         interval = int(args.interval) * 60
         logging.info(
             "Running in continous mode mit with interval set to: {} seconds ...".format(
@@ -311,31 +679,134 @@ def main():
             "database_engine": database_engine,
             "processing_steps": processing_steps,
             "sensor_mapping": sensor_mapping,
+            "csv_folder": args.csv_outfolder,
             "db_schema": db_schema,
             "db_table_prefix": db_table_prefix,
             "timeout": args.timeout,
             "datetime_column": args.rename_datetime,
+            **download_args,
+            **write_args,
         }
 
+        # payloads which did not change since the last poll are not parsed, processed and written
+        fingerprints = None
+        if not args.no_skip_unchanged:
+            fingerprints = FingerprintCache()
+            manage_dl_db_args["fingerprints"] = fingerprints
+
         if args.ps_force:
             logging.warning(f'Processing Steps are forced to run in "ongoing" mode ...')
             manage_dl_db_args["processing_steps"] = processing_steps
-        try:
-            while True:
-                today = datetime.datetime.today()
-                yesterday = today - datetime.timedelta(days=1)
-                tomorrow = today + datetime.timedelta(days=1)
-                conf["startdate"] = yesterday.strftime("%Y-%m-%d")  # %H:%M:%S
-                conf["enddate"] = tomorrow.strftime("%Y-%m-%d")
-                logstar.manage_dl_db(**manage_dl_db_args)
-                logging.debug(f"sleeping {interval} seconds ...")
-                time.sleep(interval)
-        except KeyboardInterrupt:
-            logging.warning("interrupted, program is going to shutdown ...")
+
+        # last stored timestamp of every station, recovered from the database or the csv sidecar files
+        watermarks = ongoing.WatermarkStore(
+            database_engine,
+            db_schema,
+            db_table_prefix,
+            args.csv_outfolder,
+            args.rename_datetime,
+        )
+        if args.scheduler:
+            try:
+                intervals = scheduler.parse_station_intervals(
+                    args.station_intervals, conf["stationlist"], interval
+                )
+            except ValueError as e:
+                logging.error(f"{e}, bye ...")
+                sys.exit(1)
+
+            # processing steps are shared by all stations, the pool merges their state per station
+            process_lock = threading.Lock() if process_pool is None else None
+
+            def poll_station(station):
+                if args.no_watermark:
+                    today = datetime.datetime.today()
+                    station_conf = dict(
+                        conf,
+                        stationlist=[station],
+                        startdate=(today - datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+                        enddate=(today + datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+                    )
+                    lock = (
+                        process_lock
+                        if processing_steps and process_lock is not None
+                        else contextlib.nullcontext()
+                    )
+                    with lock:
+                        logstar.manage_dl_db(**dict(manage_dl_db_args, conf=station_conf))
+                else:
+                    ongoing.poll_station(
+                        station,
+                        watermarks=watermarks,
+                        chunk_delta=args.chunk_delta,
+                        lookback_days=args.lookback_days,
+                        process_lock=process_lock,
+                        **manage_dl_db_args,
+                    )
+                    for step in processing_steps or []:
+                        step.flush_change_log()
+                # other stations are polled at the same time, they report their own failures
+                logstar.report_failed_downloads(stations=[station])
+                if fingerprints is not None:
+                    logging.debug(f"{fingerprints} ...")
+
+            station_scheduler = scheduler.StationScheduler(
+                poll_station,
+                intervals,
+                jitter=args.jitter,
+                max_concurrent=args.max_concurrent_stations,
+            )
+            try:
+                station_scheduler.run()
+            except KeyboardInterrupt:
+                logging.warning("interrupted, program is going to shutdown ...")
+
+        else:
+            try:
+                while True:
+                    if args.no_watermark:
+                        today = datetime.datetime.today()
+                        yesterday = today - datetime.timedelta(days=1)
+                        tomorrow = today + datetime.timedelta(days=1)
+                        conf["startdate"] = yesterday.strftime("%Y-%m-%d")  # %H:%M:%S
+                        conf["enddate"] = tomorrow.strftime("%Y-%m-%d")
+                        logstar.manage_dl_db(**manage_dl_db_args)
+                    else:
+                        ongoing.run_ongoing_poll(
+                            watermarks=watermarks,
+                            chunk_delta=args.chunk_delta,
+                            lookback_days=args.lookback_days,
+                            **manage_dl_db_args,
+                        )
+                    logstar.report_failed_downloads()
+                    if fingerprints is not None:
+                        logging.info(f"{fingerprints} ...")
+                    logging.debug(f"sleeping {interval} seconds ...")
+                    time.sleep(interval)
+            except KeyboardInterrupt:
+                logging.warning("interrupted, program is going to shutdown ...")
+
+    elif args.backfill:
+        backfill.run_backfill(
+            conf,
+            args.chunk_delta,
+            checkpoint=args.checkpoint,
+            backfill_workers=args.backfill_workers,
+            database_engine=database_engine,
+            processing_steps=processing_steps,
+            sensor_mapping=sensor_mapping,
+            csv_folder=args.csv_outfolder,
+            db_schema=db_schema,
+            db_table_prefix=db_table_prefix,
+            timeout=args.timeout,
+            datetime_column=args.rename_datetime,
+            **download_args,
+            **write_args,
+        )
 
     else:
         # check if chunk delta is set and if the difference between start and end date is larger than chunk delta
-        if args.chunk_delta > 0 and calc_diff_days(conf["startdate"], conf["enddate"]) > args.chunk_delta:
+        if chunked:
             
             # iterate over sliding windowand run manage_dl_db for each chunk
             logging.info("Running in chunked mode with delta set to: {} days ...".format(args.chunk_delta))
@@ -353,6 +824,9 @@ def main():
                         db_table_prefix=db_table_prefix,
                         timeout=args.timeout,
                         datetime_column=args.rename_datetime,
+                        final=sliding_conf["enddate"] == conf["enddate"],
+                        **download_args,
+                        **write_args,
                     )
 
                 if sliding_conf["enddate"] == conf["enddate"]:
@@ -374,13 +848,33 @@ def main():
                 db_table_prefix=db_table_prefix,
                 timeout=args.timeout,
                 datetime_column=args.rename_datetime,
+                final=True,
+                **download_args,
+                **write_args,
             )
 
+    failed_downloads = logstar.report_failed_downloads()
+
+    if process_pool is not None:
+        process_pool.close()
+
+    metrics.get_metrics().log_summary()
+    if args.profile:
+        metrics.get_metrics().profiler.log_report()
+    if args.metrics_json:
+        metrics.get_metrics().write_json(args.metrics_json)
+        logging.info(f"metrics written to {args.metrics_json} ...")
+    if args.metrics_port is not None:
+        metrics_server.shutdown()
+
     if database_engine:
         logging.info("Closing database connection ...")
         database_engine.dispose()
     logging.info("bye bye ...")
 
+    if failed_downloads:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
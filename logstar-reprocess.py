@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import os
+import sys
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+
+import logstar_stream.logstar as logstar
+import logstar_stream.metrics as metrics
+import logstar_stream.planner as planner
+import logstar_stream.reprocess as reprocess
+
+DEFAULT_DB_SCHEMA = "public"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+    Runs the processing steps again on the raw data stored by logstar-receiver.py --store-raw, without
+    downloading it again, e.g. after tuning the thresholds of a processing step.
+
+    Raw data is streamed from the raw tables of the database (in windows of --chunk-delta days, read
+    with server side cursors) or from the raw csv files (--raw-csv-dir) and the processed data is
+    written to the database and|or csv files like logstar-receiver.py does. Rows already in the
+    database are updated (--db-write-method upsert). The database is configured with the LOGSTAR_DB_*
+    env vars of logstar-receiver.py.
+    """
+    )
+    parser.add_argument(
+        "--stations",
+        nargs="+",
+        default=None,
+        help="mapped names of the stations to reprocess, all stations with raw data if not set",
+    )
+    parser.add_argument(
+        "--startdate",
+        default=None,
+        help="first day to reprocess as %%Y-%%m-%%d, the processing steps start without state at this day (default: first raw row)",
+    )
+    parser.add_argument(
+        "--enddate",
+        default=None,
+        help="last day to reprocess as %%Y-%%m-%%d (default: last raw row)",
+    )
+    parser.add_argument(
+        "--raw-table-prefix",
+        dest="raw_table_prefix",
+        default=reprocess.RAW_TABLE_PREFIX,
+        help=f"prefix of the raw tables (default: {reprocess.RAW_TABLE_PREFIX})",
+    )
+    parser.add_argument(
+        "--raw-csv-dir",
+        dest="raw_csv_folder",
+        default=None,
+        help="read the raw data from the csv files in this folder instead of the database",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-delta",
+        type=int,
+        dest="chunk_delta",
+        default=reprocess.REPROCESS_CHUNK_DAYS,
+        help=f"days of raw data queried at once from the database (default: {reprocess.REPROCESS_CHUNK_DAYS})",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        dest="chunk_rows",
+        default=reprocess.REPROCESS_CHUNK_ROWS,
+        help=f"rows of raw data held in memory at once (default: {reprocess.REPROCESS_CHUNK_ROWS})",
+    )
+    parser.add_argument(
+        "--float-dtype",
+        dest="float_dtype",
+        choices=["float64", "float32"],
+        default="float64",
+        help="dtype of measurement columns (default: float64)",
+    )
+    parser.add_argument(
+        "--rename-datetime-column",
+        type=str,
+        dest="rename_datetime",
+        default="Datetime",
+        help="name of the Datetime column in the csv files or database tables",
+    )
+
+    # plugins
+    parser.add_argument(
+        "-ps",
+        "--processing-step",
+        dest="ps",
+        nargs="+",
+        action="append",
+        help="adds a processingstep to work on the raw data",
+    )
+
+    # output
+    parser.add_argument(
+        "-co",
+        "--csv-outdir",
+        type=str,
+        default=None,
+        dest="csv_outfolder",
+        help="path to the folder where csv file are stored, existing files of the reprocessed stations are replaced",
+    )
+    parser.add_argument(
+        "-nodb",
+        "--disable-database",
+        action="store_true",
+        dest="disable_database",
+        default=False,
+        help="do not write the reprocessed data to the database, needs --raw-csv-dir",
+    )
+    parser.add_argument(
+        "-dbtp",
+        "--db_table_prefix",
+        dest="db_table_prefix",
+        type=str,
+        default="",
+        help="Prefix set for tables in Database",
+    )
+    parser.add_argument(
+        "--db-write-method",
+        dest="db_write_method",
+        choices=logstar.DB_WRITE_METHODS,
+        default="upsert",
+        help="upsert: update rows already in the table, insert and copy: skip them (default: upsert)",
+    )
+    parser.add_argument(
+        "-dbs",
+        "--db_schema",
+        dest="db_schema",
+        default=DEFAULT_DB_SCHEMA,
+        type=str,
+        help="Database schema",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        dest="metrics_json",
+        default=None,
+        help="write a json summary of durations and counters per stage and station to this file at the end of the run",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Enable verbose logging"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(message)s",
+        level=logging.DEBUG if args.verbose else logging.INFO,
+    )
+
+    if args.disable_database and args.raw_csv_folder is None:
+        logging.error("raw data is read from the database, -nodb needs --raw-csv-dir, bye ...")
+        sys.exit(1)
+    if args.disable_database and args.csv_outfolder is None:
+        logging.error("neither database nor csv output set, bye ...")
+        sys.exit(1)
+    for folder in [args.raw_csv_folder, args.csv_outfolder]:
+        if folder is not None and not os.path.exists(folder):
+            logging.error(f"provided csv path: {folder} does not exist, bye ...")
+            sys.exit(1)
+
+    processing_steps = None
+    if args.ps:
+        try:
+            processing_steps = planner.load_processing_steps(args.ps)
+        except ValueError as e:
+            logging.error(f"{e}, bye ...")
+            sys.exit(1)
+
+    database_engine = None
+    if not args.disable_database:
+        database_engine = create_engine(
+            URL.create(
+                "postgresql",
+                username=os.environ.get("LOGSTAR_DB_USER", "postgres"),
+                password=os.environ.get("LOGSTAR_DB_PASS", "postgres"),
+                host=os.environ.get("LOGSTAR_DB_HOST", "localhost"),
+                port=os.environ.get("LOGSTAR_DB_PORT", "5432"),
+                database=os.environ.get("LOGSTAR_DB_DBNAME", "logstar"),
+            )
+        )
+
+    try:
+        written = reprocess.run_reprocess(
+            processing_steps,
+            stations=args.stations,
+            raw_database_engine=database_engine,
+            raw_csv_folder=args.raw_csv_folder,
+            raw_table_prefix=args.raw_table_prefix,
+            database_engine=database_engine,
+            csv_folder=args.csv_outfolder,
+            db_schema=args.db_schema,
+            db_table_prefix=args.db_table_prefix,
+            datetime_column=args.rename_datetime,
+            startdate=args.startdate,
+            enddate=args.enddate,
+            chunk_delta=args.chunk_delta,
+            chunk_rows=args.chunk_rows,
+            float_dtype=args.float_dtype,
+            db_write_method=args.db_write_method,
+        )
+    except ValueError as e:
+        logging.error(f"{e}, bye ...")
+        sys.exit(1)
+
+    logging.info(
+        f"reprocessed {sum(written.values())} rows of {len(written)} stations ..."
+    )
+    metrics.get_metrics().log_summary()
+    if args.metrics_json:
+        metrics.get_metrics().write_json(args.metrics_json)
+        logging.info(f"metrics written to {args.metrics_json} ...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import logstar_stream.logstar as logstar
+
+DATE_FORMAT = "%Y-%m-%d"
+
+# a single download of a station, startdate and enddate as used in conf
+WorkItem = namedtuple("WorkItem", ["station", "startdate", "enddate"])
+
+
+def plan_windows(startdate, enddate, chunk_delta):
+    """
+    splits startdate to enddate into windows of chunk_delta days, like the chunked mode of logstar-receiver
+
+    :param startdate: first day, as %Y-%m-%d
+    :param enddate: last day, as %Y-%m-%d
+    :param chunk_delta: days per window, 0 for a single window
+    :return: list of (startdate, enddate) tuples
+    """
+    start = datetime.datetime.strptime(startdate, DATE_FORMAT).date()
+    end = datetime.datetime.strptime(enddate, DATE_FORMAT).date()
+    if chunk_delta <= 0:
+        return [(startdate, enddate)]
+
+    windows = []
+    while True:
+        window_end = min(start + datetime.timedelta(days=chunk_delta), end)
+        windows.append((start.strftime(DATE_FORMAT), window_end.strftime(DATE_FORMAT)))
+        if window_end >= end:
+            return windows
+        start = window_end + datetime.timedelta(days=1)
+
+
+def plan_backfill(stations, startdate, enddate, chunk_delta):
+    """returns all work items of a backfill, windows of a station are in chronological order"""
+    windows = plan_windows(startdate, enddate, chunk_delta)
+    return [WorkItem(station, start, end) for station in stations for start, end in windows]
+
+
+class Checkpoint(object):
+    """
+    Completed work items of a backfill, stored as json lines.
+
+    Every completed item is appended and flushed right away, so an interrupted backfill loses at
+    most the items in flight. An incomplete last line, e.g. from a killed process, is ignored when
+    the checkpoint is loaded.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: json lines file, the checkpoint is only kept in memory if None
+        """
+        self.path = path
+        self.completed = set()
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        self.completed.add(WorkItem(*json.loads(line)))
+                    except (ValueError, TypeError):
+                        logging.warning(f"ignoring invalid checkpoint entry in {path}: {line!r}")
+            logging.info(f"loaded {len(self.completed)} completed items from checkpoint {path} ...")
+
+    def is_done(self, item):
+        with self._lock:
+            return item in self.completed
+
+    def mark_done(self, item):
+        with self._lock:
+            self.completed.add(item)
+            if self.path is None:
+                return
+            with open(self.path, "a") as f:
+                f.write(json.dumps(list(item)) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def run_backfill(
+    conf,
+    chunk_delta,
+    checkpoint=None,
+    backfill_workers=1,
+    database_engine=None,
+    processing_steps=None,
+    sensor_mapping=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix=None,
+    datetime_column="Datetime",
+    timeout=15,
+    stream_decode=False,
+    float_dtype="float64",
+    json_decoder="auto",
+    db_write_method="insert",
+    projection=None,
+    process_pool=None,
+    stream_state=None,
+    raw_store=None,
+    **kwargs,
+):
+    """
+    Downloads conf["startdate"] to conf["enddate"] of all stations in windows of chunk_delta days.
+
+    All (station, window) items are planned up front. Stations are backfilled in parallel by
+    backfill_workers threads, the windows of a station are downloaded, processed and written in
+    chronological order, so processing steps keep their state between windows. Processing steps
+    run one station at a time, with a process_pool the stations are processed in its workers at once. Completed items are stored in the checkpoint and skipped when the
+    backfill is run again. If the download of a window fails, the later windows of the station are
+    postponed, so the data of a station has no holes and the next run resumes at the failed window.
+
+    Args:
+        conf (dict): configuration as for logstar.manage_dl_db.
+        chunk_delta (int): days per window, 0 downloads the whole range at once.
+        checkpoint (str, optional): path of the checkpoint file, no checkpoint is persisted if None.
+        backfill_workers (int): number of stations backfilled in parallel.
+        process_pool (parallel.ProcessingPool, optional): runs the processing steps in worker processes.
+        stream_state (streaming.StreamState, optional): processes the windows of a station like a single
+            download, store it in a directory to resume a backfill with a checkpoint.
+        raw_store (reprocess.RawStore, optional): stores the mapped data before the processing steps.
+        **kwargs: remaining arguments as for logstar.manage_dl_db.
+
+    Returns:
+        dict: number of "completed", "skipped" (already in the checkpoint), "failed" and "postponed"
+            (after a failed window of the station) items
+    """
+    checkpoint = Checkpoint(checkpoint)
+    items = plan_backfill(conf["stationlist"], conf["startdate"], conf["enddate"], chunk_delta)
+    pending = [item for item in items if not checkpoint.is_done(item)]
+    logging.info(
+        f"backfill of {len(items)} items, {len(items) - len(pending)} already completed, using {backfill_workers} workers ..."
+    )
+
+    stations = {}
+    for item in pending:
+        stations.setdefault(item.station, []).append(item)
+
+    counts = {
+        "completed": 0,
+        "skipped": len(items) - len(pending),
+        "failed": 0,
+        "postponed": 0,
+    }
+    counts_lock = threading.Lock()
+    # processing steps keep state and changelogs per instance, the pool merges them per station
+    process_lock = threading.Lock() if process_pool is None else contextlib.nullcontext()
+    # set if a station failed with an exception, the other stations stop after their current item
+    stop = threading.Event()
+
+    def backfill_station(station_items):
+        for i, item in enumerate(station_items):
+            if stop.is_set():
+                return
+            item_conf = dict(conf, startdate=item.startdate, enddate=item.enddate)
+            logging.info(
+                f"downloading data for station {item.station} from {item.startdate} to {item.enddate} ..."
+            )
+            data = logstar.download_data(
+                item_conf,
+                item.station,
+                timeout,
+                stream=stream_decode,
+                float_dtype=float_dtype,
+                json_decoder=json_decoder,
+                projection=projection,
+            )
+
+            # something went wrong while downloading the data, retried by the next run. Later windows
+            # would leave a hole and carry the state of the processing steps across it
+            if data is None or ("data" not in data and "columns" not in data):
+                logging.error(f"could not download data for station {item.station}\n {data}")
+                postponed = len(station_items) - i - 1
+                if postponed:
+                    logging.warning(
+                        f"postponing {postponed} later windows of station {item.station} to the next run ..."
+                    )
+                with counts_lock:
+                    counts["failed"] += 1
+                    counts["postponed"] += postponed
+                return
+
+            with process_lock:
+                name, df = logstar.process_station(
+                    item.station,
+                    data,
+                    processing_steps,
+                    sensor_mapping,
+                    datetime_column,
+                    float_dtype,
+                    projection=projection,
+                    process_pool=process_pool,
+                    stream_state=stream_state,
+                    final=item.enddate == conf["enddate"],
+                    raw_store=raw_store,
+                )
+
+            if df is None or df.empty:
+                logging.warning(f"empty dataframe for station {name}")
+            else:
+                logstar.write_station(
+                    name,
+                    df,
+                    database_engine,
+                    csv_folder,
+                    db_schema,
+                    db_table_prefix,
+                    datetime_column,
+                    db_write_method,
+                )
+
+            checkpoint.mark_done(item)
+            with counts_lock:
+                counts["completed"] += 1
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, backfill_workers), thread_name_prefix="logstar-backfill"
+    ) as executor:
+        futures = [
+            executor.submit(backfill_station, station_items)
+            for station_items in stations.values()
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            stop.set()
+            raise
+
+    # changelogs of the processing steps are written once per run
+    for step in processing_steps or []:
+        step.flush_change_log()
+
+    logging.info(
+        "backfill finished, {completed} items completed, {skipped} skipped, {failed} failed, {postponed} postponed ...".format(
+            **counts
+        )
+    )
+    return counts
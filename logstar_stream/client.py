@@ -0,0 +1,209 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# status codes which are worth another try, everything else except 200 fails immediately
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# status codes for which the server may tell us how long to wait
+RETRY_AFTER_STATUS_CODES = (429, 503)
+
+DownloadFailure = namedtuple(
+    "DownloadFailure", ["station", "startdate", "enddate", "error"]
+)
+
+
+class LogstarRequestError(Exception):
+    """raised if a request to logstar-online failed after all retries"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LogstarClient(object):
+    """
+    shared http client for logstar-online
+
+    Keeps a pooled keep-alive session, negotiates gzip, retries failed requests with exponential
+    backoff and jitter and collects failed station downloads, so a single failing station does not
+    stop the whole run.
+    """
+
+    def __init__(
+        self, max_retries=5, backoff_factor=1.0, backoff_max=60.0, pool_maxsize=10
+    ):
+        """
+        Args:
+            max_retries (int): number of retries after the first attempt.
+            backoff_factor (float): base delay in seconds, doubled with every retry.
+            backoff_max (float): upper limit for a single delay in seconds.
+            pool_maxsize (int): number of keep-alive connections kept per host.
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        # retries are handled in get to honour Retry-After and to log each attempt
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+        self.failures = []
+        self._failures_lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """full jitter delay for the given retry attempt, starting with 0"""
+        cap = min(self.backoff_max, self.backoff_factor * 2**attempt)
+        return random.uniform(0, cap)
+
+    @staticmethod
+    def retry_after(response):
+        """
+        Reads the Retry-After header of the response.
+
+        Returns:
+            float or None: seconds to wait or None if the header is missing or invalid.
+        """
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_date.tzinfo is None:
+            retry_date = retry_date.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+    def get(self, url, timeout=15, stream=False):
+        """
+        GET the given url, retrying connection errors, timeouts and RETRY_STATUS_CODES.
+
+        Args:
+            url (str): The URL to request data from.
+            timeout (int): timeout in seconds to wait for the server.
+            stream (bool): do not read the response body in advance.
+
+        Returns:
+            requests.Response: the successful response.
+
+        Raises:
+            LogstarRequestError: If the request did not succeed after all retries.
+        """
+        attempt = 0
+        while True:
+            try:
+                r = self.session.get(url, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as E:
+                if attempt >= self.max_retries:
+                    raise LogstarRequestError(f"Request error {E}") from E
+                delay = self.backoff(attempt)
+                logging.warning(
+                    f"Request error {type(E).__name__}, retry {attempt + 1}/{self.max_retries} in {delay:.1f} seconds ..."
+                )
+            else:
+                if r.status_code == 200:
+                    return r
+
+                r.close()
+                if (
+                    r.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.max_retries
+                ):
+                    raise LogstarRequestError(
+                        "Request error {}".format(r.status_code), r.status_code
+                    )
+
+                delay = None
+                if r.status_code in RETRY_AFTER_STATUS_CODES:
+                    delay = self.retry_after(r)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                else:
+                    delay = min(delay, self.backoff_max)
+                logging.warning(
+                    f"Request error {r.status_code}, retry {attempt + 1}/{self.max_retries} in {delay:.1f} seconds ..."
+                )
+            time.sleep(delay)
+            attempt += 1
+
+    def record_failure(self, station, startdate, enddate, error):
+        """remember a failed download to report it at the end of the run"""
+        with self._failures_lock:
+            self.failures.append(
+                DownloadFailure(station, startdate, enddate, str(error))
+            )
+
+    def has_failed(self, station, startdate, enddate):
+        """check if the download for station and time window failed in this run"""
+        with self._failures_lock:
+            return any(
+                (f.station, f.startdate, f.enddate) == (station, startdate, enddate)
+                for f in self.failures
+            )
+
+    def report_failures(self, clear=True, stations=None):
+        """
+        Logs all failed downloads collected so far.
+
+        Args:
+            clear (bool): forget the reported failures.
+            stations (list, optional): only report the failures of these stations, others are kept.
+
+        Returns:
+            list: the reported DownloadFailure entries.
+        """
+        with self._failures_lock:
+            if stations is None:
+                failures = list(self.failures)
+            else:
+                failures = [f for f in self.failures if f.station in stations]
+            if clear:
+                self.failures = [f for f in self.failures if f not in failures]
+
+        if failures:
+            logging.error(f"{len(failures)} download(s) failed:")
+            for f in failures:
+                logging.error(
+                    f"\t{f.station} from {f.startdate} to {f.enddate}: {f.error}"
+                )
+        return failures
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def configure_client(**kwargs):
+    """replaces the shared client with a new one created with the given LogstarClient arguments"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = LogstarClient(**kwargs)
+    return _client
+
+
+def get_client():
+    """returns the shared client, creating one with default settings if needed"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LogstarClient()
+        return _client
@@ -0,0 +1,428 @@
+import array
+import codecs
+import json
+import logging
+import re
+
+import numpy as np
+
+try:
+    import ijson
+except ImportError:  # optional faster decoder
+    ijson = None
+
+# hashes are comming from UP as no-value
+NO_VALUE = "#"
+
+# rows converted at once into the typed column buffers
+BATCH_SIZE = 4096
+
+# bytes read at once from the response
+CHUNK_SIZE = 64 * 1024
+
+FLOAT_TYPECODES = {"float64": "d", "float32": "f"}
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def to_float_array(values, float_dtype="float64"):
+    """
+    converts a list of raw logstar values into a float array, no-values (# or null) become NaN
+
+    :param values: list of str, int or float values
+    :param float_dtype: numpy float dtype of the result
+    :raise ValueError: if a value is not numeric
+    """
+    values = np.array(values, dtype=object)
+    values[values == NO_VALUE] = np.nan
+    return values.astype(float_dtype)
+
+
+def is_integer_column(values, converted):
+    """
+    True if pd.to_numeric would return the raw values as integers: ints or integer strings, no no-values
+
+    :param values: list of raw logstar values
+    :param converted: the values as returned by to_float_array
+    """
+    if np.isnan(converted).any() or not np.array_equal(converted, np.trunc(converted)):
+        return False
+    for value in values:
+        if type(value) is int:
+            continue
+        if type(value) is str and value.strip().lstrip("+-").isdigit():
+            continue
+        return False
+    return True
+
+
+class ColumnarBuilder(object):
+    """
+    Collects logstar rows into one typed buffer per column.
+
+    Rows are buffered for BATCH_SIZE rows and then converted column wise. Columns start out as
+    float columns, the first value which is not numeric turns the column into a plain list of
+    values (e.g. the Datetime column). Columns of integers without no-values are returned as int64,
+    like pd.to_numeric does. The result of finish holds the same information as the json response,
+    with "columns" instead of "data".
+    """
+
+    def __init__(self, float_dtype="float64", batch_size=BATCH_SIZE):
+        if float_dtype not in FLOAT_TYPECODES:
+            raise ValueError(f"unsupported float dtype {float_dtype}")
+        self.float_dtype = float_dtype
+        self.typecode = FLOAT_TYPECODES[float_dtype]
+        self.batch_size = batch_size
+
+        self.fields = {}
+        self.columns = {}
+        # column key -> all values so far are integers, see is_integer_column
+        self.integer = {}
+        self.rows = 0
+        self._keys = None
+        self._batch = {}
+        self._batch_rows = 0
+
+    def set_field(self, key, value):
+        """stores top level fields of the response like the header"""
+        self.fields[key] = value
+
+    def _add_column(self, key):
+        """adds a column which shows up after the first rows, previous rows get no-value"""
+        self.columns[key] = array.array(self.typecode, [np.nan] * self.rows)
+        self._batch[key] = [NO_VALUE] * self._batch_rows
+        self.integer[key] = not self.rows and not self._batch_rows
+
+    def add_row(self, row):
+        """
+        adds a single row of the data array
+
+        :param row: dict of column key -> value, or list of values keyed by position
+        """
+        if isinstance(row, list):
+            row = dict(zip(map(str, range(len(row))), row))
+
+        keys = row.keys()
+        if keys != self._keys:
+            for key in keys:
+                if key not in self._batch:
+                    self._add_column(key)
+            for key in self._batch.keys() - keys:
+                self._batch[key].append(NO_VALUE)
+            self._keys = keys
+            if len(keys) != len(self._batch):
+                # some columns are missing in this row, do not compare against its keys again
+                self._keys = None
+
+        for key, value in row.items():
+            self._batch[key].append(value)
+
+        self._batch_rows += 1
+        if self._batch_rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """converts the buffered rows into the typed column buffers"""
+        if not self._batch_rows:
+            return
+        for key, values in self._batch.items():
+            column = self.columns[key]
+            if isinstance(column, array.array):
+                try:
+                    converted = to_float_array(values, self.float_dtype)
+                    column.frombytes(converted.tobytes())
+                    if self.integer[key]:
+                        self.integer[key] = is_integer_column(values, converted)
+                except (ValueError, TypeError):
+                    # not numeric, keep the raw values
+                    column = self.columns[key] = column.tolist()
+                    self.integer[key] = False
+            if isinstance(column, list):
+                column.extend(values)
+            self._batch[key] = []
+        self.rows += self._batch_rows
+        self._batch_rows = 0
+
+    def finish(self):
+        """
+        returns the decoded response as {"header": ..., "columns": {key: values}}
+
+        float columns are returned as numpy arrays sharing memory with the buffers
+        """
+        self.flush()
+        columns = {}
+        for key, column in self.columns.items():
+            if isinstance(column, array.array):
+                column = np.frombuffer(column, dtype=self.float_dtype)
+                if self.integer[key] and len(column):
+                    column = column.astype(np.int64)
+            columns[key] = column
+        result = dict(self.fields)
+        result["columns"] = columns
+        return result
+
+
+def rows_to_columns(rows, float_dtype="float64", batch_size=BATCH_SIZE):
+    """
+    Converts the rows of a decoded logstar response into typed columns in a single pass.
+
+    The rows are converted in batches of batch_size rows straight into preallocated column arrays,
+    no-values (#) become NaN on the way. Columns which are not numeric (e.g. Datetime) are returned
+    as lists of the raw values, columns of integers without no-values as int64 arrays.
+
+    Args:
+        rows (list): data array of the response, all rows are dicts with the same keys or lists.
+        float_dtype (str): "float64" or "float32" for the measurement columns.
+        batch_size (int): number of rows converted at once.
+
+    Returns:
+        dict: column key -> numpy array or list, like ColumnarBuilder.finish()["columns"]
+    """
+    if not rows:
+        return {}
+    first = rows[0]
+    if isinstance(first, list):
+        keys = list(range(len(first)))
+    else:
+        keys = list(first)
+
+    # rows with missing or additional columns need the slower row wise builder
+    if any(len(row) != len(keys) for row in rows):
+        builder = ColumnarBuilder(float_dtype=float_dtype, batch_size=batch_size)
+        for row in rows:
+            builder.add_row(row)
+        return builder.finish()["columns"]
+
+    n = len(rows)
+    columns = {key: np.empty(n, dtype=float_dtype) for key in keys}
+    integer = dict.fromkeys(keys, True)
+    for start in range(0, n, batch_size):
+        batch = rows[start : start + batch_size]
+        for key in keys:
+            values = [row[key] for row in batch]
+            column = columns[key]
+            if isinstance(column, np.ndarray):
+                try:
+                    converted = to_float_array(values, float_dtype)
+                    column[start : start + len(values)] = converted
+                    if integer[key]:
+                        integer[key] = is_integer_column(values, converted)
+                    continue
+                except (ValueError, TypeError):
+                    # not numeric, keep the raw values
+                    column = columns[key] = column[:start].tolist()
+                    integer[key] = False
+            column.extend(values)
+
+    for key, column in columns.items():
+        if integer[key]:
+            columns[key] = column.astype(np.int64)
+
+    if isinstance(first, list):
+        return {str(key): column for key, column in columns.items()}
+    return columns
+
+
+class BuiltinStreamDecoder(object):
+    """
+    incremental decoder for logstar responses based on the json module
+
+    Only the top level object is parsed by hand, every row of the data array is decoded on its own
+    with json.JSONDecoder.raw_decode, so only the current chunk and a single row are kept as text.
+    """
+
+    name = "builtin"
+
+    def __init__(self):
+        self._json = json.JSONDecoder()
+
+    def decode(self, chunks, builder):
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+        self._expect("{")
+        self._skip_whitespace()
+        if self._peek() == "}":
+            return builder
+        while True:
+            key = self._value()
+            self._expect(":")
+            self._skip_whitespace()
+            if key == "data" and self._peek() == "[":
+                self._pos += 1
+                self._rows(builder)
+            else:
+                builder.set_field(key, self._value())
+            self._skip_whitespace()
+            delimiter = self._next_char()
+            if delimiter == "}":
+                return builder
+            if delimiter != ",":
+                raise ValueError(f"invalid logstar response, unexpected {delimiter!r}")
+            self._skip_whitespace()
+
+    def _rows(self, builder):
+        self._skip_whitespace()
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            builder.add_row(self._value())
+            self._skip_whitespace()
+            delimiter = self._next_char()
+            if delimiter == "]":
+                return
+            if delimiter != ",":
+                raise ValueError(f"invalid logstar response, unexpected {delimiter!r}")
+
+    def _read_more(self):
+        """appends the next chunk to the buffer and drops the parsed part, returns False at the end"""
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._text.decode(b"", final=True)
+        else:
+            text = self._text.decode(chunk)
+        self._buf = self._buf[self._pos :] + text
+        self._pos = 0
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf) or not self._read_more():
+                return
+
+    def _peek(self):
+        self._skip_whitespace()
+        if self._pos >= len(self._buf):
+            raise ValueError("invalid logstar response, unexpected end of data")
+        return self._buf[self._pos]
+
+    def _next_char(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, char):
+        found = self._next_char()
+        if found != char:
+            raise ValueError(
+                f"invalid logstar response, expected {char!r} but found {found!r}"
+            )
+
+    def _value(self):
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self._buf) and self._read_more():
+                continue
+            self._pos = end
+            return value
+
+
+class _ChunkReader(object):
+    """file like wrapper around an iterator of byte chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size < 0:
+            size = len(self._buf)
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+
+class IjsonStreamDecoder(object):
+    """incremental decoder for logstar responses based on ijson (uses the yajl2 C backend if installed)"""
+
+    name = "ijson"
+
+    def decode(self, chunks, builder):
+        header = None
+        header_key = None
+        row = None
+        row_key = None
+        for prefix, event, value in ijson.parse(_ChunkReader(chunks), use_float=True):
+            if prefix == "data.item":
+                if event == "start_map":
+                    row = {}
+                elif event == "start_array":
+                    row = []
+                elif event == "map_key":
+                    row_key = value
+                elif event in ("end_map", "end_array"):
+                    builder.add_row(row)
+                    row = None
+            elif row is not None:
+                if isinstance(row, list):
+                    row.append(value)
+                else:
+                    row[row_key] = value
+            elif prefix == "header":
+                if event == "start_map":
+                    header = {}
+                elif event == "map_key":
+                    header_key = value
+                elif event == "end_map":
+                    builder.set_field("header", header)
+            elif header is not None and prefix.startswith("header."):
+                header[header_key] = value
+        return builder
+
+
+DECODERS = {
+    BuiltinStreamDecoder.name: BuiltinStreamDecoder,
+    IjsonStreamDecoder.name: IjsonStreamDecoder,
+}
+
+
+def get_decoder(name="auto"):
+    """
+    returns a stream decoder instance
+
+    :param name: "builtin", "ijson" or "auto" to use ijson if it is installed
+    """
+    if name == "auto":
+        name = IjsonStreamDecoder.name if ijson is not None else BuiltinStreamDecoder.name
+    if name not in DECODERS:
+        raise ValueError(f"unknown json decoder {name}, use one of {list(DECODERS)}")
+    if name == IjsonStreamDecoder.name and ijson is None:
+        logging.warning("ijson is not installed, falling back to builtin json decoder ...")
+        name = BuiltinStreamDecoder.name
+    return DECODERS[name]()
+
+
+def decode_stream(chunks, float_dtype="float64", decoder="auto"):
+    """
+    Decodes a logstar response from an iterator of byte chunks straight into typed columns.
+
+    Args:
+        chunks (iterable): byte chunks of the response body, e.g. response.iter_content().
+        float_dtype (str): "float64" or "float32" for the measurement columns.
+        decoder (str): name of the json decoder, see get_decoder.
+
+    Returns:
+        dict: {"header": ..., "columns": {key: numpy array or list}}
+    """
+    builder = ColumnarBuilder(float_dtype=float_dtype)
+    get_decoder(decoder).decode(chunks, builder)
+    return builder.finish()
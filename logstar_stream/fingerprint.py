@@ -0,0 +1,51 @@
+import hashlib
+import threading
+
+# returned by logstar.download_data instead of the data if the payload did not change since the last poll
+UNCHANGED = {"unchanged": True}
+
+
+def new_hash():
+    """hash object used for payload fingerprints"""
+    return hashlib.blake2b(digest_size=16)
+
+
+class FingerprintCache(object):
+    """
+    Fingerprints of the last stored payload per station and request window.
+
+    A payload is checked right after it is downloaded. If it is identical to the last payload which
+    was stored for the same station and window, parsing, processing steps and writing are skipped.
+    A new fingerprint only becomes the reference with commit, after the data was written, so a
+    payload which failed to be processed or written is not skipped by the next poll.
+    """
+
+    def __init__(self):
+        self._committed = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+
+    def unchanged(self, key, digest):
+        """
+        :param key: (station, startdate, enddate) of the request
+        :param digest: fingerprint of the payload
+        :return: True if the payload was already stored and can be skipped
+        """
+        with self._lock:
+            self.checked += 1
+            if self._committed.get(key) == digest:
+                self.skipped += 1
+                return True
+            self._pending[key] = digest
+            return False
+
+    def commit(self, key):
+        """marks the last checked payload of key as stored"""
+        with self._lock:
+            if key in self._pending:
+                self._committed[key] = self._pending.pop(key)
+
+    def __str__(self):
+        return f"{self.skipped} of {self.checked} payloads unchanged and skipped"
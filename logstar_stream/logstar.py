@@ -1,11 +1,18 @@
 import requests
-import re
 import logging
 import json
 import os
+import io
 import csv
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
+from urllib.parse import urlparse
+import numpy as np
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
 
 import sqlalchemy as sq
 
@@ -13,11 +20,48 @@ import sqlalchemy as sq
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.inspection import inspect
 
+import logstar_stream.metrics as metrics
+import logstar_stream.planner as planner
+from logstar_stream.client import get_client, LogstarRequestError
+from logstar_stream.fingerprint import UNCHANGED, new_hash
+from logstar_stream.projection import ALL_CHANNELS, CHANNEL_SEPARATOR
+from logstar_stream.sensor_mapping import (
+    FIELDS_TO_IGNORE,
+    SensorMapping,
+    compile_sensor_mapping,
+)
+from logstar_stream.decoder import (
+    CHUNK_SIZE,
+    decode_stream,
+    rows_to_columns,
+    to_float_array,
+)
+
 """
 	API DOCs
 	http://dokuwiki.weather-station-data.com/doku.php?id=:en:start
 """
-LOGSTAR_API_URL = "https://logstar-online.de/api"
+LOGSTAR_DEFAULT_API_URL = "https://logstar-online.de/api"
+# can be pointed at a local stand-in, see mock_api.MockLogstarServer
+LOGSTAR_API_URL = os.environ.get("LOGSTAR_API_URL", LOGSTAR_DEFAULT_API_URL)
+
+# format of the Datetime column if LOGSTAR_DAYTIME="0"
+LOGSTAR_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# station -> format of its Datetime column which worked last, see parse_datetime
+_datetime_formats = {}
+_datetime_formats_lock = threading.Lock()
+
+# insert: multi row INSERT statements through pandas to_sql, copy: COPY into a staging table,
+# upsert: like insert, but rows already in the table are updated, e.g. when reprocessing raw data
+DB_WRITE_METHODS = ["insert", "copy", "upsert"]
+
+# rows rendered at once into the csv stream for COPY
+COPY_CHUNK_ROWS = 65536
+
+# introspected database tables, see get_table_metadata
+TableMetadata = namedtuple("TableMetadata", ["exists", "primary_key", "columns"])
+_table_metadata = {}
+_table_metadata_lock = threading.Lock()
 
 
 # PostgreSQL interaction
@@ -46,6 +90,101 @@ def insert_or_do_nothing_on_conflict(table, conn, keys, data_iter):
     return result.rowcount
 
 
+def insert_or_update_on_conflict(table, conn, keys, data_iter):
+    """
+    Insert all records from data_iter into table. If a record already exists (as determined by the primary keys), its values are updated.
+
+    :param table: the sqlalchemy table to insert into
+    :type table: sqlalchemy.sql.schema.Table
+    :param conn: the sqlalchemy connection to use
+    :type conn: sqlalchemy.engine.Connection
+    :param keys: the keys to use for determining uniqueness
+    :type keys: List[str]
+    :param data_iter: the data to insert
+    :type data_iter: iterator over dictionaries
+    """
+    if keys[0] == "Date":
+        index_elements = [keys[0], keys[1]]
+    else:
+        index_elements = [keys[0]]
+
+    data = [dict(zip(keys, row)) for row in data_iter]
+    stmt = insert(table.table).values(data)
+    update = {k: stmt.excluded[k] for k in keys if k not in index_elements}
+    if update:
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=update)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    result = conn.execute(stmt)
+    return result.rowcount
+
+
+class _CsvStream(object):
+    """file like object rendering a dataframe as csv in chunks of rows, read by COPY"""
+
+    def __init__(self, df, chunk_rows=COPY_CHUNK_ROWS):
+        self._chunks = (
+            df.iloc[start : start + chunk_rows].to_csv(
+                header=False, index=False, na_rep=""
+            )
+            for start in range(0, len(df), chunk_rows)
+        )
+        self._buf = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size < 0:
+            size = len(self._buf)
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+
+def copy_and_insert_on_conflict(conn, df, table_name, schema=None):
+    """
+    Streams df with COPY into a temporary staging table and moves it into table_name with a single
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING. Only works for PostgreSQL with psycopg2.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): connection with an open transaction, the staging table
+            is dropped at its commit.
+        df (DataFrame): data to write, the columns must exist in table_name.
+        table_name (str): name of the target table.
+        schema (str, optional): schema of the target table.
+
+    Returns:
+        int: number of inserted rows, rows already in the table are skipped.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    target = quote(table_name) if schema is None else f"{quote(schema)}.{quote(table_name)}"
+    staging = quote("logstar_staging")
+    columns = ", ".join(quote(str(c)) for c in df.columns)
+
+    if df.columns[0] == "Date":
+        index_elements = ", ".join(quote(c) for c in df.columns[:2])
+    else:
+        index_elements = quote(df.columns[0])
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        cursor.copy_expert(
+            f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)", _CsvStream(df)
+        )
+        cursor.execute(
+            f"INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging} "
+            f"ON CONFLICT ({index_elements}) DO NOTHING"
+        )
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
 # ref: https://stackoverflow.com/questions/30867390/python-pandas-to-sql-how-to-create-a-table-with-a-primary-key
 def create_table(
     table_name,
@@ -98,10 +237,14 @@ def create_table(
     )
     table.create()
 
-def build_url(conf, station, channel=0):
+def build_url(conf, station, channel=ALL_CHANNELS):
     """build url to request from
     docs: https://logstar-online.de/api/{apiKey}/{Stationname}/{StartTag}/{EndTag}/{Channellist}/{DateTime}/{GeoData}
+
+    channel is a single channel id (0 for all channels) or a list of channel ids
     """
+    if isinstance(channel, (list, tuple)):
+        channel = CHANNEL_SEPARATOR.join(map(str, channel))
     apikey = conf["apikey"]
     startdate = conf["startdate"]
     enddate = conf["enddate"]
@@ -118,25 +261,19 @@ def do_station_name_mapping(station, mapping):
 
     :param station: The station to map.
     :type station: Any
-    :param mapping: The mapping to use.
-    :type mapping: dict
+    :param mapping: The mapping to use, compile it once with compile_sensor_mapping to avoid rebuilding the index.
+    :type mapping: dict or SensorMapping
     :return: The mapped key or the original station.
     :rtype: Any
     """
-    for key, value in mapping["sensor-mapping"].items():
-        if station in value["values"]:
-            return key
-    logging.debug("Mapping for sensor {} not found ...".format(station))
-    return station
+    mapping = compile_sensor_mapping(mapping)
+    if not mapping.find_sensor_mapping(station):
+        logging.debug("Mapping for sensor {} not found ...".format(station))
+    return mapping.station_name(station)
 
 
-FIELDS_TO_IGNORE = ["date", "time", "Datetime"]
-
 def __find_sensor_mapping__(sensor_name, mapping):
-    for key, value in mapping["sensor-mapping"].items():
-        if sensor_name in value["values"]:
-          return key
-    return False
+    return compile_sensor_mapping(mapping).find_sensor_mapping(sensor_name)
 
 def do_column_name_mapping(sensor_name, header, mapping):
     """
@@ -145,164 +282,313 @@ def do_column_name_mapping(sensor_name, header, mapping):
     Args:
         sensor_name (str): The name of the sensor.
         header (dict): The header dictionary containing column names as keys and column names as values.
-        mapping (dict): The mapping dictionary containing sensor mappings and measurement classes.
+        mapping (dict or SensorMapping): The mapping dictionary containing sensor mappings and measurement classes.
+            A SensorMapping memoizes the result per sensor and header.
 
     Returns:
         dict: A new header dictionary with mapped column names.
     """
-    mapping_name = __find_sensor_mapping__(sensor_name,mapping)
-    if not mapping_name:
-        logging.info(
-            "could not provide measurement mapping for sensor {}, not found ...".format(
-                sensor_name
-            )
-        )
-        return header
-
-    measurement_class_name = mapping["sensor-mapping"][mapping_name]["measurement-class"]
-    measurement_class = mapping["measurement-classes"][measurement_class_name]
-    if "regex" in measurement_class:
-        pattern = re.compile(measurement_class["regex"])
-
-        new_header = {}
-        for k, c_name_remote in header.items():
-            if c_name_remote in FIELDS_TO_IGNORE:
-                new_header[k] = c_name_remote
-                continue
-            for name, value in measurement_class["mapping"].items():
-                if value["abbreviation"] in c_name_remote:
-                    if (
-                        "only_includes_abbreviation" in value
-                        and value["only_includes_abbreviation"]
-                    ):
-                        new_header[k] = c_name = name
-                        continue
-
-                    r = pattern.match(c_name_remote)
-
-                    # c_name_remote can differ a lot, the design of this names is not properly choosen by UP GmbH
-                    # worst case is weather data which supports 3 different pattern:
-
-                    # case 1: "WS1_LT_3 - °C
-                    if r["number"] is not None:
-                        c_name = "{}_{}_{}_cm".format(
-                            name,
-                            measurement_class["position"][r["number"]]["side"],
-                            measurement_class["position"][r["number"]]["depth"],
-                        )
-                    # case 2 "WS1_WG_x - m/s"
-                    elif r["number"] is None and r["string"] is not None:
-                        c_name = "{}_{}".format(
-                            name,
-                            r["string"],
-                        )
-                    # case 3 "WS1_WR - grad"
-                    elif r["number"] is None and r["string"] is None:
-                        c_name = "{}".format(
-                            name,
-                        )
-                    new_header[k] = c_name
-        return new_header
-    return None
+    return compile_sensor_mapping(mapping).column_names(sensor_name, header)
 
 
 def request_data(url, timeout):
     """
-    Request data from a specified URL.
+    Request data from a specified URL using the shared logstar client.
 
     Args:
         url (str): The URL to request data from.
 
     Returns:
-        str or None: The response text if the request is successful, or None if there is an error.
+        str: The response text.
 
+    Raises:
+        LogstarRequestError: If the request did not succeed after all retries.
     """
     logging.debug("requesting {} ...".format(url))
-    r = requests.get(url, timeout=timeout)
+    r = get_client().get(url, timeout=timeout)
+    return r.text
 
-    if r.status_code == 200:
-        return r.text
-    else:
-        logging.error("Request error {}".format(r.status_code))
-        exit(1)
+
+def fingerprint_key(conf, station):
+    """key of a request in the FingerprintCache"""
+    return (station, conf["startdate"], conf["enddate"])
 
 
-def download_data(conf, station, timeout=15):
+def _observed_chunks(chunks, received, digest=None):
+    """passes the chunks through, counting their bytes in received[0] and hashing them into digest"""
+    for chunk in chunks:
+        received[0] += len(chunk)
+        if digest is not None:
+            digest.update(chunk)
+        yield chunk
+
+
+def _payload_rows(data):
+    if "data" in data:
+        return len(data["data"])
+    columns = data.get("columns")
+    return len(next(iter(columns.values()))) if columns else 0
+
+
+def download_data(
+    conf,
+    station,
+    timeout=15,
+    stream=False,
+    float_dtype="float64",
+    json_decoder="auto",
+    fingerprints=None,
+    projection=None,
+):
     """
     Downloads data from a given station.
 
+    Failed downloads do not stop the run, they are recorded on the shared client
+    and can be reported with report_failed_downloads.
+
     Args:
         conf (dict): The configuration settings for downloading the data.
         station (str): The name of the station to download data from.
+        stream (bool): decode the response while it is received straight into typed columns,
+            the result holds "columns" instead of "data".
+        float_dtype (str): "float64" or "float32", dtype of the measurement columns when streaming.
+        json_decoder (str): json decoder used when streaming, see decoder.get_decoder.
+        fingerprints (FingerprintCache, optional): if set, payloads identical to the last stored
+            payload of the same request are not parsed, the caller commits the fingerprint
+            with fingerprint_key(conf, station) after the data was written. When streaming, the
+            response is buffered and hashed before it is decoded.
+        projection (ChannelProjection, optional): if set, only the channels needed by the
+            projection are requested.
 
     Returns:
-        dict: The downloaded data as a dictionary, or None if the download fails.
+        dict: The downloaded data as a dictionary, fingerprint.UNCHANGED if the payload did not
+            change, or None if the download fails.
     """
-    url = build_url(conf, station=station)
+    channels = projection.channels(station) if projection is not None else ALL_CHANNELS
+    url = build_url(conf, station=station, channel=channels)
 
     try:
-        request = request_data(url, timeout=timeout)
-        return json.loads(request)
-    except:
+        with metrics.stage("download", station):
+            digest = new_hash() if fingerprints is not None else None
+            if stream:
+                logging.debug("requesting {} ...".format(url))
+                received = [0]
+                with get_client().get(url, timeout=timeout, stream=True) as r:
+                    chunks = _observed_chunks(
+                        r.iter_content(chunk_size=CHUNK_SIZE), received, digest
+                    )
+                    if digest is None:
+                        data = decode_stream(
+                            chunks, float_dtype=float_dtype, decoder=json_decoder
+                        )
+                    else:
+                        # the digest is known once the whole body is received, decoded below if it changed
+                        chunks = list(chunks)
+                metrics.inc("bytes_downloaded", received[0], station=station)
+            else:
+                request = request_data(url, timeout=timeout)
+                payload = request.encode("utf-8")
+                metrics.inc("bytes_downloaded", len(payload), station=station)
+                if digest is not None:
+                    digest.update(payload)
+
+            # parsing and everything after is skipped for payloads which are already stored
+            if fingerprints is not None and fingerprints.unchanged(
+                fingerprint_key(conf, station), digest.digest()
+            ):
+                metrics.inc("payloads_unchanged", station=station)
+                return UNCHANGED
+            if not stream:
+                data = json.loads(request)
+            elif digest is not None:
+                data = decode_stream(
+                    iter(chunks), float_dtype=float_dtype, decoder=json_decoder
+                )
+            metrics.inc("rows_downloaded", _payload_rows(data), station=station)
+
+        # the header of all channels is needed to resolve the channels of the next requests
+        if projection is not None and channels == ALL_CHANNELS and "header" in data:
+            projection.learn(station, data["header"])
+        return data
+    except (LogstarRequestError, requests.RequestException, ValueError) as E:
         logging.error(
-            f"Error when downloading data for station {station} using url {url}...\n"
+            f"Error when downloading data for station {station} using url {url}: {E}\n"
         )
-        exit(1)
-
-
-def prepare_dataframe(data: Dict, datetime_column: str) -> pd.DataFrame:
-    # build pandas df from data
-    df = pd.DataFrame(data["data"])
-    df = df.rename(columns=data["header"])
-
-    # depending on LOGSTAR_DAYTIME="0"
-    # making datetime occure in beginning
-    if "Datetime" in df.columns.tolist():
-        df.rename(columns={"Datetime": datetime_column}, inplace=True)
-        cols = df.columns.tolist()
-
-        # set datetime column astype datetime
-        df[datetime_column] = pd.to_datetime(df[datetime_column], errors="raise")
-
-        # force datetime column to be on first position
-        cols.insert(0, cols.pop(cols.index(datetime_column)))
-        df = df[cols]
-
-        cols.remove(datetime_column)
-
-    # may buggy
-    elif "Date" in cols and "Time" in cols:
-        # making date and time occure in beginning
-        cols.insert(0, cols.pop(cols.index("Date")))
-        cols.insert(0, cols.pop(cols.index("Time")))
-        cols = df.columns.tolist()
-        df = df[cols]
-
-        # clean cols for dtype optimization
-        cols.remove("Date")
-        cols.remove("Time")
-
-    # replace # to be Nan , hashes are comming from UP as no-value
-    df.replace("#", pd.NA, inplace=True)
-    # update col type to numeric after replacing # value
-    for col in cols:
-        df[col] = pd.to_numeric(df[col], errors="raise")
+        get_client().record_failure(station, conf["startdate"], conf["enddate"], E)
+        return None
+
+
+def report_failed_downloads(stations=None):
+    """
+    logs all station downloads which failed since the last report
+
+    :param stations: only report the failures of these stations, e.g. of a single poll
+    :return: list of DownloadFailure entries
+    """
+    return get_client().report_failures(stations=stations)
+
+
+def parse_datetime(values, station=None):
+    """
+    Converts logstar timestamps to datetime64.
+
+    Tries the format which worked last for the station (starting with LOGSTAR_DATETIME_FORMAT) and only
+    infers a new format from the first value if that fails. Formats are kept per station, so stations
+    parsed at the same time in other threads do not change each other's format.
+
+    :param values: list of timestamp strings
+    :param station: station the timestamps belong to
+    :return: DatetimeIndex
+    """
+    with _datetime_formats_lock:
+        datetime_format = _datetime_formats.get(station, LOGSTAR_DATETIME_FORMAT)
+    try:
+        return pd.to_datetime(values, format=datetime_format, errors="raise", cache=True)
+    except (ValueError, TypeError):
+        datetime_format = guess_datetime_format(values[0]) if len(values) else None
+        if datetime_format is None:
+            return pd.to_datetime(values, errors="raise", cache=True)
+        logging.debug(f"switching datetime format of station {station} to {datetime_format} ...")
+        parsed = pd.to_datetime(values, format=datetime_format, errors="raise", cache=True)
+        with _datetime_formats_lock:
+            _datetime_formats[station] = datetime_format
+        return parsed
+
+
+def prepare_dataframe(
+    data: Dict, datetime_column: str, float_dtype="float64", station=None
+) -> pd.DataFrame:
+    """
+    Builds a typed dataframe from downloaded data.
+
+    Measurement columns are converted to float with no-values (#) as NaN in a single pass, columns of
+    integers without no-values stay int64 like with pd.to_numeric. The Datetime column
+    (renamed to datetime_column) or Date and Time columns are moved to the front. Streamed responses
+    (see decoder.decode_stream) are already split into typed columns and are not copied.
+
+    Args:
+        data (dict): downloaded data with "header" and either "data" or "columns".
+        datetime_column (str): name of the datetime column.
+        float_dtype (str): "float64" or "float32", dtype of the measurement columns which are not integers.
+        station (str, optional): station the data belongs to, see parse_datetime.
+
+    Returns:
+        pd.DataFrame: The prepared dataframe.
+    """
+    if "columns" in data:
+        columns = data["columns"]
+    else:
+        columns = rows_to_columns(data["data"], float_dtype=float_dtype)
+
+    names = [data["header"].get(key, key) for key in columns]
+    values = list(columns.values())
+
+    # depending on LOGSTAR_DAYTIME="0" datetime or date and time occure in beginning
+    if "Datetime" in names:
+        front = [names.index("Datetime")]
+        names[front[0]] = datetime_column
+        values[front[0]] = parse_datetime(values[front[0]], station)
+    elif "Date" in names and "Time" in names:
+        front = [names.index("Date"), names.index("Time")]
+    else:
+        front = []
+    order = front + [i for i in range(len(names)) if i not in front]
+
+    for i in order[len(front) :]:
+        # columns which could not be converted while decoding, raises if they are not numeric
+        if not isinstance(values[i], np.ndarray):
+            values[i] = to_float_array(values[i], float_dtype)
+
+    df = pd.DataFrame({n: values[i] for n, i in enumerate(order)}, copy=False)
+    df.columns = [names[i] for i in order]
     return df
 
 
+def _table_metadata_key(conn, table_name, schema):
+    return (str(conn.engine.url), schema, table_name)
+
+
+def get_table_metadata(conn, table_name, schema=None):
+    """
+    Returns existence, primary key columns and columns of a table, introspected once per process.
+
+    Tables do not change while logstar stream runs, so the catalog is only queried for the first
+    write of a table. The entry has to be dropped with invalidate_table_metadata if the table is
+    created or altered.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): connection used if the table is not cached yet.
+        table_name (str): name of the table.
+        schema (str, optional): schema of the table.
+
+    Returns:
+        TableMetadata: exists, primary_key (list of column names), columns (column name -> sqlalchemy type)
+    """
+    key = _table_metadata_key(conn, table_name, schema)
+    with _table_metadata_lock:
+        if key in _table_metadata:
+            return _table_metadata[key]
+
+    inspector = inspect(conn)
+    if inspector.has_table(table_name=table_name, schema=schema):
+        primary_key = inspector.get_pk_constraint(
+            table_name=table_name, schema=schema
+        ).get("constrained_columns", [])
+        columns = {
+            column["name"]: column["type"]
+            for column in inspector.get_columns(table_name=table_name, schema=schema)
+        }
+        metadata = TableMetadata(True, primary_key, columns)
+    else:
+        metadata = TableMetadata(False, [], {})
+
+    with _table_metadata_lock:
+        _table_metadata[key] = metadata
+    return metadata
+
+
+def invalidate_table_metadata(conn=None, table_name=None, schema=None):
+    """drops the cached metadata of a table, or of all tables if conn is None"""
+    with _table_metadata_lock:
+        if conn is None:
+            _table_metadata.clear()
+        else:
+            _table_metadata.pop(_table_metadata_key(conn, table_name, schema), None)
+
+
 def write_to_database(
-    name, df, database_engine, db_schema, db_table_prefix, datetime_column, **kwargs
+    name,
+    df,
+    database_engine,
+    db_schema,
+    db_table_prefix,
+    datetime_column,
+    db_write_method="insert",
+    **kwargs,
 ):
-    table_name = db_table_prefix + name
-    with database_engine.begin() as conn:
-        has_table = inspect(conn).has_table(table_name=table_name, schema=db_schema)
-    
-    if not has_table:
-        logging.info(
-            f"creating database table {table_name} with primary key on {datetime_column} ..."
+    """
+    writes df into the table db_table_prefix + name, rows already in the table are skipped or updated
+
+    :param db_write_method: "insert" for multi row INSERT statements, "copy" for COPY into a staging table,
+        "upsert" for multi row INSERT statements updating rows already in the table
+    :return: number of inserted (and with upsert updated) rows
+    """
+    if db_write_method not in DB_WRITE_METHODS:
+        raise ValueError(
+            f"unknown db write method {db_write_method}, use one of {DB_WRITE_METHODS}"
         )
-        with database_engine.begin() as conn:
-            pandas_sql = pd.io.sql.pandasSQL_builder(conn, schema=db_schema)
+    table_name = db_table_prefix + name
+    num_rows = len(df)
+
+    # a single transaction per station write, the table metadata is cached across writes
+    with metrics.stage("write_database", name), database_engine.begin() as conn:
+        metadata = get_table_metadata(conn, table_name, db_schema)
+        pandas_sql = pd.io.sql.pandasSQL_builder(conn, schema=db_schema)
+
+        if not metadata.exists:
+            logging.info(
+                f"creating database table {table_name} with primary key on {datetime_column} ..."
+            )
             # create table with constrains
             create_table(
                 frame=df,
@@ -313,81 +599,168 @@ def write_to_database(
                 index_label=None,
                 keys=datetime_column,
             )
-    
-    else:
-        with database_engine.begin() as conn:
-            contrains = inspect(conn).get_pk_constraint(
-                table_name=table_name, schema=db_schema
-            )
-        if (
-            not "constrained_columns" in contrains
-            or datetime_column not in contrains["constrained_columns"]
-        ):
-            logging.warning(
-                f"Table {table_name} has no primary key set on {datetime_column} column, this can result in duplicated data in table  ..."
-            )
+            invalidate_table_metadata(conn, table_name, db_schema)
+
+        else:
+            missing_columns = [c for c in df.columns if c not in metadata.columns]
+            if missing_columns:
+                # table might have been altered since it was introspected
+                invalidate_table_metadata(conn, table_name, db_schema)
+                metadata = get_table_metadata(conn, table_name, db_schema)
+                missing_columns = [c for c in df.columns if c not in metadata.columns]
+                if missing_columns:
+                    logging.warning(
+                        f"Table {table_name} has no columns {missing_columns} ..."
+                    )
+
+            if datetime_column not in metadata.primary_key:
+                logging.warning(
+                    f"Table {table_name} has no primary key set on {datetime_column} column, this can result in duplicated data in table  ..."
+                )
 
-    to_sql_arugments = {
-        "name": table_name,
-        "con": database_engine,
-        "schema": db_schema,
-        "if_exists": "append",
-        "index": False,
-        "chunksize": 4096,
-        "method": insert_or_do_nothing_on_conflict
-    }
-
-    with database_engine.begin() as conn:
         try:
-            num_rows = len(df)
             logging.info(f"Attempting to insert {num_rows} rows into {table_name} ...")
-            df.to_sql(**to_sql_arugments)
-            logging.info(f"succesfully writing data ...")
+            if db_write_method == "copy":
+                inserted = copy_and_insert_on_conflict(conn, df, table_name, db_schema)
+            else:
+                # like df.to_sql, without introspecting the table again
+                table = pd.io.sql.SQLTable(
+                    table_name,
+                    pandas_sql,
+                    frame=df,
+                    index=False,
+                    if_exists="append",
+                    schema=db_schema,
+                )
+                inserted = table.insert(
+                    chunksize=4096,
+                    method=(
+                        insert_or_update_on_conflict
+                        if db_write_method == "upsert"
+                        else insert_or_do_nothing_on_conflict
+                    ),
+                )
+            if db_write_method == "upsert":
+                logging.info(
+                    f"succesfully writing data, {inserted} rows inserted or updated ..."
+                )
+            else:
+                logging.info(
+                    f"succesfully writing data, {inserted} rows inserted, {num_rows - inserted} rows already existed ..."
+                )
+            metrics.inc("rows_inserted", inserted, station=name)
+            metrics.inc("rows_skipped", num_rows - inserted, station=name)
         except Exception as E:
             logging.error(f"failed writing data: {str(E)[:200]}")  # Print first 200 chars of error
             exit(1)
+    return inserted
 
-def manage_dl_db(
+def iter_station_downloads(
     conf,
-    database_engine=None,
-    processing_steps: List = [],
-    sensor_mapping=None,
-    csv_folder=None,
-    db_schema=None,
-    db_table_prefix=None,
-    datetime_column="Datetime",
     timeout=15,
-    **kwargs,
+    download_workers=1,
+    max_connections_per_host=None,
+    **download_kwargs,
 ):
     """
-    main routine to download data and save it to database and|or csv
+    Downloads the data of all stations in conf["stationlist"] and yields them in the order of the station list.
 
-    :param conf
-    :param database_engine
-    :param processing_steps
-    :param sensor_mapping
-    :param csv_folder
-    :param db_schema
-    :param db_table_prefix
+    With download_workers > 1 the requests are issued from a bounded thread pool. At most download_workers
+    downloads are in flight, buffered or handed out to the caller at a time, the next download is only
+    started once the caller is done with a payload. So a slow consumer never holds more than that many
+    payloads in memory. max_connections_per_host additionally caps the parallel requests against a single host.
+
+    Args:
+        conf (dict): The configuration settings for downloading the data.
+        timeout (int): timeout in seconds to wait for logstar server.
+        download_workers (int): number of parallel downloads, 1 downloads sequentially.
+        max_connections_per_host (int, optional): maximum parallel requests per host. Defaults to download_workers.
+        **download_kwargs: additional arguments passed to download_data.
+
+    Yields:
+        tuple: (station, data) with data as returned by download_data.
     """
-    ret_data = {}
-    for station in conf["stationlist"]:
-        name = station
+    stations = conf["stationlist"]
 
-        # download data
+    def logged_download(station):
         logging.info(
             "downloading data for station {} from {} to {} ...".format(
-                name, conf["startdate"], conf["enddate"]
+                station, conf["startdate"], conf["enddate"]
             )
         )
-        data = download_data(conf, station, timeout)
-        # no new data or something went wrong while downloading the data
-        if data is None or "data" not in data:
-            logging.error(f"could not download data for station {name}\n {data}")
-            continue
+        return download_data(conf, station, timeout, **download_kwargs)
+
+    if download_workers is None or download_workers <= 1:
+        for station in stations:
+            yield station, logged_download(station)
+        return
+
+    # all stations are requested from the same api host, but keep the limit per host in case
+    # LOGSTAR_API_URL is changed in between runs
+    host_limit = max_connections_per_host or download_workers
+    host_semaphores = {}
+    host_semaphores_lock = threading.Lock()
+
+    def limited_download(station):
+        host = urlparse(build_url(conf, station)).netloc
+        with host_semaphores_lock:
+            semaphore = host_semaphores.setdefault(
+                host, threading.BoundedSemaphore(host_limit)
+            )
+        with semaphore:
+            return logged_download(station)
+
+    logging.debug(
+        f"downloading {len(stations)} stations with {download_workers} workers and at most {host_limit} connections per host ..."
+    )
+    with ThreadPoolExecutor(
+        max_workers=download_workers, thread_name_prefix="logstar-download"
+    ) as executor:
+        pending = deque()
+        station_iter = iter(stations)
+        for station in station_iter:
+            pending.append((station, executor.submit(limited_download, station)))
+            if len(pending) >= download_workers:
+                break
+
+        while pending:
+            station, future = pending.popleft()
+            data = future.result()
+            del future
+            # the payload handed out counts to the window, the other downloads continue while the caller works
+            yield station, data
+            del data
+            next_station = next(station_iter, None)
+            if next_station is not None:
+                pending.append(
+                    (next_station, executor.submit(limited_download, next_station))
+                )
+
+
+def prepare_station(
+    station,
+    data,
+    sensor_mapping=None,
+    datetime_column="Datetime",
+    float_dtype="float64",
+    after=None,
+):
+    """
+    applies the sensor mapping to the downloaded data of a single station and builds its dataframe
 
-        # rename table column names, or csv column names
-        if sensor_mapping:
+    :param station: station name as used by logstar-online
+    :param data: downloaded data as returned by download_data
+    :param sensor_mapping: sensor mapping to rename station and columns
+    :param datetime_column: name of the datetime column
+    :param float_dtype: dtype of the measurement columns
+    :param after: if set, rows up to this timestamp are dropped
+    :return: tuple of (mapped station name, dataframe)
+    """
+    name = station
+
+    # rename table column names, or csv column names
+    if sensor_mapping:
+        with metrics.stage("column_mapping", station):
             mapping_return = do_column_name_mapping(
                 name, data["header"], sensor_mapping
             )
@@ -399,28 +772,150 @@ def manage_dl_db(
             # rename station if sensor_mapping available
             name = do_station_name_mapping(station, sensor_mapping)
 
-        # get downloaded data as dataframe
-        df = prepare_dataframe(data, datetime_column)
+    # get downloaded data as dataframe
+    with metrics.stage("prepare_dataframe", name):
+        df = prepare_dataframe(data, datetime_column, float_dtype, station)
 
-        # give data to process
-        if processing_steps is not None:
-            [df := ps.process(df, name) for ps in processing_steps]
+    # drop rows which are already stored
+    if after is not None and datetime_column in df.columns:
+        df = df[df[datetime_column] > after].reset_index(drop=True)
 
-        # check if dataframe is not empty
-        if df is None or df.empty:
-            logging.warning(f"empty dataframe for station {name}")
-            ret_data[name] = df
-            continue
+    return name, df
 
-        # if database engine is set, write to database
-        if database_engine:
-            write_to_database(
-                name, df, database_engine, db_schema, db_table_prefix, datetime_column
-            )
 
-        # write to file
-        if csv_folder:
-            filepath = os.path.join(csv_folder, name + ".csv")
+def run_processing_steps(name, df, processing_steps=None, process_pool=None):
+    """
+    runs the processing steps on the dataframe of a single station
+
+    :param name: mapped station name
+    :param df: dataframe as returned by prepare_station
+    :param processing_steps: list of processing steps to run on the data
+    :param process_pool: parallel.ProcessingPool of processing_steps, runs the steps in a worker process
+    :return: processed dataframe
+    """
+    if process_pool is not None and processing_steps:
+        return process_pool.process(name, df)
+
+    # give data to process, steps whose columns are missing are skipped
+    steps = processing_steps or []
+    if steps and df is not None:
+        steps = planner.station_plan(steps, name, df.columns)
+    for ps in steps:
+        rows = len(df) if df is not None else 0
+        metrics.inc("rows_in", rows, station=name, step=ps.ps_name)
+        with metrics.stage("process", name, step=ps.ps_name):
+            df = ps.process(df, name)
+        rows = len(df) if df is not None else 0
+        metrics.inc("rows_out", rows, station=name, step=ps.ps_name)
+    return df
+
+
+def reset_station_state(name, processing_steps=None):
+    """
+    clears the state the processing steps keep for the station, see ProcessingStep.get_station_state
+
+    Only streaming.StreamState passes the chunks of a station in order and without overlap, without it
+    every dataframe of a station starts without state.
+    """
+    for step in processing_steps or []:
+        step.set_station_state(name, None)
+
+
+def process_station(
+    station,
+    data,
+    processing_steps=None,
+    sensor_mapping=None,
+    datetime_column="Datetime",
+    float_dtype="float64",
+    after=None,
+    projection=None,
+    process_pool=None,
+    stream_state=None,
+    final=False,
+    raw_store=None,
+):
+    """
+    applies the sensor mapping and the processing steps to the downloaded data of a single station
+
+    :param station: station name as used by logstar-online
+    :param data: downloaded data as returned by download_data
+    :param processing_steps: list of processing steps to run on the data
+    :param sensor_mapping: sensor mapping to rename station and columns
+    :param datetime_column: name of the datetime column
+    :param float_dtype: dtype of the measurement columns
+    :param after: if set, rows up to this timestamp are dropped before the processing steps
+    :param projection: ChannelProjection, drops columns which are not requested after the processing steps
+    :param process_pool: parallel.ProcessingPool of processing_steps, runs the steps in a worker process
+    :param stream_state: streaming.StreamState of processing_steps, data is the next chunk of the station and
+        rows whose values may still change with the next chunk are held back. Without it the processing
+        steps start without state, see reset_station_state
+    :param final: data is the last chunk of the station, nothing is held back by stream_state
+    :param raw_store: reprocess.RawStore, the mapped data is stored before the processing steps run
+    :return: tuple of (mapped station name, dataframe)
+    """
+    if stream_state is not None and processing_steps:
+        # rows up to after are context of the processing steps
+        name, df = prepare_station(
+            station, data, sensor_mapping, datetime_column, float_dtype
+        )
+        if raw_store is not None:
+            raw_store.write(name, df, after)
+        df = stream_state.process(name, df, after, final, process_pool)
+    else:
+        name, df = prepare_station(
+            station, data, sensor_mapping, datetime_column, float_dtype, after
+        )
+        if raw_store is not None:
+            raw_store.write(name, df)
+        # downloads of a station may overlap, e.g. ongoing polls without watermark
+        reset_station_state(name, processing_steps)
+        df = run_processing_steps(name, df, processing_steps, process_pool)
+
+    if projection is not None and df is not None:
+        df = projection.project(df, datetime_column)
+
+    return name, df
+
+
+def write_station(
+    name,
+    df,
+    database_engine=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix=None,
+    datetime_column="Datetime",
+    db_write_method="insert",
+):
+    """
+    writes the processed data of a single station to database and|or csv
+
+    :param name: mapped station name, used as table and file name
+    :param df: dataframe to write
+    :param database_engine
+    :param csv_folder
+    :param db_schema
+    :param db_table_prefix
+    :param datetime_column
+    :param db_write_method: see write_to_database
+    """
+    # if database engine is set, write to database
+    if database_engine:
+        write_to_database(
+            name,
+            df,
+            database_engine,
+            db_schema,
+            db_table_prefix,
+            datetime_column,
+            db_write_method,
+        )
+
+    # write to file
+    if csv_folder:
+        filepath = os.path.join(csv_folder, name + ".csv")
+        with metrics.stage("write_csv", name):
             df.to_csv(
                 filepath,
                 sep=",",
@@ -431,7 +926,179 @@ def manage_dl_db(
                 quoting=csv.QUOTE_MINIMAL,
                 index=False,
             )
+        metrics.inc("rows_written_csv", len(df), station=name)
+
+    if database_engine or csv_folder:
+        metrics.set_gauge("last_write_timestamp_seconds", time.time(), station=name)
+
+
+def manage_dl_db(
+    conf,
+    database_engine=None,
+    processing_steps: List = [],
+    sensor_mapping=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix=None,
+    datetime_column="Datetime",
+    timeout=15,
+    download_workers=1,
+    max_connections_per_host=None,
+    stream_decode=False,
+    float_dtype="float64",
+    json_decoder="auto",
+    db_write_method="insert",
+    pipeline=False,
+    fingerprints=None,
+    projection=None,
+    process_pool=None,
+    stream_state=None,
+    final=False,
+    raw_store=None,
+    **kwargs,
+):
+    """
+    main routine to download data and save it to database and|or csv
+
+    Downloads can run in parallel (download_workers > 1), mapping, processing steps and writing
+    always run one station after another in the order of conf["stationlist"].
+
+    :param conf
+    :param database_engine
+    :param processing_steps
+    :param sensor_mapping
+    :param csv_folder
+    :param db_schema
+    :param db_table_prefix
+    :param download_workers: number of parallel downloads
+    :param max_connections_per_host: maximum parallel requests against the logstar host
+    :param stream_decode: decode responses while downloading straight into typed columns
+    :param float_dtype: dtype of the measurement columns
+    :param json_decoder: json decoder used when stream_decode is set
+    :param db_write_method: "insert" or "copy", see write_to_database
+    :param pipeline: download, process and write concurrently, see pipeline.run_pipeline
+    :param fingerprints: FingerprintCache, skips stations whose payload did not change since the last run
+    :param projection: ChannelProjection, requests only the channels needed for the output
+    :param process_pool: parallel.ProcessingPool of processing_steps, runs the processing steps of several
+        stations in worker processes at once, see parallel.run_process_pool
+    :param stream_state: streaming.StreamState, conf is the next chunk of a longer period, see process_station
+    :param final: conf is the last chunk of the period
+    :param raw_store: reprocess.RawStore, stores the mapped data before the processing steps, see logstar-reprocess.py
+    """
+    if process_pool is not None and processing_steps and stream_state is None:
+        from logstar_stream.parallel import run_process_pool
+
+        return run_process_pool(
+            conf,
+            database_engine,
+            processing_steps,
+            sensor_mapping,
+            csv_folder,
+            db_schema,
+            db_table_prefix,
+            datetime_column,
+            timeout,
+            download_workers,
+            max_connections_per_host,
+            stream_decode,
+            float_dtype,
+            json_decoder,
+            db_write_method,
+            process_pool=process_pool,
+            fingerprints=fingerprints,
+            projection=projection,
+            raw_store=raw_store,
+            **kwargs,
+        )
+
+    if pipeline:
+        from logstar_stream.pipeline import run_pipeline
+
+        return run_pipeline(
+            conf,
+            database_engine,
+            processing_steps,
+            sensor_mapping,
+            csv_folder,
+            db_schema,
+            db_table_prefix,
+            datetime_column,
+            timeout,
+            download_workers,
+            max_connections_per_host,
+            stream_decode,
+            float_dtype,
+            json_decoder,
+            db_write_method,
+            fingerprints=fingerprints,
+            projection=projection,
+            process_pool=process_pool,
+            stream_state=stream_state,
+            final=final,
+            raw_store=raw_store,
+            **kwargs,
+        )
+
+    ret_data = {}
+    for station, data in iter_station_downloads(
+        conf,
+        timeout,
+        download_workers,
+        max_connections_per_host,
+        stream=stream_decode,
+        float_dtype=float_dtype,
+        json_decoder=json_decoder,
+        fingerprints=fingerprints,
+        projection=projection,
+    ):
+        if data is UNCHANGED:
+            logging.debug(f"data of station {station} did not change, skipping ...")
+            continue
+
+        # no new data or something went wrong while downloading the data
+        if data is None or ("data" not in data and "columns" not in data):
+            logging.error(f"could not download data for station {station}\n {data}")
+            continue
+
+        name, df = process_station(
+            station,
+            data,
+            processing_steps,
+            sensor_mapping,
+            datetime_column,
+            float_dtype,
+            projection=projection,
+            process_pool=process_pool,
+            stream_state=stream_state,
+            final=final,
+            raw_store=raw_store,
+        )
+
+        # check if dataframe is not empty
+        if df is None or df.empty:
+            logging.warning(f"empty dataframe for station {name}")
+            ret_data[name] = df
+            if fingerprints is not None:
+                fingerprints.commit(fingerprint_key(conf, station))
+            continue
+
+        write_station(
+            name,
+            df,
+            database_engine,
+            csv_folder,
+            db_schema,
+            db_table_prefix,
+            datetime_column,
+            db_write_method,
+        )
+        if fingerprints is not None:
+            fingerprints.commit(fingerprint_key(conf, station))
 
         # add df to return data collection
         ret_data[name] = df
+
+    # changelogs of the processing steps are written once per run
+    for step in processing_steps or []:
+        step.flush_change_log()
     return ret_data
@@ -0,0 +1,257 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# prefix of all exported metric names
+METRICS_PREFIX = "logstar_"
+
+# stages timed with stage, in the order of a run
+STAGES = [
+    "download",
+    "column_mapping",
+    "prepare_dataframe",
+    "process",
+    "write_database",
+    "write_csv",
+]
+
+# counters and their help text, exported as <prefix><name>_total
+COUNTERS = {
+    "bytes_downloaded": "bytes of downloaded payloads",
+    "rows_downloaded": "rows of downloaded payloads",
+    "rows_in": "rows passed into a processing step",
+    "rows_out": "rows returned by a processing step",
+    "rows_inserted": "rows inserted into the database",
+    "rows_skipped": "rows not inserted because they already existed",
+    "rows_written_csv": "rows appended to csv files",
+    "payloads_unchanged": "payloads skipped because they did not change since the last poll",
+    "errors": "failed stages",
+}
+
+# gauges and their help text
+GAUGES = {
+    "last_write_timestamp_seconds": "unix time of the last successful write of a station",
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in key
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Metrics(object):
+    """
+    Durations and counters of the stages of a run, labeled with station and processing step.
+
+    Download counters are labeled with the logstar station name, everything after the column mapping
+    with the mapped station name. Recording is a dict update under a lock, cheap compared to any stage.
+    """
+
+    def __init__(self):
+        # (stage, labels) -> [count, sum, max] of the durations
+        self.durations = {}
+        # (name, labels) -> value
+        self.counters = {}
+        self.gauges = {}
+        # profiling.StageProfiler profiling every stage, None if profiling is disabled
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, station=None, **labels):
+        """times the block as stage name, an exception leaving the block is counted as error"""
+        start = time.perf_counter()
+        try:
+            if self.profiler is None:
+                yield
+            else:
+                with self.profiler.profile(name, station, **labels):
+                    yield
+        except (Exception, SystemExit):
+            # SystemExit is raised by write_to_database, an interrupt is not a failure of the stage
+            self.inc("errors", stage=name, station=station, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, station, **labels)
+
+    def observe(self, name, seconds, station=None, **labels):
+        """records a duration of stage name measured elsewhere, e.g. in a worker process"""
+        key = (name, _labels_key(dict(labels, stage=name, station=station)))
+        with self._lock:
+            entry = self.durations.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def inc(self, name, value=1, **labels):
+        """adds value to the counter name"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """sets the gauge name"""
+        with self._lock:
+            self.gauges[(name, _labels_key(labels))] = value
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def summary(self):
+        """
+        returns all recorded values as dict, suitable for json
+
+        {"totals": {stage: seconds}, "stages": [...], "counters": [...], "gauges": [...]}
+        """
+        with self._lock:
+            durations = dict(self.durations)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        totals = {}
+        stages = []
+        for (name, key), (count, seconds, max_seconds) in sorted(durations.items()):
+            totals[name] = totals.get(name, 0.0) + seconds
+            stages.append(
+                dict(key, count=count, seconds=seconds, max_seconds=max_seconds)
+            )
+        return {
+            "totals": totals,
+            "stages": stages,
+            "counters": [
+                dict(key, name=name, value=value)
+                for (name, key), value in sorted(counters.items())
+            ],
+            "gauges": [
+                dict(key, name=name, value=value)
+                for (name, key), value in sorted(gauges.items())
+            ],
+        }
+
+    def to_prometheus(self):
+        """returns all recorded values in the prometheus text format"""
+        with self._lock:
+            durations = sorted(self.durations.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        name = METRICS_PREFIX + "stage_duration_seconds"
+        lines.append(f"# HELP {name} time spent in the stages of a run")
+        lines.append(f"# TYPE {name} summary")
+        for (_, key), (count, seconds, _) in durations:
+            lines.append(f"{name}_sum{_format_labels(key)} {seconds}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+        for metric, help_text in COUNTERS.items():
+            name = f"{METRICS_PREFIX}{metric}_total"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(
+                f"{name}{_format_labels(key)} {value}"
+                for (counter, key), value in counters
+                if counter == metric
+            )
+
+        for metric, help_text in GAUGES.items():
+            name = METRICS_PREFIX + metric
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(
+                f"{name}{_format_labels(key)} {value}"
+                for (gauge, key), value in gauges
+                if gauge == metric
+            )
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self):
+        """logs the time spent per stage and the counters summed over all stations"""
+        summary = self.summary()
+        totals = summary["totals"]
+        order = sorted(totals, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES))
+        for stage in order:
+            logging.info(f"stage {stage}: {totals[stage]:.2f} s ...")
+        totals = {}
+        for counter in summary["counters"]:
+            totals[counter["name"]] = totals.get(counter["name"], 0) + counter["value"]
+        if totals:
+            logging.info(
+                "counters: " + ", ".join(f"{k} {v}" for k, v in sorted(totals.items()))
+            )
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+# shared by all modules, like the shared http client
+_metrics = Metrics()
+
+
+def get_metrics():
+    """returns the shared metrics registry"""
+    return _metrics
+
+
+def stage(name, station=None, **labels):
+    """times a stage in the shared registry, see Metrics.stage"""
+    return _metrics.stage(name, station, **labels)
+
+
+def inc(name, value=1, **labels):
+    """adds value to a counter of the shared registry"""
+    _metrics.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    """sets a gauge of the shared registry"""
+    _metrics.set(name, value, **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.metrics.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("metrics: " + format % args)
+
+
+def start_metrics_server(port, host="0.0.0.0", metrics=None):
+    """
+    serves the metrics in the prometheus text format on http://host:port/metrics from a background thread
+
+    :return: the http server, stop it with shutdown()
+    """
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    httpd.metrics = metrics or _metrics
+    threading.Thread(
+        target=httpd.serve_forever, name="logstar-metrics", daemon=True
+    ).start()
+    logging.info(f"serving metrics on http://{host}:{httpd.server_address[1]}/metrics ...")
+    return httpd
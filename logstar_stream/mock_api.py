@@ -0,0 +1,392 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from logstar_stream.projection import ALL_CHANNELS, CHANNEL_SEPARATOR
+
+"""
+	Local stand-in for the logstar-online api, serving
+	/api/{apiKey}/{Stationname}/{StartTag}/{EndTag}/{Channellist}/{DateTime}/{GeoData}
+	from synthetic or recorded payloads. Point LOGSTAR_API_URL at MockLogstarServer.url to use it.
+"""
+
+# defaults of the synthetic payloads
+MOCK_COLUMNS = 20
+MOCK_INTERVAL_MINUTES = 10
+MOCK_GAP_RATIO = 0.05
+
+# value of a missing measurement in logstar responses
+NO_VALUE = "#"
+
+DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%H:%M:%S"
+
+# encoded payloads kept by the server, the same window is usually requested several times in benchmarks
+PAYLOAD_CACHE_SIZE = 64
+
+# paths of the latest requests kept by the server, e.g. to check the requested channels in tests
+RECENT_PATHS = 100
+
+# replaces the api key in the kept paths
+REDACTED = "***"
+
+
+def _station_seed(station, seed):
+    return zlib.crc32(station.encode("utf-8")) ^ seed
+
+
+def _day_values(station, day, rows, columns, gap_ratio, seed):
+    """measurements of a single day, only depend on station, day and seed so overlapping windows agree"""
+    rng = np.random.default_rng([_station_seed(station, seed), day.toordinal()])
+    # smooth daily curve with noise, one offset per channel
+    phase = np.linspace(0, 2 * np.pi, rows, endpoint=False)[:, None]
+    offsets = np.random.default_rng(_station_seed(station, seed)).uniform(0, 40, columns)
+    values = offsets + 5 * np.sin(phase) + rng.normal(0, 0.5, (rows, columns))
+    values = np.round(values, 2).astype(str)
+    values[rng.random((rows, columns)) < gap_ratio] = NO_VALUE
+    return values
+
+
+def generate_payload(
+    station,
+    startdate,
+    enddate,
+    channels=ALL_CHANNELS,
+    columns=MOCK_COLUMNS,
+    interval_minutes=MOCK_INTERVAL_MINUTES,
+    gap_ratio=MOCK_GAP_RATIO,
+    datetime_mode="0",
+    until=None,
+    seed=0,
+):
+    """
+    Builds a synthetic logstar response of a station.
+
+    Measurements are string encoded like in real responses, missing values are "#". The data of a
+    day only depends on station, day and seed, so overlapping requests return the same rows.
+
+    Args:
+        station (str): name of the station, used for the column names and the random values.
+        startdate (str): first day, YYYY-MM-DD.
+        enddate (str): last day (inclusive), YYYY-MM-DD.
+        channels (int or list): ALL_CHANNELS or the channel ids to return.
+        columns (int): number of measurement channels of the station.
+        interval_minutes (int): minutes in between two rows.
+        gap_ratio (float): share of missing values.
+        datetime_mode (str): "0" returns a Datetime column, everything else Date and Time columns.
+        until (datetime.datetime, optional): rows after until are not returned yet.
+        seed (int): seed of the random values.
+
+    Returns:
+        dict: {"header": {channel id: column name}, "data": [{channel id: value}, ...]}
+    """
+    start = datetime.datetime.strptime(startdate, DATE_FORMAT).date()
+    end = datetime.datetime.strptime(enddate, DATE_FORMAT).date()
+    rows_per_day = max(1, 24 * 60 // interval_minutes)
+
+    keys = [str(i) for i in range(1, columns + 1)]
+    if channels == ALL_CHANNELS:
+        selected = list(range(columns))
+    else:
+        selected = [keys.index(str(c)) for c in channels if str(c) in keys]
+
+    if datetime_mode == "0":
+        header = {"0": "Datetime"}
+    else:
+        header = {"date": "Date", "time": "Time"}
+    header.update({keys[i]: f"{station}_CH_{keys[i]} - °C" for i in selected})
+
+    data = []
+    day = start
+    while day <= end:
+        timestamps = pd.date_range(
+            day, periods=rows_per_day, freq=f"{interval_minutes}min"
+        )
+        if until is not None:
+            timestamps = timestamps[timestamps <= until]
+        if len(timestamps) == 0:
+            break
+        values = _day_values(station, day, rows_per_day, columns, gap_ratio, seed)
+        values = values[: len(timestamps), selected].tolist()
+        selected_keys = [keys[i] for i in selected]
+
+        if datetime_mode == "0":
+            stamps = timestamps.strftime(f"{DATE_FORMAT} {TIME_FORMAT}")
+            data.extend(
+                {"0": t, **dict(zip(selected_keys, row))}
+                for t, row in zip(stamps, values)
+            )
+        else:
+            dates = timestamps.strftime(DATE_FORMAT)
+            times = timestamps.strftime(TIME_FORMAT)
+            data.extend(
+                {"date": d, "time": t, **dict(zip(selected_keys, row))}
+                for d, t, row in zip(dates, times, values)
+            )
+        day += datetime.timedelta(days=1)
+
+    return {"header": header, "data": data}
+
+
+def save_fixture(path, payload):
+    """stores a recorded response as fixture"""
+    with open(path, "w") as f:
+        json.dump(payload, f)
+
+
+def load_fixture(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def filter_payload(payload, startdate, enddate, channels=ALL_CHANNELS):
+    """
+    returns the rows of a recorded response from startdate to enddate (inclusive) and the requested channels
+
+    dates are compared as iso strings with the first 10 characters of the Datetime or Date column
+    """
+    header = payload["header"]
+    time_keys = [k for k, v in header.items() if v in ("Datetime", "Date", "Time")]
+    date_key = next((k for k in time_keys if header[k] in ("Datetime", "Date")), None)
+
+    keys = list(header)
+    if channels != ALL_CHANNELS:
+        wanted = {str(c) for c in channels}
+        keys = [k for k in keys if k in time_keys or k in wanted]
+
+    data = []
+    for row in payload["data"]:
+        if date_key is not None and not (startdate <= row.get(date_key, "")[:10] <= enddate):
+            continue
+        data.append({k: row[k] for k in keys if k in row})
+    return {"header": {k: header[k] for k in keys}, "data": data}
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    # keep-alive, like logstar-online
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.mock.handle(self)
+
+    def log_message(self, format, *args):
+        logging.debug("mock api: " + format % args)
+
+
+class MockLogstarServer(object):
+    """
+    Local http server answering logstar api requests.
+
+    Stations found as <fixtures_dir>/<station>.json are served from the recorded response, all other
+    stations get synthetic payloads (see generate_payload). Latency and failing requests can be
+    injected to exercise retries and the download concurrency. Responses are gzip encoded if the
+    client accepts it.
+
+        with MockLogstarServer(columns=50) as server:
+            logstar.LOGSTAR_API_URL = server.url
+            ...
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        apikey=None,
+        stations=None,
+        columns=MOCK_COLUMNS,
+        interval_minutes=MOCK_INTERVAL_MINUTES,
+        gap_ratio=MOCK_GAP_RATIO,
+        latency=0.0,
+        error_rate=0.0,
+        error_status=(503,),
+        fixtures_dir=None,
+        realtime=False,
+        seed=0,
+    ):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free port
+        :param apikey: api key to accept, any key if None
+        :param stations: known stations, other stations get 404, any station if None
+        :param columns: measurement channels of synthetic stations
+        :param interval_minutes: minutes in between two rows of synthetic stations
+        :param gap_ratio: share of missing values of synthetic stations
+        :param latency: seconds every response is delayed
+        :param error_rate: share of requests failing with one of error_status
+        :param error_status: status codes of failing requests, 429 and 503 carry Retry-After: 0
+        :param fixtures_dir: directory with recorded responses named <station>.json
+        :param realtime: do not return rows after the current time
+        :param seed: seed of the synthetic values and the error injection
+        """
+        self.host = host
+        self.port = port
+        self.apikey = apikey
+        self.stations = set(stations) if stations else None
+        self.columns = columns
+        self.interval_minutes = interval_minutes
+        self.gap_ratio = gap_ratio
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = list(error_status)
+        self.fixtures_dir = fixtures_dir
+        self.realtime = realtime
+        self.seed = seed
+
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        # latest request paths with the api key replaced by REDACTED
+        self.paths = deque(maxlen=RECENT_PATHS)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """value for LOGSTAR_API_URL"""
+        return f"http://{self.host}:{self.port}/api"
+
+    def payload(self, station, startdate, enddate, channels=ALL_CHANNELS, datetime_mode="0"):
+        """response of a request as dict"""
+        fixture = (
+            os.path.join(self.fixtures_dir, station + ".json")
+            if self.fixtures_dir
+            else None
+        )
+        if fixture and os.path.exists(fixture):
+            return filter_payload(load_fixture(fixture), startdate, enddate, channels)
+        return generate_payload(
+            station,
+            startdate,
+            enddate,
+            channels,
+            columns=self.columns,
+            interval_minutes=self.interval_minutes,
+            gap_ratio=self.gap_ratio,
+            datetime_mode=datetime_mode,
+            until=datetime.datetime.now() if self.realtime else None,
+            seed=self.seed,
+        )
+
+    def _body(self, key, compress):
+        with self._lock:
+            body = self._cache.get((key, compress))
+        if body is not None:
+            return body
+
+        body = json.dumps(self.payload(*key)).encode("utf-8")
+        if compress:
+            body = gzip.compress(body, compresslevel=1)
+        # realtime payloads change with every request
+        if not self.realtime:
+            with self._lock:
+                if len(self._cache) >= PAYLOAD_CACHE_SIZE:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[(key, compress)] = body
+        return body
+
+    def _send(self, handler, status, body=b"", headers=None):
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self._lock:
+            self.bytes_sent += len(body)
+
+    @staticmethod
+    def redact(path):
+        """path of a request with the api key replaced by REDACTED"""
+        parts = path.split("/")
+        if len(parts) > 2 and parts[1] == "api":
+            parts[2] = REDACTED
+        return "/".join(parts)
+
+    def handle(self, handler):
+        """answers a single request"""
+        with self._lock:
+            self.requests += 1
+            self.paths.append(self.redact(handler.path))
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+            status = self._random.choice(self.error_status) if fail else 200
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if status != 200:
+            with self._lock:
+                self.errors += 1
+            headers = {"Retry-After": "0"} if status in (429, 503) else None
+            self._send(handler, status, headers=headers)
+            return
+
+        parts = handler.path.strip("/").split("/")
+        if len(parts) != 8 or parts[0] != "api":
+            self._send(handler, 404)
+            return
+        _, apikey, station, startdate, enddate, channels, datetime_mode, _ = parts
+        if self.apikey is not None and apikey != self.apikey:
+            self._send(handler, 403)
+            return
+        if self.stations is not None and station not in self.stations:
+            self._send(handler, 404)
+            return
+
+        if channels != str(ALL_CHANNELS):
+            channels = tuple(channels.split(CHANNEL_SEPARATOR))
+        else:
+            channels = ALL_CHANNELS
+        compress = "gzip" in handler.headers.get("Accept-Encoding", "")
+        try:
+            body = self._body((station, startdate, enddate, channels, datetime_mode), compress)
+        except ValueError as e:
+            self._send(handler, 400, str(e).encode("utf-8"))
+            return
+
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        self._send(handler, 200, body, headers)
+
+    def start(self):
+        """starts serving in a background thread"""
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _MockHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="logstar-mock-api", daemon=True
+        )
+        self._thread.start()
+        logging.info(f"mock logstar api listening on {self.url} ...")
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __str__(self):
+        return f"{self.requests} requests, {self.errors} injected errors, {self.bytes_sent} bytes sent"
@@ -0,0 +1,281 @@
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+import sqlalchemy as sq
+
+import logstar_stream.logstar as logstar
+from logstar_stream.fingerprint import UNCHANGED
+from logstar_stream.backfill import DATE_FORMAT, plan_windows
+
+# days downloaded for a station without a watermark, like the previous ongoing mode (yesterday to tomorrow)
+ONGOING_LOOKBACK_DAYS = 1
+
+# suffix of the csv sidecar files holding the watermark of a station
+WATERMARK_SUFFIX = ".watermark.json"
+
+
+class WatermarkStore(object):
+    """
+    Last stored timestamp (high-water mark) of every station.
+
+    Watermarks are kept in memory, the first lookup of a station recovers it from the sinks: the
+    maximum of the datetime column of the database table and the csv sidecar file
+    <csv_folder>/<name>.watermark.json. If both sinks are used the older watermark wins, so neither
+    sink misses data. A sink without a watermark (e.g. csv output added to a station already stored in
+    the database) does not hold the station back: it is filled from the watermark of the other sink
+    on, the history before it is not downloaded again. A station without a watermark in any sink
+    starts lookback_days back, see plan_ongoing_windows.
+    """
+
+    def __init__(
+        self,
+        database_engine=None,
+        db_schema=None,
+        db_table_prefix="",
+        csv_folder=None,
+        datetime_column="Datetime",
+    ):
+        self.database_engine = database_engine
+        self.db_schema = db_schema
+        self.db_table_prefix = db_table_prefix or ""
+        self.csv_folder = csv_folder
+        self.datetime_column = datetime_column
+        self._watermarks = {}
+        self._lock = threading.Lock()
+
+    def _sidecar_path(self, name):
+        return os.path.join(self.csv_folder, name + WATERMARK_SUFFIX)
+
+    def _from_database(self, name):
+        table_name = self.db_table_prefix + name
+        with self.database_engine.begin() as conn:
+            metadata = logstar.get_table_metadata(conn, table_name, self.db_schema)
+            if not metadata.exists or self.datetime_column not in metadata.columns:
+                return None
+            stmt = sq.select(sq.func.max(sq.column(self.datetime_column))).select_from(
+                sq.table(table_name, schema=self.db_schema)
+            )
+            watermark = conn.execute(stmt).scalar()
+        return pd.Timestamp(watermark) if watermark is not None else None
+
+    def _from_sidecar(self, name):
+        path = self._sidecar_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return pd.Timestamp(json.load(f)[self.datetime_column])
+
+    def _recover(self, name):
+        watermarks = []
+        if self.database_engine is not None:
+            watermarks.append(self._from_database(name))
+        if self.csv_folder is not None:
+            watermarks.append(self._from_sidecar(name))
+        # a sink without a watermark has no data of the station yet, see the class docstring
+        watermarks = [w for w in watermarks if w is not None]
+        return min(watermarks) if watermarks else None
+
+    def get(self, name):
+        """returns the watermark of the station as pd.Timestamp, None if nothing is stored yet"""
+        with self._lock:
+            if name in self._watermarks:
+                return self._watermarks[name]
+        watermark = self._recover(name)
+        logging.debug(f"recovered watermark of {name}: {watermark}")
+        with self._lock:
+            return self._watermarks.setdefault(name, watermark)
+
+    def update(self, name, df):
+        """moves the watermark of the station to the last timestamp of the stored dataframe"""
+        if df is None or df.empty or self.datetime_column not in df.columns:
+            return
+        watermark = pd.Timestamp(df[self.datetime_column].max())
+        with self._lock:
+            current = self._watermarks.get(name)
+            if current is not None and current >= watermark:
+                return
+            self._watermarks[name] = watermark
+
+        if self.csv_folder is not None:
+            # write and rename, a crash never leaves a broken sidecar
+            path = self._sidecar_path(name)
+            with open(path + ".tmp", "w") as f:
+                json.dump({self.datetime_column: watermark.isoformat()}, f)
+            os.replace(path + ".tmp", path)
+
+
+def plan_ongoing_windows(watermark, today, chunk_delta, lookback_days=ONGOING_LOOKBACK_DAYS):
+    """
+    windows to request for a station, starting at the day of its watermark up to tomorrow
+
+    after a downtime of more than chunk_delta days the range is split into several windows
+
+    :param watermark: last stored timestamp of the station or None
+    :param today: datetime.date of today
+    :param chunk_delta: days per window, 0 requests the whole range at once
+    :param lookback_days: days requested for a station without a watermark
+    :return: list of (startdate, enddate) tuples
+    """
+    if watermark is None:
+        start = today - datetime.timedelta(days=lookback_days)
+    else:
+        start = min(watermark.date(), today)
+    end = today + datetime.timedelta(days=1)
+    return plan_windows(start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT), chunk_delta)
+
+
+def poll_station(
+    station,
+    conf,
+    watermarks,
+    chunk_delta=0,
+    lookback_days=ONGOING_LOOKBACK_DAYS,
+    database_engine=None,
+    processing_steps=None,
+    sensor_mapping=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix=None,
+    datetime_column="Datetime",
+    timeout=15,
+    stream_decode=False,
+    float_dtype="float64",
+    json_decoder="auto",
+    db_write_method="insert",
+    today=None,
+    process_lock=None,
+    fingerprints=None,
+    projection=None,
+    process_pool=None,
+    stream_state=None,
+    raw_store=None,
+    **kwargs,
+):
+    """
+    Downloads the data of a single station released since its watermark, see run_ongoing_poll.
+
+    :param process_lock: lock held while the processing steps run, if stations are polled concurrently
+    :param fingerprints: FingerprintCache, windows whose payload did not change since the last poll are skipped
+    :param projection: ChannelProjection, requests only the channels needed for the output
+    :param process_pool: parallel.ProcessingPool of processing_steps, runs the steps in a worker process
+    :param stream_state: streaming.StreamState, rows up to the watermark are context of the processing steps and
+        rows whose values may still change are held back until the next poll
+    :param raw_store: reprocess.RawStore, stores the new rows before the processing steps run
+    :return: tuple of (mapped station name, dataframe of the new rows or None)
+    """
+    today = today or datetime.date.today()
+    name = (
+        logstar.do_station_name_mapping(station, sensor_mapping)
+        if sensor_mapping
+        else station
+    )
+    watermark = watermarks.get(name)
+    windows = plan_ongoing_windows(watermark, today, chunk_delta, lookback_days)
+    if len(windows) > 1:
+        logging.info(
+            f"catching up station {station} since {watermark} in {len(windows)} windows ..."
+        )
+
+    new_data = []
+    for startdate, enddate in windows:
+        window_conf = dict(conf, startdate=startdate, enddate=enddate)
+        logging.info(
+            f"downloading data for station {station} from {startdate} to {enddate} ..."
+        )
+        data = logstar.download_data(
+            window_conf,
+            station,
+            timeout,
+            stream=stream_decode,
+            float_dtype=float_dtype,
+            json_decoder=json_decoder,
+            fingerprints=fingerprints,
+            projection=projection,
+        )
+
+        if data is UNCHANGED:
+            logging.debug(f"data of station {station} did not change, skipping ...")
+            continue
+
+        # something went wrong while downloading the data, continue with the next poll
+        if data is None or ("data" not in data and "columns" not in data):
+            logging.error(f"could not download data for station {station}\n {data}")
+            break
+
+        with process_lock or contextlib.nullcontext():
+            name, df = logstar.process_station(
+                station,
+                data,
+                processing_steps,
+                sensor_mapping,
+                datetime_column,
+                float_dtype,
+                after=watermarks.get(name),
+                projection=projection,
+                process_pool=process_pool,
+                stream_state=stream_state,
+                raw_store=raw_store,
+            )
+
+        if df is None or df.empty:
+            logging.debug(f"no new data for station {name} after {watermarks.get(name)}")
+            if fingerprints is not None:
+                fingerprints.commit(logstar.fingerprint_key(window_conf, station))
+            continue
+
+        logstar.write_station(
+            name,
+            df,
+            database_engine,
+            csv_folder,
+            db_schema,
+            db_table_prefix,
+            datetime_column,
+            db_write_method,
+        )
+        watermarks.update(name, df)
+        if fingerprints is not None:
+            fingerprints.commit(logstar.fingerprint_key(window_conf, station))
+        new_data.append(df)
+
+    return name, pd.concat(new_data) if new_data else None
+
+
+def run_ongoing_poll(conf, watermarks, processing_steps=None, **kwargs):
+    """
+    Downloads the data of all stations released since their watermark.
+
+    Every station is requested from the day of its watermark, rows up to the watermark are dropped
+    before the processing steps and writing, so only new rows are processed and inserted. After a
+    downtime the missing days are caught up in windows of chunk_delta days. If a download fails,
+    the remaining windows of the station are left for the next poll, the watermark only moves
+    with stored data.
+
+    Args:
+        conf (dict): configuration as for logstar.manage_dl_db, startdate and enddate are ignored.
+        watermarks (WatermarkStore): watermarks of the stations, updated by the poll.
+        processing_steps (list, optional): processing steps to run on the new rows.
+        **kwargs: chunk_delta (days per window when catching up), lookback_days (days requested
+            for stations without a watermark), today (datetime.date, defaults to the current
+            day) and the remaining arguments as for logstar.manage_dl_db.
+
+    Returns:
+        dict: station name -> dataframe of the new rows
+    """
+    ret_data = {}
+    for station in conf["stationlist"]:
+        name, df = poll_station(
+            station, conf, watermarks, processing_steps=processing_steps, **kwargs
+        )
+        if df is not None:
+            ret_data[name] = df
+
+    # changelogs of the processing steps are written once per run
+    for step in processing_steps or []:
+        step.flush_change_log()
+    return ret_data
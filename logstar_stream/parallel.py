@@ -0,0 +1,224 @@
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import logstar_stream.logstar as logstar
+import logstar_stream.metrics as metrics
+import logstar_stream.planner as planner
+from logstar_stream.fingerprint import UNCHANGED
+
+# stations in flight per worker process before the oldest result is written
+PENDING_PER_WORKER = 2
+
+# processing steps of a worker process, set once by _init_worker
+_worker_steps = None
+
+
+def _init_worker(processing_steps):
+    global _worker_steps
+    _worker_steps = processing_steps
+
+
+def _process_in_worker(name, df, states):
+    """
+    runs the processing steps of the worker on df with the station state shipped from the parent
+
+    :return: tuple of (df, station states, columnar changes, (seconds, rows in, rows out) per step or None
+        if the step is skipped)
+    """
+    active = set()
+    if df is not None:
+        active = {id(step) for step in planner.station_plan(_worker_steps, name, df.columns)}
+    timings = []
+    for step, state in zip(_worker_steps, states):
+        step.set_station_state(name, state)
+        if df is not None and id(step) not in active:
+            timings.append(None)
+            continue
+        rows_in = len(df) if df is not None else 0
+        start = time.perf_counter()
+        df = step.process(df, name)
+        timings.append(
+            (time.perf_counter() - start, rows_in, len(df) if df is not None else 0)
+        )
+    return (
+        df,
+        [step.get_station_state(name) for step in _worker_steps],
+        [step.pop_change_log(name) for step in _worker_steps],
+        timings,
+    )
+
+
+class ProcessingPool(object):
+    """
+    Runs the processing steps of stations in worker processes.
+
+    Every worker holds a copy of the processing steps, pickled once when the pool starts. The
+    processing steps in this process stay the owner of the state: the state of a station (see
+    ProcessingStep.get_station_state) is shipped with its dataframe and the state and columnar
+    changes returned by the worker are merged back. Results of a station have to be merged before
+    the station is submitted again, then the state, dataframes and changelogs are the same as if
+    the steps ran in this process. Dataframes are pickled, numeric columns as raw numpy buffers.
+    Text changelogs are written by the workers.
+
+    Workers are started with spawn, forking a process running download threads is not safe.
+    """
+
+    def __init__(self, processing_steps, workers):
+        """
+        :param processing_steps: processing steps to run, the same list must be passed to manage_dl_db
+        :param workers: number of worker processes
+        """
+        self.processing_steps = processing_steps
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(processing_steps,),
+        )
+        logging.info(f"running processing steps in {workers} worker processes ...")
+
+    def submit(self, name, df):
+        """starts processing df of the station, the result must be passed to merge"""
+        with self._lock:
+            states = [step.get_station_state(name) for step in self.processing_steps]
+        return self._executor.submit(_process_in_worker, name, df, states)
+
+    def merge(self, name, future):
+        """waits for the result of submit, merges state and changelog of the station and returns the dataframe"""
+        try:
+            df, states, change_logs, timings = future.result()
+        except BaseException:
+            metrics.inc("errors", stage="process", station=name)
+            raise
+
+        with self._lock:
+            for step, state, changes in zip(self.processing_steps, states, change_logs):
+                step.set_station_state(name, state)
+                step.extend_change_log(name, changes)
+        for step, timing in zip(self.processing_steps, timings):
+            if timing is None:
+                continue
+            seconds, rows_in, rows_out = timing
+            metrics.get_metrics().observe("process", seconds, name, step=step.ps_name)
+            metrics.inc("rows_in", rows_in, station=name, step=step.ps_name)
+            metrics.inc("rows_out", rows_out, station=name, step=step.ps_name)
+        return df
+
+    def process(self, name, df):
+        """
+        processes df of the station in a worker and waits for the result
+
+        can be called from several threads, as long as a station is not processed by two threads at once
+        """
+        return self.merge(name, self.submit(name, df))
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def run_process_pool(
+    conf,
+    database_engine=None,
+    processing_steps=None,
+    sensor_mapping=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix=None,
+    datetime_column="Datetime",
+    timeout=15,
+    download_workers=1,
+    max_connections_per_host=None,
+    stream_decode=False,
+    float_dtype="float64",
+    json_decoder="auto",
+    db_write_method="insert",
+    process_pool=None,
+    fingerprints=None,
+    projection=None,
+    raw_store=None,
+    **kwargs,
+):
+    """
+    variant of logstar.manage_dl_db running the processing steps of several stations at once in process_pool
+
+    Stations are prepared in this process and submitted to the pool while the next stations are
+    downloaded. Results are merged and written in the order of conf["stationlist"], at most
+    PENDING_PER_WORKER stations per worker are in flight.
+
+    takes the same arguments as logstar.manage_dl_db and returns the same dict of station name -> dataframe
+    """
+    ret_data = {}
+    pending = deque()
+    window = process_pool.workers * PENDING_PER_WORKER
+
+    def finish(station, name, future):
+        df = process_pool.merge(name, future)
+        if projection is not None and df is not None:
+            df = projection.project(df, datetime_column)
+        ret_data[name] = df
+
+        # check if dataframe is not empty
+        if df is None or df.empty:
+            logging.warning(f"empty dataframe for station {name}")
+        else:
+            logstar.write_station(
+                name,
+                df,
+                database_engine,
+                csv_folder,
+                db_schema,
+                db_table_prefix,
+                datetime_column,
+                db_write_method,
+            )
+        if fingerprints is not None:
+            fingerprints.commit(logstar.fingerprint_key(conf, station))
+
+    for station, data in logstar.iter_station_downloads(
+        conf,
+        timeout,
+        download_workers,
+        max_connections_per_host,
+        stream=stream_decode,
+        float_dtype=float_dtype,
+        json_decoder=json_decoder,
+        fingerprints=fingerprints,
+        projection=projection,
+    ):
+        if data is UNCHANGED:
+            logging.debug(f"data of station {station} did not change, skipping ...")
+            continue
+
+        # no new data or something went wrong while downloading the data
+        if data is None or ("data" not in data and "columns" not in data):
+            logging.error(f"could not download data for station {station}\n {data}")
+            continue
+
+        name, df = logstar.prepare_station(
+            station, data, sensor_mapping, datetime_column, float_dtype
+        )
+        del data
+        if raw_store is not None:
+            raw_store.write(name, df)
+
+        # the state of a station is shipped with it, an earlier result of the same station is merged first
+        while pending and (
+            len(pending) >= window or any(p[1] == name for p in pending)
+        ):
+            finish(*pending.popleft())
+        logstar.reset_station_state(name, processing_steps)
+        pending.append((station, name, process_pool.submit(name, df)))
+
+    while pending:
+        finish(*pending.popleft())
+
+    # changelogs of the processing steps are written once per run
+    for step in processing_steps or []:
+        step.flush_change_log()
+    return ret_data
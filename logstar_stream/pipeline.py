@@ -0,0 +1,244 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import logstar_stream.logstar as logstar
+from logstar_stream.fingerprint import UNCHANGED
+
+# stations buffered between two stages, a full queue blocks the stage in front of it
+PIPELINE_QUEUE_SIZE = 2
+
+# seconds a blocked stage waits before checking if another stage failed
+_POLL_INTERVAL = 0.1
+
+# marks the end of the stream of stations
+_STOP = object()
+
+
+class StageStats(object):
+    """busy and idle time of a pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.idle = 0.0
+        self.items = 0
+
+    @contextmanager
+    def timed(self, kind):
+        """adds the time spent in the block to busy or idle"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, kind, getattr(self, kind) + time.perf_counter() - start)
+
+    def __str__(self):
+        return f"{self.name}: {self.items} stations, busy {self.busy:.2f} s, idle {self.idle:.2f} s"
+
+
+class Pipeline(object):
+    """
+    Runs download, processing and writing of the stations concurrently.
+
+    Every stage runs in its own thread and hands its results to the next stage through a bounded
+    queue, so the network is used while the database inserts and vice versa, but a slow stage
+    stops the stages in front of it instead of piling up data. Each stage works on one station
+    after another, the order of conf["stationlist"] is kept through the whole pipeline and
+    processing steps see the stations in the same order as with manage_dl_db.
+    """
+
+    def __init__(self, queue_size=PIPELINE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stats = {}
+        self._failed = threading.Event()
+        self._error = None
+
+    def _put(self, q, item, stats):
+        with stats.timed("idle"):
+            while not self._failed.is_set():
+                try:
+                    q.put(item, timeout=_POLL_INTERVAL)
+                    return
+                except queue.Full:
+                    continue
+
+    def _get(self, q, stats):
+        with stats.timed("idle"):
+            while not self._failed.is_set():
+                try:
+                    return q.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+        return _STOP
+
+    def _stage(self, name, func, source, target):
+        """
+        runs func for every item of the source queue and puts the results into the target queue
+
+        source is an iterator for the first stage, target is None for the last stage
+        """
+        stats = self.stats[name] = StageStats(name)
+
+        def run():
+            try:
+                while True:
+                    if isinstance(source, queue.Queue):
+                        item = self._get(source, stats)
+                    else:
+                        with stats.timed("busy"):
+                            item = next(source, _STOP)
+                    if item is _STOP or self._failed.is_set():
+                        break
+
+                    with stats.timed("busy"):
+                        result = func(item)
+                    stats.items += 1
+                    if target is not None and result is not None:
+                        self._put(target, result, stats)
+            except BaseException as e:
+                # also catches SystemExit raised by write_to_database
+                self._error = e
+                self._failed.set()
+            finally:
+                if target is not None:
+                    self._put(target, _STOP, stats)
+
+        return threading.Thread(target=run, name=f"logstar-{name}", daemon=True)
+
+    def run(self, downloads, process, write):
+        """
+        Args:
+            downloads (iterator): (station, data) tuples, e.g. logstar.iter_station_downloads.
+            process (callable): (station, data) -> tuple passed to write or None to skip the station.
+            write (callable): called with the tuple returned by process.
+
+        Raises:
+            the first exception raised in any stage, after all stages are stopped.
+        """
+        processed = queue.Queue(maxsize=self.queue_size)
+        downloaded = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            self._stage("download", lambda item: item, downloads, downloaded),
+            self._stage("process", lambda item: process(*item), downloaded, processed),
+            self._stage("write", lambda item: write(*item), processed, None),
+        ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        for stats in self.stats.values():
+            logging.info(f"pipeline stage {stats}")
+        busy = sum(stats.busy for stats in self.stats.values())
+        logging.info(
+            f"pipeline finished in {duration:.2f} s, {busy:.2f} s of stage work ({busy / duration if duration else 0:.2f}x overlap) ..."
+        )
+
+        if self._error is not None:
+            raise self._error
+
+
+def run_pipeline(
+    conf,
+    database_engine=None,
+    processing_steps=None,
+    sensor_mapping=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix=None,
+    datetime_column="Datetime",
+    timeout=15,
+    download_workers=1,
+    max_connections_per_host=None,
+    stream_decode=False,
+    float_dtype="float64",
+    json_decoder="auto",
+    db_write_method="insert",
+    queue_size=PIPELINE_QUEUE_SIZE,
+    fingerprints=None,
+    projection=None,
+    process_pool=None,
+    stream_state=None,
+    final=False,
+    raw_store=None,
+    **kwargs,
+):
+    """
+    pipelined variant of logstar.manage_dl_db, downloading, processing and writing concurrently
+
+    takes the same arguments as logstar.manage_dl_db and returns the same dict of station name -> dataframe
+
+    :param queue_size: number of stations buffered in between two stages
+    """
+    ret_data = {}
+
+    def process(station, data):
+        if data is UNCHANGED:
+            logging.debug(f"data of station {station} did not change, skipping ...")
+            return None
+
+        # no new data or something went wrong while downloading the data
+        if data is None or ("data" not in data and "columns" not in data):
+            logging.error(f"could not download data for station {station}\n {data}")
+            return None
+
+        name, df = logstar.process_station(
+            station,
+            data,
+            processing_steps,
+            sensor_mapping,
+            datetime_column,
+            float_dtype,
+            projection=projection,
+            process_pool=process_pool,
+            stream_state=stream_state,
+            final=final,
+            raw_store=raw_store,
+        )
+        ret_data[name] = df
+
+        # check if dataframe is not empty
+        if df is None or df.empty:
+            logging.warning(f"empty dataframe for station {name}")
+            if fingerprints is not None:
+                fingerprints.commit(logstar.fingerprint_key(conf, station))
+            return None
+        return station, name, df
+
+    def write(station, name, df):
+        logstar.write_station(
+            name,
+            df,
+            database_engine,
+            csv_folder,
+            db_schema,
+            db_table_prefix,
+            datetime_column,
+            db_write_method,
+        )
+        if fingerprints is not None:
+            fingerprints.commit(logstar.fingerprint_key(conf, station))
+
+    downloads = logstar.iter_station_downloads(
+        conf,
+        timeout,
+        download_workers,
+        max_connections_per_host,
+        stream=stream_decode,
+        float_dtype=float_dtype,
+        json_decoder=json_decoder,
+        fingerprints=fingerprints,
+        projection=projection,
+    )
+    Pipeline(queue_size).run(downloads, process, write)
+
+    # changelogs of the processing steps are written once per run
+    for step in processing_steps or []:
+        step.flush_change_log()
+    return ret_data
@@ -0,0 +1,288 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import logstar_stream.processing_steps.ProcessingStep as ps
+from logstar_stream.processing_steps.ProcessingStep import ProcessingStep
+
+# plans kept by station_plan, the least recently used plan is dropped first
+STATION_PLAN_CACHE_SIZE = 256
+
+# (processing steps, station, columns) -> processing steps to run, see station_plan. The key holds the
+# steps themselves, so a plan is never returned for other steps
+_station_plans = OrderedDict()
+_station_plans_lock = threading.Lock()
+
+
+def project_columns(step, pairs):
+    """
+    applies the renames, keeps and drops of a projection step to the columns of a dataframe
+
+    :param step: projection step
+    :param pairs: (column of the input dataframe, column name) of every column
+    :return: pairs of the columns returned by the step, None if the step returns an empty dataframe
+    """
+    if isinstance(step, FusedProjectionPS):
+        for inner in step.steps:
+            if pairs is None:
+                return None
+            pairs = project_columns(inner, pairs)
+        return pairs
+
+    keeps = step.keeps()
+    if keeps is not None:
+        sources = {name: source for source, name in pairs}
+        if not set(keeps).issubset(sources):
+            return None
+        return [(sources[name], name) for name in keeps]
+
+    drops = step.drops([name for _, name in pairs])
+    renames = step.renames()
+    return [
+        (source, renames.get(name, name)) for source, name in pairs if name not in drops
+    ]
+
+
+class FusedProjectionPS(ProcessingStep):
+    ps_name = "FusedProjectionPS"
+
+    ps_description = """
+      Runs consecutive SimpleRenameColumnsPS, WhitelistFilterColumnsPS and BlacklistFilterColumnsPS steps as a
+      single column selection, created by the planner
+      """
+
+    projection = True
+
+    def __init__(self, steps):
+        super().__init__({})
+        self.steps = steps
+        # columns of the input dataframe -> (columns to select, new column names), None for an empty dataframe
+        self._selections = {}
+
+    def selection(self, columns):
+        key = tuple(columns)
+        if key not in self._selections:
+            pairs = project_columns(self, [(c, c) for c in columns])
+            self._selections[key] = (
+                None if pairs is None else ([s for s, _ in pairs], [n for _, n in pairs])
+            )
+        return self._selections[key]
+
+    def required_columns(self, columns, available, station):
+        for step in reversed(self.steps):
+            columns = set(step.required_columns(columns, available, station))
+        return columns
+
+    def process(self, df: pd.DataFrame, station: str):
+        """
+        selects and renames the columns of all fused steps at once, the dataframe is copied at most once
+
+        Args:
+            df (pd.DataFrame): The DataFrame to be processed.
+            station (str): The name of the station.
+
+        Returns:
+            pd.DataFrame: The processed DataFrame, empty if a column selected by a whitelist is missing.
+        """
+        if df is None:
+            return df
+        selection = self.selection(list(df.columns))
+        if selection is None:
+            logging.debug(
+                f"did not found all required columns in {station} to run {self.ps_name}"
+            )
+            return pd.DataFrame()
+
+        sources, names = selection
+        if sources != list(df.columns):
+            df = df[sources]
+        if names != sources:
+            df.columns = names
+        return df
+
+
+def fuse_projections(processing_steps):
+    """replaces runs of consecutive projection steps with a FusedProjectionPS"""
+    fused = []
+    run = []
+    for step in processing_steps + [None]:
+        if step is not None and step.projection:
+            run.append(step)
+            continue
+        if len(run) > 1:
+            fused.append(FusedProjectionPS(run))
+        else:
+            fused.extend(run)
+        run = []
+        if step is not None:
+            fused.append(step)
+    return fused
+
+
+def validate(processing_steps):
+    """
+    checks the columns of the chain before any data is downloaded
+
+    Raises:
+        ValueError: if a step can never run because the steps before it remove its columns, or a
+            whitelist always returns an empty dataframe.
+    """
+    # columns which are never available at this point of the chain, None once a step changes unknown columns
+    removed = set()
+    # columns which can be available at this point, None if not restricted by a whitelist
+    possible = None
+    for step in processing_steps:
+        if removed is None:
+            return
+        for inner in step.steps if isinstance(step, FusedProjectionPS) else [step]:
+            if inner.projection:
+                keeps = inner.keeps()
+                if keeps is not None:
+                    missing = [
+                        c
+                        for c in keeps
+                        if c in removed or (possible is not None and c not in possible)
+                    ]
+                    if missing:
+                        raise ValueError(
+                            f"{inner.ps_name} keeps {missing} which are removed by the steps before it, its result is always empty"
+                        )
+                    possible = set(keeps)
+                    removed -= possible
+
+                renames = inner.renames()
+                targets = list(renames.values())
+                duplicates = sorted({t for t in targets if targets.count(t) > 1})
+                if duplicates:
+                    raise ValueError(
+                        f"{inner.ps_name} renames several columns to {duplicates}"
+                    )
+                for old, new in renames.items():
+                    if old != new and old not in targets:
+                        removed.add(old)
+                    removed.discard(new)
+                if possible is not None:
+                    possible = {renames.get(c, c) for c in possible}
+
+                drops = inner.drops(sorted(possible or []))
+                removed |= drops
+                if possible is not None:
+                    possible -= drops
+                continue
+
+            reads = inner.reads(None)
+            if reads:
+                readable = reads - removed
+                if possible is not None:
+                    readable &= possible
+                if not readable or (inner.reads_all and readable != reads):
+                    raise ValueError(
+                        f"{inner.ps_name} reads {sorted(reads)}, which are removed by the steps before it"
+                    )
+            if inner.writes(None) is None:
+                # unknown changes of the columns, later steps can not be checked
+                removed = None
+                break
+
+
+def describe(step):
+    """returns a line describing the columns the step works on"""
+    if isinstance(step, FusedProjectionPS):
+        return f"{step.ps_name}: " + ", then ".join(
+            describe(inner) for inner in step.steps
+        )
+    if step.projection:
+        parts = []
+        if step.renames():
+            parts.append(f"renames {step.renames()}")
+        if step.keeps() is not None:
+            parts.append(f"keeps {step.keeps()}")
+        if step.drops([]):
+            parts.append(f"drops {sorted(step.drops([]))}")
+        return f"{step.ps_name} " + " ".join(parts)
+    reads = step.reads(None)
+    if reads is None:
+        return f"{step.ps_name} does not declare its columns, always runs"
+    return "{} reads {} of {}, writes {}".format(
+        step.ps_name,
+        "all" if step.reads_all else "any",
+        sorted(reads) or "station specific columns",
+        sorted(step.writes(None) or []),
+    )
+
+
+def plan(processing_steps, fuse=True):
+    """
+    validates the chain, fuses consecutive projection steps and logs the plan
+
+    :param processing_steps: processing steps in the order they run
+    :param fuse: fuse consecutive projection steps into a single FusedProjectionPS
+    :return: processing steps to run
+    """
+    validate(processing_steps)
+    if fuse:
+        processing_steps = fuse_projections(processing_steps)
+    logging.info("processing plan:")
+    for i, step in enumerate(processing_steps):
+        logging.info(f"    {i + 1}. {describe(step)}")
+    return processing_steps
+
+
+def load_processing_steps(specs, fuse=True):
+    """
+    loads the processing steps with ps.load_class and plans them
+
+    :param specs: list of ["PSNAME", "arg1=value1", ...] as given with --processing-step
+    :return: processing steps to run
+    """
+    return plan([ps.load_class(spec) for spec in specs], fuse)
+
+
+def station_plan(processing_steps, station, columns):
+    """
+    returns the processing steps to run on a dataframe of the station with the given columns
+
+    Steps whose declared columns are missing are skipped before any data is touched. The plan of a station
+    is computed once per set of columns, the last STATION_PLAN_CACHE_SIZE plans are kept.
+    """
+    key = (tuple(processing_steps), station, tuple(columns))
+    with _station_plans_lock:
+        steps = _station_plans.get(key)
+        if steps is not None:
+            _station_plans.move_to_end(key)
+            return steps
+
+    steps = []
+    skipped = []
+    # columns passed to the next step, None once a step changes unknown columns
+    names = set(columns)
+    pairs = [(c, c) for c in columns]
+    for step in processing_steps:
+        if step.projection:
+            steps.append(step)
+            if names is not None:
+                pairs = project_columns(step, pairs) or []
+                names = {name for _, name in pairs}
+            continue
+
+        reads = step.reads(station)
+        if names is not None and reads is not None:
+            available = reads & names
+            if not available or (step.reads_all and available != reads):
+                skipped.append(step.ps_name)
+                continue
+        steps.append(step)
+        if step.writes(station) is None:
+            names = None
+
+    if skipped:
+        logging.debug(
+            f"skipping {skipped} for station {station}, their columns are missing ..."
+        )
+    with _station_plans_lock:
+        _station_plans[key] = steps
+        while len(_station_plans) > STATION_PLAN_CACHE_SIZE:
+            _station_plans.popitem(last=False)
+    return steps
@@ -15,8 +15,20 @@ class BlacklistFilterColumnsPS(ProcessingStep):
       python logstar-receiver.py -m sensor_mapping.json -nodb -ps FilterColumnsPS columns="battery_voltage signal_strength"
       """
 
+    projection = True
+
     def __init__(self, kwargs):
         super().__init__(kwargs)
+        if "columns" not in kwargs:
+            raise ValueError(f"columns missing in {self.ps_name}")
+        self.columns = kwargs["columns"].split(" ")
+
+    def drops(self, columns):
+        return set(self.columns)
+
+    def required_columns(self, columns, available, station):
+        # removed columns are not requested at all
+        return set(columns) - set(self.columns)
 
     def process(self, df: pd.DataFrame, station: str):
         """
@@ -29,14 +41,16 @@ class BlacklistFilterColumnsPS(ProcessingStep):
         Returns:
             pd.DataFrame: The processed pandas DataFrame.
         """
-        columns = self.args["columns"].split(" ")
+        columns = self.columns
         logging.debug(
             f"running {self.ps_name} and removing following columns: {columns} ..."
         )
 
-        try:
-            for column in columns:
-                df.drop(column, axis=1, inplace=True)
-        except:
-            logging.error("Could not filter out column: {}".format(column))
+        # columns might be missing if they were not requested, see required_columns
+        missing = [column for column in columns if column not in df.columns]
+        if missing:
+            logging.debug(f"columns {missing} not found in {station} ...")
+        df.drop(
+            [column for column in columns if column in df.columns], axis=1, inplace=True
+        )
         return df
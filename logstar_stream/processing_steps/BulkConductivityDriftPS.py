@@ -2,13 +2,31 @@ from logstar_stream.processing_steps.ProcessingStep import ProcessingStep
 import math
 import logging
 
+import numpy as np
 import pandas as pd
 
 
 class BulkConductivityDriftPS(ProcessingStep):
     ps_name = "BulkConductivityDriftPS"
 
-    ps_description = "TODO"
+    ps_description = """
+      Removes drifting bulk conductivity values. A value is removed if it is higher than threshold_max_value,
+      higher than the value on the other side plus treshold_left_to_right, or higher than the value of the next
+      upper depth plus threshold_between_depth.
+
+      usage like:
+
+      python logstar-receiver.py -m sensor_mapping.json -nodb -co data/ -ps BulkConductivityDriftPS treshold_left_to_right=50 threshold_between_depth=80 threshold_max_value=300
+
+      engine=rowwise checks row by row instead of whole columns and always writes the text changelog,
+      changelog=text (default, or exact_log=true) writes the same changelog entries as engine=rowwise,
+      changelog=csv or changelog=parquet writes a columnar changelog once per run
+      """
+
+    ENGINES = ["vectorized", "rowwise"]
+
+    # the depths and sides are compared with each other
+    reads_all = True
 
     # value to fill if missmeasurement detected
     ERROR_VALUE = pd.NA
@@ -48,6 +66,15 @@ class BulkConductivityDriftPS(ProcessingStep):
             else self.threshold_max_value
         )
 
+        self.engine = kwargs.get("engine", "vectorized")
+        if self.engine not in self.ENGINES:
+            raise ValueError(
+                f"unknown engine {self.engine} for {self.ps_name}, use one of {self.ENGINES}"
+            )
+        # exact_log=true is kept as alias of changelog=text
+        if str(kwargs.get("exact_log", "false")).lower() == "true":
+            self.changelog = "text"
+
         self.to_change = []
 
     def compare_and_prepare_to_change(self, row, row_num):
@@ -112,6 +139,132 @@ class BulkConductivityDriftPS(ProcessingStep):
             ):
                 self.to_change.append((int(row_num), self.ELEMENT_ORDER_RIGHT[i]))
 
+    def change_masks(self, df):
+        """
+        Computes which values to remove as boolean masks over whole columns.
+
+        Args:
+            df (pd.DataFrame): The DataFrame to check, must contain all ELEMENT_ORDER_* columns.
+
+        Returns:
+            list: (depth index, rule index, column name, mask) with rule index 0/1 for left/right difference and
+            max value, 2/3 for left/right difference between depths. Ordered like the row by row check.
+        """
+        left = [
+            df[column].to_numpy(dtype="float64", na_value=np.nan)
+            for column in self.ELEMENT_ORDER_LEFT
+        ]
+        right = [
+            df[column].to_numpy(dtype="float64", na_value=np.nan)
+            for column in self.ELEMENT_ORDER_RIGHT
+        ]
+
+        masks = []
+        # comparisons with NaN are False, so missing values are never removed
+        with np.errstate(invalid="ignore"):
+            for i in range(3):
+                # compare diff between left and right side. If left or right higher than treshold_left_to_right + (left or right) remove the other
+                left_del = (left[i] - right[i] > self.treshold_left_to_right) | (
+                    left[i] > self.threshold_max_value
+                )
+                right_del = (right[i] - left[i] > self.treshold_left_to_right) | (
+                    right[i] > self.threshold_max_value
+                )
+                masks.append((i, 0, self.ELEMENT_ORDER_LEFT[i], left_del))
+                masks.append((i, 1, self.ELEMENT_ORDER_RIGHT[i], right_del))
+
+                # if 30cm depth
+                if i == 0:
+                    continue
+
+                # check distance between depth and next depth is lower than threshold_between_depth
+                left_depth = (
+                    left[i - 1] + self.threshold_between_depth < left[i]
+                ) & ~left_del
+                right_depth = (
+                    right[i - 1] + self.threshold_between_depth < right[i]
+                ) & ~right_del
+                masks.append((i, 2, self.ELEMENT_ORDER_LEFT[i], left_depth))
+                masks.append((i, 3, self.ELEMENT_ORDER_RIGHT[i], right_depth))
+        return masks
+
+    def process_vectorized(self, df: pd.DataFrame, station: str):
+        """
+        removes all values flagged by change_masks, one assignment per column
+
+        Args:
+            df (pd.DataFrame): The DataFrame to process.
+            station (str): The name of the station.
+
+        Returns:
+            pd.DataFrame: The processed DataFrame.
+        """
+        changes = [
+            (i, rule, column, np.flatnonzero(mask))
+            for i, rule, column, mask in self.change_masks(df)
+        ]
+        changes = [change for change in changes if len(change[3])]
+        if not changes:
+            return df
+
+        if self.changelog == "text":
+            # build changelog before changing any value to keep the old values
+            changed = []
+            for _, _, column, row_nums in changes:
+                changed.extend(self.__changed_objects__(df, row_nums, column))
+
+            # order of the row by row check: row, depth, rule
+            row_nums = np.concatenate([change[3] for change in changes])
+            depths = np.concatenate([np.full(len(c[3]), c[0]) for c in changes])
+            rules = np.concatenate([np.full(len(c[3]), c[1]) for c in changes])
+            order = np.lexsort((rules, depths, row_nums))
+            self.changed.extend([changed[j] for j in order])
+
+        to_change_per_column = {}
+        for _, _, column, row_nums in changes:
+            to_change_per_column.setdefault(column, []).append(row_nums)
+        for column, row_nums in to_change_per_column.items():
+            df = self.apply_mask(
+                df,
+                station,
+                column,
+                np.concatenate(row_nums),
+                record=self.changelog != "text",
+            )
+        return df
+
+    def process_rowwise(self, df: pd.DataFrame, station: str):
+        """
+        checks and changes the given DataFrame row by row
+
+        Args:
+            df (pd.DataFrame): The DataFrame to process.
+            station (str): The name of the station.
+
+        Returns:
+            pd.DataFrame: The processed DataFrame.
+        """
+        # iterate over each row of the given data
+        for row_num, row in df.iterrows():
+            [self.compare_and_prepare_to_change(row, row_num)]
+
+        # run do change for all to change values
+        [
+            self.__do_change__(df, row_num, column_name)
+            for row_num, column_name in self.to_change
+        ]
+        self.to_change = []
+        return df
+
+    def reads(self, station):
+        return set(self.ELEMENT_ORDER_LEFT + self.ELEMENT_ORDER_RIGHT)
+
+    def writes(self, station):
+        return set(self.ELEMENT_ORDER_LEFT + self.ELEMENT_ORDER_RIGHT)
+
+    def required_columns(self, columns, available, station):
+        return set(columns) | set(self.ELEMENT_ORDER_LEFT + self.ELEMENT_ORDER_RIGHT)
+
     def process(self, df: pd.DataFrame, station: str):
         """
         Process the given DataFrame for a specific station.
@@ -125,6 +278,9 @@ class BulkConductivityDriftPS(ProcessingStep):
         """
         logging.debug(f"parsing data for station {station} ...")
 
+        if df is None:
+            return None
+
         # check if all required fields are available
         all_requested_columns_available = set(
             self.ELEMENT_ORDER_LEFT + self.ELEMENT_ORDER_RIGHT
@@ -135,18 +291,12 @@ class BulkConductivityDriftPS(ProcessingStep):
             )
             return df
 
-        if df is None:
-            return None
-        # iterate over each row of the given data
-        for row_num, row in df.iterrows():
-            [self.compare_and_prepare_to_change(row, row_num)]
+        if self.engine == "rowwise":
+            df = self.process_rowwise(df, station)
+        else:
+            df = self.process_vectorized(df, station)
 
-        # run do change for all to change values
-        [
-            self.__do_change__(df, row_num, column_name)
-            for row_num, column_name in self.to_change
-        ]
-        self.to_change = []
         # write logs
         self.write_log(station)
+        self.changed = []
         return df
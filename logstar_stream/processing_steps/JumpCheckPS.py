@@ -2,6 +2,7 @@ from typing import List, Dict
 import math
 import logging
 
+import numpy as np
 import pandas as pd
 
 from logstar_stream.processing_steps.ProcessingStep import ProcessingStep
@@ -30,6 +31,13 @@ class JumpCheckPS(ProcessingStep):
         meassurements the values jumps higher than a given Value(MINIMUM_JUMP_DIFFER_VALUE) and jumps back in a given amount
         of meassurements (MAXIMUM_JUMP_DURATION) we delete the so called jump data as we assume that it is missmeassurement
         from the sensor
+
+        usage like:
+
+        python logstar-receiver.py -m sensor_mapping.json -nodb -co data/ -ps JumpCheckPS engine=vectorized
+
+        engine=vectorized (default) scans numpy arrays, engine=rowwise runs the same state machine row by row
+        and always writes the text changelog
         """
 
     # measurements to check for data jumps
@@ -51,9 +59,24 @@ class JumpCheckPS(ProcessingStep):
     # jump difference between two following values
     MINIMUM_JUMP_DIFFER_VALUE = 5.0
 
+    ENGINES = ["vectorized", "rowwise"]
+
     def __init__(self, kwargs):
         super().__init__(kwargs)
         self.env = {}
+        # station -> rows at the end of the last dataframe belonging to an open jump
+        self.open_rows = {}
+        self.engine = kwargs.get("engine", "vectorized")
+        if self.engine not in self.ENGINES:
+            raise ValueError(
+                f"unknown engine {self.engine} for {self.ps_name}, use one of {self.ENGINES}"
+            )
+
+    def get_env(self, object_identifier):
+        """returns the EnvObject for the given station_column identifier, creating and storing it if needed"""
+        if object_identifier not in self.env:
+            self.env[object_identifier] = EnvObject()
+        return self.env[object_identifier]
 
     def change_values(self, df, station_messurement_env):
         """
@@ -84,10 +107,53 @@ class JumpCheckPS(ProcessingStep):
         station_messurement_env.jump_duration = 0
         station_messurement_env.to_change = []
 
+    def reads(self, station):
+        return set(self.JUMP_CHECK_COLUMN_NAMES)
+
+    def writes(self, station):
+        return set(self.JUMP_CHECK_COLUMN_NAMES)
+
+    def required_columns(self, columns, available, station):
+        return set(columns) | set(self.JUMP_CHECK_COLUMN_NAMES)
+
+    def get_station_state(self, station):
+        keys = (station + "_" + column for column in self.JUMP_CHECK_COLUMN_NAMES)
+        return {
+            "env": {key: self.env[key] for key in keys if key in self.env},
+            "open_rows": self.open_rows.get(station, 0),
+        }
+
+    def set_station_state(self, station, state):
+        for column in self.JUMP_CHECK_COLUMN_NAMES:
+            self.env.pop(station + "_" + column, None)
+        self.open_rows.pop(station, None)
+        if state:
+            self.env.update(state["env"])
+            self.open_rows[station] = state["open_rows"]
+
+    def lookahead(self, station):
+        return self.open_rows.get(station, 0)
+
+    def count_open_rows(self, df, station):
+        """number of rows from the first value of a jump which is not closed at the end of df"""
+        first = len(df)
+        for column in self.JUMP_CHECK_COLUMN_NAMES:
+            station_messurement_env = self.env.get(station + "_" + column)
+            if station_messurement_env is None or not station_messurement_env.to_change:
+                continue
+            # row positions (vectorized) or (index, column) tuples (rowwise) of a dataframe with default index
+            row = station_messurement_env.to_change[0]
+            first = min(first, row[0] if isinstance(row, tuple) else row)
+        return len(df) - first
+
     def process(self, df: pd.DataFrame, station: str):
         """
         remove jumps up 5 % for a single measurement
 
+        The state of each station/measurement (last value and an open jump) is kept between calls. Values of an
+        open jump which belong to an earlier dataframe can not be changed anymore and are dropped, streaming.StreamState
+        holds back the rows of open jumps (see lookahead) to process them again with the next chunk.
+
         :param df
         :param station
         :param argument
@@ -98,6 +164,131 @@ class JumpCheckPS(ProcessingStep):
         if df is None:
             return
 
+        for column in self.JUMP_CHECK_COLUMN_NAMES:
+            object_identifier = station + "_" + column
+            if object_identifier in self.env:
+                self.env[object_identifier].to_change = []
+
+        if self.engine == "rowwise":
+            df = self.process_rowwise(df, station)
+        else:
+            df = self.process_vectorized(df, station)
+        self.open_rows[station] = self.count_open_rows(df, station)
+        self.write_log(station)
+        self.changed = []
+        return df
+
+    def scan_column(self, values, station_messurement_env):
+        """
+        Runs the jump check state machine over the values of a single column.
+
+        Jumps are found with vectorized differences, the state machine only runs from each jump up until the jump
+        is closed (jump down, missing value or MAXIMUM_JUMP_DURATION reached).
+
+        Parameters:
+            values (numpy.ndarray): float values of the column, NaN for missing values.
+            station_messurement_env (EnvObject): state from the previous call, updated in place.
+
+        Returns:
+            list: (position of the jump down, positions to change) for each jump to remove.
+        """
+        n = len(values)
+        if n == 0:
+            return []
+
+        last_value = station_messurement_env.last_value
+        previous = np.empty(n, dtype="float64")
+        previous[0] = np.nan if pd.isnull(last_value) else last_value
+        previous[1:] = values[:-1]
+
+        # comparisons with NaN are False, so missing values never count as a jump
+        with np.errstate(invalid="ignore"):
+            jump_down = previous - values >= self.MINIMUM_JUMP_DIFFER_VALUE
+            jump_up = values - previous >= self.MINIMUM_JUMP_DIFFER_VALUE
+        missing = np.isnan(values)
+        jump_up_positions = np.flatnonzero(jump_up)
+
+        jumps = []
+        jump_duration = station_messurement_env.jump_duration
+        to_change = []
+        position = 0
+        while position < n:
+            if jump_duration == 0:
+                k = np.searchsorted(jump_up_positions, position)
+                if k == len(jump_up_positions):
+                    break
+                position = int(jump_up_positions[k])
+
+            # an open jump, runs until it is closed
+            while position < n:
+                if missing[position]:
+                    jump_duration = 0
+                    to_change = []
+                elif jump_down[position]:
+                    jumps.append((position, to_change))
+                    jump_duration = 0
+                    to_change = []
+                else:
+                    jump_duration += 1
+                    to_change.append(position)
+                    # if jump goes on for longer, then we want to keep the data as it is
+                    if jump_duration >= self.MAXIMUM_JUMP_DURATION:
+                        jump_duration = 0
+                        to_change = []
+                position += 1
+                if jump_duration == 0:
+                    break
+
+        station_messurement_env.jump_duration = jump_duration
+        station_messurement_env.to_change = to_change
+        station_messurement_env.last_value = pd.NA if missing[-1] else values[-1]
+        return jumps
+
+    def process_vectorized(self, df: pd.DataFrame, station: str):
+        """
+        runs the jump check state machine on numpy arrays and changes all values of a column at once
+
+        :param df
+        :param station
+
+        :return df
+        """
+        changes = []
+        for column_index, column in enumerate(self.JUMP_CHECK_COLUMN_NAMES):
+            if column not in df.columns:
+                continue
+            station_messurement_env = self.get_env(station + "_" + column)
+            values = df[column].to_numpy(dtype="float64", na_value=np.nan)
+            for position, to_change in self.scan_column(values, station_messurement_env):
+                changes.append((position, column_index, column, to_change))
+
+        if not changes:
+            return df
+
+        if self.changelog == "text":
+            # same order of the changelog as the row by row engine, by jump down and column
+            changes.sort(key=lambda change: change[:2])
+            for _, _, column, to_change in changes:
+                self.changed.extend(self.__changed_objects__(df, to_change, column))
+
+        to_change_per_column = {}
+        for _, _, column, to_change in changes:
+            to_change_per_column.setdefault(column, []).extend(to_change)
+        for column, to_change in to_change_per_column.items():
+            df = self.apply_mask(
+                df, station, column, to_change, record=self.changelog != "text"
+            )
+        return df
+
+    def process_rowwise(self, df: pd.DataFrame, station: str):
+        """
+        runs the jump check state machine row by row
+
+        :param df
+        :param station
+
+        :return df
+        """
         for index, row in df.iterrows():
             # get through all defined measurements in JUMP_CHECK_MEASUREMENTS
             for column in self.JUMP_CHECK_COLUMN_NAMES:
@@ -105,11 +296,7 @@ class JumpCheckPS(ProcessingStep):
                     continue
 
                 object_identifier = station + "_" + column
-                station_messurement_env = (
-                    EnvObject()
-                    if object_identifier not in self.env
-                    else self.env[object_identifier]
-                )
+                station_messurement_env = self.get_env(object_identifier)
                 current_value = row[column]
 
                 # check if current_value is nan
@@ -149,7 +336,4 @@ class JumpCheckPS(ProcessingStep):
                     self.reset_counters(station_messurement_env)
 
                 station_messurement_env.last_value = current_value
-                self.env[object_identifier] = station_messurement_env
-        self.write_log(station)
-        self.changed = []
         return df
@@ -1,16 +1,27 @@
 import sys
 import os
 import importlib
-from typing import Dict
+import threading
+from typing import Dict, List, Optional, Set
 import logging
 
+import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow
+except ImportError:  # parquet changelogs are optional
+    pyarrow = None
+
 PS_DIR = "logstar_stream/processing_steps/"
 PS_MOD_DIR = PS_DIR.replace("/", ".")
 
 PS_LOGGING_DIR = "logs/"
 
+# text (default): one line per change written by write_log after each process call
+# csv/parquet: columnar changelog written once per run by flush_change_log
+CHANGELOG_FORMATS = ["text", "csv", "parquet"]
+
 
 def load_class(p):
     """
@@ -48,6 +59,19 @@ class ProcessingStep(object):
         "Abstract Processing Step description, please overwrite when inheriting"
     )
     changed = []
+    PS_LOGGING_DIR = PS_LOGGING_DIR
+
+    # value to fill if missmeasurement detected
+    ERROR_VALUE = np.nan
+
+    # rows before the first new row the step has to see again, e.g. for a rolling window, see streaming.StreamState
+    lookback = 0
+
+    # the step only renames, selects or drops columns (see renames, keeps and drops), see planner
+    projection = False
+
+    # the step only runs if all columns of reads are available, otherwise if any of them is
+    reads_all = False
 
     def __init__(self, kwargs):
         if "PS_LOGGING_DIR" in kwargs:
@@ -55,10 +79,126 @@ class ProcessingStep(object):
         self.changed = []
         self.args = kwargs
 
+        self.changelog = kwargs.get("changelog", "text")
+        if self.changelog not in CHANGELOG_FORMATS:
+            raise ValueError(
+                f"unknown changelog {self.changelog} for {self.ps_name}, use one of {CHANGELOG_FORMATS}"
+            )
+        # station -> list of recorded changes, see record_changes
+        self.change_log = {}
+        self._change_log_lock = threading.Lock()
+
     def process(self, df: pd.DataFrame, station: str) -> pd.DataFrame:
         """processes data and may manipulates it"""
         raise NotImplementedError
 
+    def __getstate__(self):
+        """processing steps are pickled to run in worker processes, see parallel.ProcessingPool"""
+        state = self.__dict__.copy()
+        state.pop("_change_log_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._change_log_lock = threading.Lock()
+
+    def get_station_state(self, station: str):
+        """
+        state kept in between process calls for the station, shipped to and from worker processes
+
+        steps keeping state must keep it per station and override get_station_state and set_station_state.
+        The state is only carried over to the next dataframe of the station by streaming.StreamState, which
+        passes the chunks in order and without overlap, otherwise it is cleared before every dataframe
+        (see logstar.reset_station_state).
+
+        :param station: station name as passed to process
+        :return: picklable state, None if the step keeps no state
+        """
+        return None
+
+    def set_station_state(self, station: str, state) -> None:
+        """
+        replaces the state of the station
+
+        :param station: station name as passed to process
+        :param state: state as returned by get_station_state, None clears the state
+        """
+
+    def lookahead(self, station: str) -> int:
+        """
+        rows at the end of the last dataframe of the station whose values may still change with later rows
+
+        e.g. the values of a jump which is not closed yet. streaming.StreamState holds these rows back and
+        processes them again with the next chunk, so chunked runs give the same values as a single run.
+
+        :param station: station name as passed to process
+        :return: number of rows, 0 if all values are final
+        """
+        return 0
+
+    def pop_change_log(self, station: str):
+        """removes and returns the recorded columnar changes of the station"""
+        with self._change_log_lock:
+            return self.change_log.pop(station, [])
+
+    def extend_change_log(self, station: str, changes) -> None:
+        """appends changes returned by pop_change_log of another instance, e.g. in a worker process"""
+        if not changes:
+            return
+        with self._change_log_lock:
+            self.change_log.setdefault(station, []).extend(changes)
+
+    def reads(self, station: str) -> Optional[Set[str]]:
+        """
+        columns whose values the step reads, the planner skips the step for a station without them
+
+        :param station: station name as passed to process
+        :return: column names, None if the step does not declare them and always runs
+        """
+        return None
+
+    def writes(self, station: str) -> Optional[Set[str]]:
+        """
+        columns whose values the step changes, columns are never added or removed by steps which declare them
+
+        :param station: station name as passed to process
+        :return: column names, None if the step does not declare them
+        """
+        return None
+
+    def renames(self) -> Dict[str, str]:
+        """columns renamed by a projection step, old name -> new name"""
+        return {}
+
+    def keeps(self) -> Optional[List[str]]:
+        """
+        columns selected by a projection step in this order, the result is an empty dataframe if any is missing
+
+        :return: column names, None if the step does not select columns
+        """
+        return None
+
+    def drops(self, columns: List[str]) -> Set[str]:
+        """
+        columns removed by a projection step
+
+        :param columns: columns of the dataframe passed to process
+        """
+        return set()
+
+    def required_columns(
+        self, columns: Set[str], available: Set[str], station: str
+    ) -> Set[str]:
+        """
+        columns this step needs in its input to provide the given columns, used to request only needed channels
+
+        :param columns: columns needed after this step
+        :param available: all columns of the station
+        :param station: station name as passed to process
+        :return: columns needed before this step, all available columns if the step does not declare less
+        """
+        return set(available)
+
     def __do_change__(self, df, row_num, column_name):
         """
         function to change given values and add them to the changed list. Which is preparation to write the log with write_log
@@ -105,6 +245,185 @@ class ProcessingStep(object):
         df.at[row_num, column_name] = self.ERROR_VALUE
         return df
 
+    def __changed_objects__(self, df, row_nums, column_name):
+        """
+        builds the changed objects __do_change__ would create for the given row positions, without changing df
+
+        :param df: dataframe the values are in
+        :param row_nums: row positions of the values to change
+        :param column_name: column name of the values to change
+        """
+        old_values = df[column_name].iloc[row_nums].tolist()
+        # depends on config.dateTime if 1: „date“: „2020-04-01“, „time“: „00:00:00“
+        if "date" in df.columns and "time" in df.columns:
+            dates = df["date"].iloc[row_nums].tolist()
+            times = df["time"].iloc[row_nums].tolist()
+            return [
+                {
+                    "messurement": column_name,
+                    "date": date,
+                    "time": time,
+                    "old_value": old_value,
+                    "new_value": self.ERROR_VALUE,
+                }
+                for date, time, old_value in zip(dates, times, old_values)
+            ]
+        # if 0 (default): „dateTime“: „2020-04-01 00:00:00“
+        if "dateTime" in df.columns:
+            date_times = df["dateTime"].iloc[row_nums].tolist()
+            return [
+                {
+                    "messurement": column_name,
+                    "dateTime": date_time,
+                    "old_value": old_value,
+                    "new_value": self.ERROR_VALUE,
+                }
+                for date_time, old_value in zip(date_times, old_values)
+            ]
+        return [
+            {
+                "messurement": column_name,
+                "old_value": old_value,
+                "new_value": self.ERROR_VALUE,
+            }
+            for old_value in old_values
+        ]
+
+    @staticmethod
+    def __datetime_column__(df):
+        """name of the first datetime column of df, None if there is none"""
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                return column
+        return None
+
+    @staticmethod
+    def __change_timestamps__(df, row_nums):
+        """timestamps of the given row positions for the columnar changelog"""
+        column = ProcessingStep.__datetime_column__(df)
+        if column is not None:
+            return df[column].to_numpy()[row_nums]
+        if "date" in df.columns and "time" in df.columns:
+            return (
+                df["date"].astype(str).to_numpy()[row_nums]
+                + " "
+                + df["time"].astype(str).to_numpy()[row_nums]
+            )
+        if "dateTime" in df.columns:
+            return df["dateTime"].to_numpy()[row_nums]
+        return df.index.to_numpy()[row_nums]
+
+    def record_changes(self, df, station, column_name, row_nums):
+        """
+        records the values at the given row positions of column_name as changed in the columnar changelog
+
+        The values are not changed, use apply_mask to record and change them at once.
+
+        :param df: dataframe the values are in
+        :param station: station the dataframe belongs to
+        :param column_name: column name of the changed values
+        :param row_nums: row positions of the changed values
+        """
+        row_nums = np.asarray(row_nums, dtype=np.intp)
+        if not len(row_nums):
+            return
+        changes = {
+            "timestamp": self.__change_timestamps__(df, row_nums),
+            "messurement": column_name,
+            "old_value": df[column_name].to_numpy()[row_nums],
+        }
+        with self._change_log_lock:
+            self.change_log.setdefault(station, []).append(changes)
+
+    def apply_mask(self, df, station, column_name, mask, record=True):
+        """
+        sets all values of column_name selected by mask to ERROR_VALUE in one assignment and records the changes
+
+        :param df: dataframe to edit
+        :param station: station the dataframe belongs to
+        :param column_name: column name of the values to change
+        :param mask: boolean mask over the rows or row positions of the values to change
+        :param record: record the changes, in the changed list for the text changelog or the columnar changelog
+        :return: df
+        """
+        mask = np.asarray(mask)
+        row_nums = np.flatnonzero(mask) if mask.dtype == bool else mask
+        if not len(row_nums):
+            return df
+
+        if record:
+            if self.changelog == "text":
+                self.changed.extend(self.__changed_objects__(df, row_nums, column_name))
+            else:
+                self.record_changes(df, station, column_name, row_nums)
+
+        logging.debug(
+            f"{self.ps_name} | {column_name}: changing {len(row_nums)} values -> {self.ERROR_VALUE}"
+        )
+        if df[column_name].dtype.kind in "iu":
+            # integer columns can not hold ERROR_VALUE
+            df[column_name] = df[column_name].astype("float64")
+        df.iloc[row_nums, df.columns.get_loc(column_name)] = self.ERROR_VALUE
+        return df
+
+    def flush_change_log(self) -> None:
+        """
+        Writes the columnar changelog of all stations and clears it, called once at the end of a run.
+
+        csv changelogs are appended to <ps_name>_<station>.csv, parquet changelogs are written to a new
+        <ps_name>_<station>_<time of flush>.parquet file per run.
+        """
+        with self._change_log_lock:
+            change_log, self.change_log = self.change_log, {}
+
+        if not change_log:
+            return
+
+        if not os.path.exists(self.PS_LOGGING_DIR):
+            logging.warning(
+                f"processing step logging folder: {self.PS_LOGGING_DIR} does not exist, skip logging for {self.ps_name} ..."
+            )
+            return
+
+        changelog = self.changelog
+        if changelog == "parquet" and pyarrow is None:
+            logging.warning(
+                f"pyarrow is not installed, writing csv changelog for {self.ps_name} ..."
+            )
+            changelog = "csv"
+
+        for station, changes in change_log.items():
+            lengths = [len(c["old_value"]) for c in changes]
+            log_df = pd.DataFrame(
+                {
+                    "timestamp": np.concatenate([c["timestamp"] for c in changes]),
+                    "station": station,
+                    "messurement": np.repeat(
+                        [c["messurement"] for c in changes], lengths
+                    ),
+                    "old_value": np.concatenate([c["old_value"] for c in changes]),
+                    "new_value": self.ERROR_VALUE,
+                }
+            )
+
+            if changelog == "parquet":
+                flush_time = pd.Timestamp.now().strftime("%Y%m%dT%H%M%S%f")
+                log_filename = f"{self.ps_name}_{station}_{flush_time}.parquet"
+                log_df.to_parquet(os.path.join(self.PS_LOGGING_DIR, log_filename))
+            else:
+                log_filename = f"{self.ps_name}_{station}.csv"
+                log_path = os.path.join(self.PS_LOGGING_DIR, log_filename)
+                log_df.to_csv(
+                    log_path,
+                    mode="a",
+                    header=not os.path.exists(log_path),
+                    index=False,
+                )
+
+            logging.debug(
+                f"finished writing {len(log_df)} entries into changelog for {log_filename} ..."
+            )
+
     def write_log(self, station) -> None:
         """
         Writes a log entry for the given station.
@@ -116,18 +435,18 @@ class ProcessingStep(object):
             None
         """
 
-        if not os.path.exists(PS_LOGGING_DIR):
-            logging.warning(
-                f"processing step logging folder: {PS_LOGGING_DIR} does not exist, skip logging for {self.ps_name} ..."
-            )
+        if not self.changed:
             return
 
-        if not self.changed:
+        if not os.path.exists(self.PS_LOGGING_DIR):
+            logging.warning(
+                f"processing step logging folder: {self.PS_LOGGING_DIR} does not exist, skip logging for {self.ps_name} ..."
+            )
             return
 
         log_filename = self.ps_name + "_" + station + ".log"
 
-        with open(os.path.join(PS_LOGGING_DIR, log_filename), "a+") as f:
+        with open(os.path.join(self.PS_LOGGING_DIR, log_filename), "a+") as f:
             for d in self.changed:
                 # depends on config.dateTime
                 if "date" in d and "time" in d:
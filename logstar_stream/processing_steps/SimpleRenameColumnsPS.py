@@ -1,6 +1,5 @@
 import pandas as pd
 import logging
-import sys
 
 from logstar_stream.processing_steps.ProcessingStep import ProcessingStep
 
@@ -16,6 +15,8 @@ class SimpleRenameColumnsPS(ProcessingStep):
       python logstar-receiver.py -m sensor_mapping.json -nodb -ps SimpleRenameColumnsPS columns="time date bulk_conductivity_right_30cm"
       """
 
+    projection = True
+
     def __init__(self, kwargs):
         """
         Initializes the SimpleRenameColumnsPS with the given arguments.
@@ -34,14 +35,37 @@ class SimpleRenameColumnsPS(ProcessingStep):
             or "columns" not in kwargs
             or "seperator" not in kwargs
         ):
-            logging.error("columns or seperator missing in {}".format(self.ps_name))
-            logging.error(
-                'use like: python logstar-receiver.py  -nodb -co data/ -ps SimpleRenameColumnsPS columns="Luftfeuchte - \%rF:Luftfeuchte; " seperator=";Lufttemp1 - GradC:Lufttemp1" equal=":"'
+            raise ValueError(
+                f"equal, columns or seperator missing in {self.ps_name}, use like: "
+                'python logstar-receiver.py  -nodb -co data/ -ps SimpleRenameColumnsPS columns="Luftfeuchte - %rF:Luftfeuchte;Lufttemp1 - GradC:Lufttemp1" seperator=";" equal=":"'
             )
-            sys.exit(1)
         self.equal = str(kwargs["equal"])
         self.columns = str(kwargs["columns"])
         self.seperator = str(kwargs["seperator"])
+        self._rename_map = self.parse_rename_map()
+
+    def parse_rename_map(self):
+        """parses the dict of old column name -> new column name given with columns"""
+        columns = self.columns.split(self.seperator)
+        map = {}
+        for s in columns:
+            try:
+                k, v = s.split(self.equal)
+                map[k] = v
+            except:
+                logging.error("could not parse column: {}".format(s))
+        return map
+
+    def rename_map(self):
+        """returns the dict of old column name -> new column name given with columns"""
+        return dict(self._rename_map)
+
+    def renames(self):
+        return self.rename_map()
+
+    def required_columns(self, columns, available, station):
+        original_names = {v: k for k, v in self.rename_map().items()}
+        return {original_names.get(c, c) for c in columns}
 
     def process(self, df: pd.DataFrame, station: str):
         """
@@ -57,14 +81,6 @@ class SimpleRenameColumnsPS(ProcessingStep):
         logging.debug(
             f"running {self.ps_name} and renamning following columns: {self.columns} using seperator: {self.seperator} and equal sign: {self.equal} ..."
         )
-        columns = self.columns.split(self.seperator)
-        map = {}
-        for s in columns:
-            try:
-                k, v = s.split(self.equal)
-                map[k] = v
-            except:
-                logging.error("could not parse column: {}".format(s))
-        df.rename(columns=map, inplace=True)
+        df.rename(columns=self._rename_map, inplace=True)
 
         return df
@@ -1,6 +1,7 @@
 from typing import List, Dict
 import logging
 
+import numpy as np
 import pandas as pd
 
 from logstar_stream.processing_steps.ProcessingStep import ProcessingStep
@@ -9,6 +10,15 @@ from logstar_stream.processing_steps.ProcessingStep import ProcessingStep
 class WeatherStationPrecipitationPS(ProcessingStep):
     ps_name = "WeatherStationPrecipitationPS"
 
+    ps_description = """
+      Removes stuck precipitation values of weather stations. If the same non zero value repeats at least
+      run_length times (default: 3), all values of the run except the first and the last one are removed.
+
+      usage like:
+
+      python logstar-receiver.py -m sensor_mapping.json -nodb -co data/ -ps WeatherStationPrecipitationPS run_length=3
+      """
+
     # value to fill if missmeasurement detected
     ERROR_VALUE = float("NaN")
 
@@ -22,13 +32,127 @@ class WeatherStationPrecipitationPS(ProcessingStep):
     # apply to value
     COLUMN_NAME = "precipitation_surface_-200_cm"
 
+    # number of identical values in a row to detect a stuck value
+    RUN_LENGTH = 3
+
     def __init__(self, kwargs):
         super().__init__(kwargs)
+        self.run_length = int(kwargs.get("run_length", self.RUN_LENGTH))
+        if self.run_length < 3:
+            raise ValueError(
+                f"run_length of {self.ps_name} must be at least 3, got {self.run_length}"
+            )
+        # station -> (value, length, timestamp of the last row) of the run of identical values at the end
+        # of the last dataframe, continued by the next dataframe if it starts after that timestamp
+        self.open_run = {}
+
+    def repeated_values_mask(self, values, run=None):
+        """
+        Finds the inner values of runs of at least run_length identical non zero values.
+
+        Args:
+            values (numpy.ndarray): float values, NaN for missing values.
+            run (tuple, optional): (value, length) of the run right before values, see trailing_run.
+
+        Returns:
+            numpy.ndarray: boolean mask of the values to remove.
+        """
+        n = len(values)
+        if n == 0:
+            return np.zeros(n, dtype=bool)
+
+        # compare each value with the previous one, NaN never equals and ends a run
+        run_starts = np.flatnonzero(
+            np.concatenate(([True], values[1:] != values[:-1]))
+        )
+        run_lengths = np.diff(np.append(run_starts, n))
+
+        # rows of the run before values, if the first run continues it
+        before = np.zeros(len(run_starts), dtype=np.int64)
+        if run is not None and values[0] == run[0]:
+            before[0] = run[1]
+
+        run_length_of_row = np.repeat(run_lengths + before, run_lengths)
+        position_in_run = (
+            np.arange(n)
+            - np.repeat(run_starts, run_lengths)
+            + np.repeat(before, run_lengths)
+        )
+        return (
+            (run_length_of_row >= self.run_length)
+            & (position_in_run > 0)
+            & (position_in_run < run_length_of_row - 1)
+            & (values != 0.0)
+            & ~np.isnan(values)
+        )
+
+    def trailing_run(self, values, run=None, until=None):
+        """
+        (value, length, until) of the run at the end of values which may still grow, None for zero or missing values
+
+        :param run: (value, length, until) of the run right before values, see repeated_values_mask
+        :param until: timestamp of the last value, the run is only continued by values after it
+        """
+        if not len(values):
+            return run
+        if np.isnan(values[-1]) or values[-1] == 0.0 or until is None:
+            return None
+        different = np.flatnonzero(values != values[-1])
+        length = len(values) - (different[-1] + 1 if len(different) else 0)
+        if not len(different) and run is not None and run[0] == values[-1]:
+            length += run[1]
+        return (float(values[-1]), int(length), until)
+
+    def continued_run(self, df, station):
+        """
+        the open run of the station if df starts after it, None otherwise
+
+        Dataframes which overlap the last one (e.g. the same window downloaded again) or have no datetime
+        column start without a run.
+        """
+        run = self.open_run.get(station)
+        column = self.__datetime_column__(df)
+        if not len(df):
+            return run
+        if run is None or column is None:
+            return None
+        first = df[column].iloc[0]
+        if pd.isnull(first) or first <= run[2]:
+            return None
+        return run
+
+    def get_station_state(self, station):
+        return self.open_run.get(station)
+
+    def set_station_state(self, station, state):
+        self.open_run.pop(station, None)
+        # states stored before the value and end of the run were kept are ignored
+        if isinstance(state, (tuple, list)) and len(state) == 3:
+            self.open_run[station] = tuple(state)
+
+    def lookahead(self, station):
+        # the values of the last run depend on its length and end
+        run = self.open_run.get(station)
+        return run[1] if run else 0
+
+    def reads(self, station):
+        return {self.COLUMN_NAME} if station in self.ALLOWED_STATIONS else set()
+
+    def writes(self, station):
+        return self.reads(station)
+
+    def required_columns(self, columns, available, station):
+        if station not in self.ALLOWED_STATIONS:
+            return set(columns)
+        return set(columns) | {self.COLUMN_NAME}
 
     def process(self, df: pd.DataFrame, station: str, argument: List = None):
         """
         Process the given DataFrame by checking for anomalies in the specified station's measurements.
 
+        Dataframes of stations not in ALLOWED_STATIONS or without COLUMN_NAME are passed through unchanged.
+        A run of identical values at the end of the last dataframe is only continued if df starts after it.
+
         Args:
             df (pd.DataFrame): The DataFrame to be processed.
             station (str): The station name.
@@ -37,32 +161,26 @@ class WeatherStationPrecipitationPS(ProcessingStep):
         Returns:
             pd.DataFrame: The processed DataFrame with anomalous measurements replaced.
         """
-        if station not in self.ALLOWED_STATIONS:
-            return
-
-        if df is None:
-            return
-
-        for i, row in df.iterrows():
-            if i == 0 or i == len(df) or row[self.COLUMN_NAME] == 0.0:
-                continue
-
-            if (
-                row[self.COLUMN_NAME]
-                == df.at[i - 1, self.COLUMN_NAME]
-                == df.at[i + 1, self.COLUMN_NAME]
-            ):
-                logging.debug(
-                    f"{self.ps_name} | {row['date']} {row['time']}: {row[self.COLUMN_NAME]} -> {self.ERROR_VALUE}"
-                )
-                changed_object = {
-                    "messurement": self.COLUMN_NAME,
-                    "date": row["date"],
-                    "time": row["time"],
-                    "old_value": df.at[i, self.COLUMN_NAME],
-                    "new_value": self.ERROR_VALUE,
-                }
-                df.at[i, self.COLUMN_NAME] = self.ERROR_VALUE
-                self.changed.append(changed_object)
+        if df is None or station not in self.ALLOWED_STATIONS:
+            return df
+
+        if self.COLUMN_NAME not in df.columns:
+            logging.debug(
+                f"did not found {self.COLUMN_NAME} in {station} to run {self.ps_name}"
+            )
+            return df
+
+        values = df[self.COLUMN_NAME].to_numpy(dtype="float64", na_value=np.nan)
+        run = self.continued_run(df, station)
+        column = self.__datetime_column__(df)
+        until = df[column].iloc[-1] if column is not None and len(df) else None
+        mask = self.repeated_values_mask(values, run)
+        self.set_station_state(
+            station,
+            self.trailing_run(values, run, None if pd.isnull(until) else until),
+        )
+        df = self.apply_mask(df, station, self.COLUMN_NAME, mask)
+
         self.write_log(station)
+        self.changed = []
         return df
@@ -15,8 +15,19 @@ class WhitelistFilterColumnsPS(ProcessingStep):
       python logstar-receiver.py -m sensor_mapping.json -nodb -ps FilterColumnsPS columns="time date bulk_conductivity_right_30cm"
       """
 
+    projection = True
+
     def __init__(self, kwargs):
         super().__init__(kwargs)
+        if "columns" not in kwargs:
+            raise ValueError(f"columns missing in {self.ps_name}")
+        self.columns = kwargs["columns"].split(" ")
+
+    def keeps(self):
+        return list(self.columns)
+
+    def required_columns(self, columns, available, station):
+        return set(self.columns)
 
     def process(self, df: pd.DataFrame, station: str):
         """
@@ -29,7 +40,7 @@ class WhitelistFilterColumnsPS(ProcessingStep):
         Returns:
             pd.DataFrame: The processed DataFrame.
         """
-        columns = self.args["columns"].split(" ")
+        columns = self.columns
         logging.debug(
             f"running {self.ps_name} and only pass through following columns: {columns} ..."
         )
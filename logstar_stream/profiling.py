@@ -0,0 +1,222 @@
+import cProfile
+import io
+import linecache
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# functions and allocation sites listed in the reports
+PROFILE_TOP_N = 20
+
+# frames stored per allocation by tracemalloc
+TRACEMALLOC_FRAMES = 1
+
+
+class StageProfile(object):
+    """cpu profile and allocations of a stage of a station, summed over all calls"""
+
+    def __init__(self):
+        self.stats = None
+        self.calls = 0
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        # "file:line" -> [bytes, blocks] still allocated at the end of the stage
+        self.allocations = {}
+
+
+class StageProfiler(object):
+    """
+    Profiles the stages recorded by metrics.stage with cProfile and tracemalloc.
+
+    Every stage of every station (and processing step) gets its own profile, summed over all calls.
+    tracemalloc only runs while a stage is profiled, so the allocation report of a stage lists the
+    memory it allocated and still held at its end. Stages running concurrently in other threads
+    (pipeline, backfill, scheduler) show up in each other's allocation reports, cpu profiles are
+    per thread. Install it with metrics.get_metrics().profiler = StageProfiler(directory).
+    """
+
+    def __init__(self, directory, top_n=PROFILE_TOP_N, trace_memory=True):
+        """
+        :param directory: folder the reports are written to, created if missing
+        :param top_n: number of functions and allocation sites per report
+        :param trace_memory: also trace allocations with tracemalloc
+        """
+        self.directory = directory
+        self.top_n = top_n
+        self.trace_memory = trace_memory
+        self.profiles = {}
+        # stages which could not be profiled because another profiler was active
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tracing = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _start_tracing(self):
+        with self._lock:
+            if self._tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._owns_tracing = True
+            elif self._tracing == 0:
+                self._owns_tracing = False
+            self._tracing += 1
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+
+    def _stop_tracing(self, base):
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        with self._lock:
+            self._tracing -= 1
+            if self._tracing == 0 and self._owns_tracing:
+                tracemalloc.stop()
+
+        snapshot = snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        )
+        allocations = {}
+        for statistic in snapshot.statistics("lineno"):
+            frame = statistic.traceback[0]
+            allocations[f"{frame.filename}:{frame.lineno}"] = (statistic.size, statistic.count)
+        return peak, allocations
+
+    @contextmanager
+    def profile(self, stage, station=None, **labels):
+        """profiles the block as stage of station, nested stages are part of the outer stage"""
+        if getattr(self._local, "active", False):
+            yield
+            return
+        self._local.active = True
+        key = (stage, labels.get("step"), station)
+
+        base = self._start_tracing() if self.trace_memory else None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # a single profiler per process since python 3.12, stages running concurrently are skipped
+            profile = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            peak, allocations = (
+                self._stop_tracing(base) if self.trace_memory else (0, {})
+            )
+            self._local.active = False
+
+            with self._lock:
+                entry = self.profiles.setdefault(key, StageProfile())
+                entry.calls += 1
+                entry.seconds += seconds
+                entry.peak_bytes = max(entry.peak_bytes, peak)
+                for site, (size, count) in allocations.items():
+                    total = entry.allocations.setdefault(site, [0, 0])
+                    total[0] += size
+                    total[1] += count
+                if profile is None:
+                    self.skipped += 1
+                elif entry.stats is None:
+                    entry.stats = pstats.Stats(profile)
+                else:
+                    entry.stats.add(profile)
+
+    @staticmethod
+    def file_name(key):
+        """file name of the reports of a stage, without extension"""
+        name = "-".join(str(part) for part in key if part is not None)
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+    def _allocation_report(self, key, entry):
+        lines = [
+            f"{' '.join(str(part) for part in key if part is not None)}: {entry.calls} calls, "
+            f"{entry.seconds:.3f} s, peak {entry.peak_bytes / 1024:.1f} KiB",
+            "",
+            f"top {self.top_n} allocation sites still allocated at the end of the stage, summed over all calls:",
+        ]
+        top = sorted(entry.allocations.items(), key=lambda item: item[1][0], reverse=True)
+        for site, (size, count) in top[: self.top_n]:
+            filename, _, lineno = site.rpartition(":")
+            source = linecache.getline(filename, int(lineno)).strip()
+            lines.append(f"{size / 1024:12.1f} KiB {count:8d} blocks  {site}")
+            if source:
+                lines.append(f"{'':32s}{source}")
+        return "\n".join(lines) + "\n"
+
+    def hot_spots(self):
+        """
+        returns the lines of the hot spot summary: stages by time and functions by own time over all stages
+        """
+        with self._lock:
+            profiles = dict(self.profiles)
+
+        lines = ["stages by time:"]
+        for key, entry in sorted(profiles.items(), key=lambda item: -item[1].seconds)[
+            : self.top_n
+        ]:
+            label = " ".join(str(part) for part in key if part is not None)
+            lines.append(
+                f"\t{entry.seconds:8.3f} s {entry.calls:5d} calls {entry.peak_bytes / 1e6:8.1f} MB peak  {label}"
+            )
+
+        merged = [entry.stats for entry in profiles.values() if entry.stats is not None]
+        if merged:
+            total = pstats.Stats()
+            total.add(*merged)
+            lines.append("functions by own time:")
+            functions = sorted(total.stats.items(), key=lambda item: -item[1][2])
+            for (filename, lineno, function), (_, calls, tottime, cumtime, _) in functions[
+                : self.top_n
+            ]:
+                lines.append(
+                    f"\t{tottime:8.3f} s own {cumtime:8.3f} s cumulative {calls:8d} calls  "
+                    f"{function} ({os.path.basename(filename)}:{lineno})"
+                )
+        if self.skipped:
+            lines.append(f"{self.skipped} stages not profiled, another profiler was active")
+        return lines
+
+    def write_reports(self):
+        """
+        writes <stage>[-<step>]-<station>.pstats and .alloc.txt per stage and the hot spot summary.txt
+
+        the pstats files can be read with python -m pstats or snakeviz
+        """
+        with self._lock:
+            profiles = dict(self.profiles)
+
+        for key, entry in profiles.items():
+            path = os.path.join(self.directory, self.file_name(key))
+            if entry.stats is not None:
+                entry.stats.dump_stats(path + ".pstats")
+            if self.trace_memory:
+                with open(path + ".alloc.txt", "w") as f:
+                    f.write(self._allocation_report(key, entry))
+
+        lines = self.hot_spots()
+        with open(os.path.join(self.directory, "summary.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+            # full listing of the merged profile
+            merged = [e.stats for e in profiles.values() if e.stats is not None]
+            if merged:
+                stream = io.StringIO()
+                stats = pstats.Stats(stream=stream)
+                stats.add(*merged)
+                stats.sort_stats("cumulative").print_stats(self.top_n * 2)
+                f.write("\n" + stream.getvalue())
+        return lines
+
+    def log_report(self):
+        """writes the reports and logs the hot spot summary"""
+        lines = self.write_reports()
+        logging.info(f"profiles written to {self.directory} ...")
+        for line in lines:
+            logging.info(line.replace("\t", "    "))
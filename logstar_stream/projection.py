@@ -0,0 +1,104 @@
+import logging
+import threading
+
+from logstar_stream.sensor_mapping import FIELDS_TO_IGNORE, compile_sensor_mapping
+
+# separator of the channel ids in the {Channellist} part of the url
+CHANNEL_SEPARATOR = ","
+
+# requests all channels of a station
+ALL_CHANNELS = 0
+
+# time columns are delivered with every channel list and are never requested as channel
+TIME_FIELDS = set(FIELDS_TO_IGNORE) | {"Date", "Time"}
+
+
+class ChannelProjection(object):
+    """
+    Requests only the channels of a station which are needed to build the output.
+
+    The needed columns are resolved backwards through the processing steps (see
+    ProcessingStep.required_columns), starting with the columns given with columns or all columns
+    of the station. They are mapped through the sensor mapping to the channel ids (keys of the
+    header) of the station. The header of a station is learned from its first download, which
+    requests all channels, so the result never differs from a download of all channels.
+    """
+
+    def __init__(self, processing_steps=None, sensor_mapping=None, columns=None):
+        """
+        :param processing_steps: processing steps run on the downloaded data
+        :param sensor_mapping: sensor mapping used to rename the columns
+        :param columns: columns to keep in the output, all columns if None
+        """
+        self.processing_steps = processing_steps or []
+        self.sensor_mapping = (
+            compile_sensor_mapping(sensor_mapping) if sensor_mapping else None
+        )
+        self.columns = set(columns) if columns else None
+        self._headers = {}
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def learn(self, station, header):
+        """stores the header of a download of all channels of the station"""
+        header = dict(header)
+        with self._lock:
+            if self._headers.get(station) == header:
+                return
+            self._headers[station] = header
+            self._channels.pop(station, None)
+
+    def channels(self, station):
+        """
+        returns the channel ids to request for the station, or ALL_CHANNELS if the header of the
+        station is unknown or all channels are needed
+        """
+        with self._lock:
+            if station in self._channels:
+                return self._channels[station]
+            header = self._headers.get(station)
+        if header is None:
+            return ALL_CHANNELS
+
+        channels = self._resolve(station, header)
+        with self._lock:
+            self._channels[station] = channels
+        return channels
+
+    def _resolve(self, station, header):
+        name = station
+        mapped = header
+        if self.sensor_mapping is not None:
+            mapped = self.sensor_mapping.column_names(station, header) or header
+            name = self.sensor_mapping.station_name(station)
+
+        # column name of every channel, like in logstar.prepare_dataframe
+        names = {
+            key: mapped.get(key, key)
+            for key, raw_name in header.items()
+            if raw_name not in TIME_FIELDS
+        }
+        available = set(names.values())
+
+        # output columns may be created by the steps, e.g. renamed, so they are only compared with
+        # the columns of the station once resolved back to the downloaded columns
+        needed = available if self.columns is None else set(self.columns)
+        for step in reversed(self.processing_steps):
+            needed = set(step.required_columns(needed, available, name))
+        needed &= available
+
+        keys = [key for key, column in names.items() if column in needed]
+        if not keys or len(keys) == len(names):
+            return ALL_CHANNELS
+
+        logging.debug(
+            f"requesting {len(keys)} of {len(names)} channels of station {station} ..."
+        )
+        return keys
+
+    def project(self, df, datetime_column="Datetime"):
+        """drops all columns which are not in columns, time columns are kept"""
+        if self.columns is None:
+            return df
+        keep = self.columns | TIME_FIELDS | {datetime_column}
+        return df[[c for c in df.columns if c in keep]]
@@ -0,0 +1,379 @@
+import logging
+import os
+
+import pandas as pd
+import sqlalchemy as sq
+
+import logstar_stream.logstar as logstar
+import logstar_stream.metrics as metrics
+from logstar_stream.backfill import plan_windows
+from logstar_stream.streaming import StreamState
+
+# prefix of the tables holding the raw data of a station, raw_<name>
+RAW_TABLE_PREFIX = "raw_"
+
+# days of raw data queried at once from the database
+REPROCESS_CHUNK_DAYS = 30
+
+# rows fetched at once from a server side cursor or read at once from a csv file
+REPROCESS_CHUNK_ROWS = 50000
+
+# folder inside the csv folder the reprocessed csv files are written to before they replace the old ones
+REPROCESS_CSV_STAGING = ".reprocess"
+
+
+class RawStore(object):
+    """
+    Mapped data of the stations before the processing steps run, so it can be reprocessed later
+    without downloading it again (see run_reprocess).
+
+    Raw data is written like the processed data by logstar.write_station, into the table
+    <db_table_prefix><name> and|or the file <csv_folder>/<name>.csv. Rows already in the table
+    are skipped.
+    """
+
+    def __init__(
+        self,
+        database_engine=None,
+        csv_folder=None,
+        db_schema=None,
+        db_table_prefix=RAW_TABLE_PREFIX,
+        datetime_column="Datetime",
+        db_write_method="insert",
+    ):
+        self.database_engine = database_engine
+        self.csv_folder = csv_folder
+        self.db_schema = db_schema
+        self.db_table_prefix = db_table_prefix
+        self.datetime_column = datetime_column
+        # rows of the raw data never change, updating them is not needed
+        self.db_write_method = "insert" if db_write_method == "upsert" else db_write_method
+        if csv_folder is not None:
+            os.makedirs(csv_folder, exist_ok=True)
+
+    def write(self, name, df, after=None):
+        """
+        stores the mapped dataframe of the station, must be called before the processing steps change it
+
+        :param after: if set, only rows after this timestamp are stored
+        """
+        if df is None:
+            return
+        if after is not None and self.datetime_column in df.columns:
+            df = df[df[self.datetime_column] > after]
+        if df.empty:
+            return
+        logging.debug(f"storing {len(df)} raw rows of station {name} ...")
+        logstar.write_station(
+            name,
+            df,
+            self.database_engine,
+            self.csv_folder,
+            self.db_schema,
+            self.db_table_prefix,
+            self.datetime_column,
+            self.db_write_method,
+        )
+
+
+def raw_stations(
+    database_engine=None, csv_folder=None, db_schema=None, db_table_prefix=RAW_TABLE_PREFIX
+):
+    """returns the names of all stations with raw data in the database, or in csv_folder if set"""
+    if csv_folder is not None:
+        return sorted(
+            f[: -len(".csv")] for f in os.listdir(csv_folder) if f.endswith(".csv")
+        )
+    tables = sq.inspect(database_engine).get_table_names(schema=db_schema)
+    return sorted(
+        t[len(db_table_prefix) :]
+        for t in tables
+        if t.startswith(db_table_prefix) and len(t) > len(db_table_prefix)
+    )
+
+
+def _check_layout(columns, datetime_column, source):
+    """
+    raw data is ordered, windowed and joined on datetime_column, the Date and Time columns of
+    LOGSTAR_DAYTIME other than 0 are not supported
+
+    :raise ValueError: if datetime_column is not in columns
+    """
+    if datetime_column in columns:
+        return
+    if "Date" in columns and "Time" in columns:
+        raise ValueError(
+            f"raw data in {source} has Date and Time columns (LOGSTAR_DAYTIME is not 0), reprocessing needs a {datetime_column} column"
+        )
+    raise ValueError(f"raw data in {source} has no {datetime_column} column")
+
+
+def _typed(df, datetime_column, float_dtype):
+    """converts the columns read back to the dtypes of logstar.prepare_dataframe, integer columns stay int64"""
+    df[datetime_column] = pd.to_datetime(df[datetime_column])
+    for column in df.columns:
+        if column != datetime_column:
+            values = pd.to_numeric(df[column], errors="coerce")
+            if values.dtype.kind != "i":
+                values = values.astype(float_dtype)
+            df[column] = values
+    return df
+
+
+def read_raw_database(
+    database_engine,
+    name,
+    db_schema=None,
+    db_table_prefix=RAW_TABLE_PREFIX,
+    datetime_column="Datetime",
+    startdate=None,
+    enddate=None,
+    chunk_delta=REPROCESS_CHUNK_DAYS,
+    chunk_rows=REPROCESS_CHUNK_ROWS,
+    float_dtype="float64",
+):
+    """
+    yields the raw data of the station from the database as dataframes ordered by datetime_column
+
+    The table is queried in windows of chunk_delta days (see backfill.plan_windows) and every window is
+    fetched from a server side cursor in chunks of chunk_rows rows, so only a single chunk is held in
+    memory.
+
+    :param startdate: first day, as %Y-%m-%d, defaults to the first row of the table
+    :param enddate: last day, as %Y-%m-%d, defaults to the last row of the table
+    """
+    table_name = db_table_prefix + name
+    with database_engine.connect() as conn:
+        table = sq.Table(
+            table_name, sq.MetaData(), schema=db_schema, autoload_with=conn
+        )
+        _check_layout(table.c.keys(), datetime_column, f"table {table_name}")
+        column = table.c[datetime_column]
+        if startdate is None or enddate is None:
+            first, last = conn.execute(
+                sq.select(sq.func.min(column), sq.func.max(column))
+            ).one()
+            if first is None:
+                return
+            startdate = startdate or pd.Timestamp(first).strftime("%Y-%m-%d")
+            enddate = enddate or pd.Timestamp(last).strftime("%Y-%m-%d")
+
+    for start, end in plan_windows(startdate, enddate, chunk_delta):
+        stmt = (
+            sq.select(table)
+            .where(column >= pd.Timestamp(start).to_pydatetime())
+            .where(column < (pd.Timestamp(end) + pd.Timedelta(days=1)).to_pydatetime())
+            .order_by(column)
+        )
+        logging.debug(f"reading raw data of station {name} from {start} to {end} ...")
+        with database_engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, max_row_buffer=chunk_rows
+            ).execute(stmt)
+            for rows in result.partitions(chunk_rows):
+                yield _typed(
+                    pd.DataFrame(rows, columns=list(result.keys())),
+                    datetime_column,
+                    float_dtype,
+                )
+
+
+def read_raw_csv(
+    csv_folder,
+    name,
+    datetime_column="Datetime",
+    startdate=None,
+    enddate=None,
+    chunk_rows=REPROCESS_CHUNK_ROWS,
+    float_dtype="float64",
+):
+    """
+    yields the raw data of the station from <csv_folder>/<name>.csv in chunks of chunk_rows rows
+
+    Every write appends a header and downloads may overlap, so repeated headers and rows which are
+    not after the last yielded row are dropped. Rows are expected in the order they were downloaded.
+
+    :param startdate: first day, as %Y-%m-%d, all rows if None
+    :param enddate: last day, as %Y-%m-%d, all rows if None
+    """
+    first = pd.Timestamp(startdate) if startdate else None
+    until = pd.Timestamp(enddate) + pd.Timedelta(days=1) if enddate else None
+    last = None
+    path = os.path.join(csv_folder, name + ".csv")
+    _check_layout(pd.read_csv(path, nrows=0).columns, datetime_column, path)
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype=str):
+        chunk = chunk[chunk[datetime_column] != datetime_column]
+        chunk = _typed(chunk.copy(), datetime_column, float_dtype)
+        mask = pd.Series(True, index=chunk.index)
+        if last is not None:
+            mask &= chunk[datetime_column] > last
+        if first is not None:
+            mask &= chunk[datetime_column] >= first
+        if until is not None:
+            mask &= chunk[datetime_column] < until
+        chunk = (
+            chunk[mask]
+            .sort_values(datetime_column, kind="stable")
+            .drop_duplicates(datetime_column)
+            .reset_index(drop=True)
+        )
+        if chunk.empty:
+            continue
+        last = chunk[datetime_column].iloc[-1]
+        yield chunk
+
+
+def reprocess_station(
+    name,
+    chunks,
+    stream_state,
+    database_engine=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix="",
+    datetime_column="Datetime",
+    db_write_method="upsert",
+):
+    """
+    runs the processing steps of stream_state on the raw chunks of the station and writes the result
+
+    Chunks are processed like a single download of the whole period, see streaming.StreamState.
+
+    :param chunks: iterator over the raw dataframes of the station, ordered by datetime_column
+    :return: number of written rows
+    """
+    written = 0
+    with metrics.stage("read_raw", name):
+        chunk = next(chunks, None)
+    while chunk is not None:
+        metrics.inc("rows_read_raw", len(chunk), station=name)
+        with metrics.stage("read_raw", name):
+            next_chunk = next(chunks, None)
+
+        df = stream_state.process(name, chunk, final=next_chunk is None)
+        if df is not None and not df.empty:
+            logstar.write_station(
+                name,
+                df,
+                database_engine,
+                csv_folder,
+                db_schema,
+                db_table_prefix,
+                datetime_column,
+                db_write_method,
+            )
+            written += len(df)
+        chunk = next_chunk
+    return written
+
+
+def run_reprocess(
+    processing_steps=None,
+    stations=None,
+    raw_database_engine=None,
+    raw_csv_folder=None,
+    raw_table_prefix=RAW_TABLE_PREFIX,
+    database_engine=None,
+    csv_folder=None,
+    db_schema=None,
+    db_table_prefix="",
+    datetime_column="Datetime",
+    startdate=None,
+    enddate=None,
+    chunk_delta=REPROCESS_CHUNK_DAYS,
+    chunk_rows=REPROCESS_CHUNK_ROWS,
+    float_dtype="float64",
+    db_write_method="upsert",
+):
+    """
+    Runs the processing steps again on the raw data stored with a RawStore and writes the result.
+
+    Raw data is streamed from raw_csv_folder if set, otherwise from the tables <raw_table_prefix><name>
+    of raw_database_engine. With the default db_write_method "upsert" rows already in the table
+    <db_table_prefix><name> are updated, rows which are not written again are kept. Csv files of the
+    reprocessed stations are replaced once a station is completed.
+
+    Args:
+        processing_steps (list, optional): processing steps to run, see planner.load_processing_steps.
+        stations (list, optional): mapped station names, all stations with raw data if None.
+        startdate (str, optional): first day to reprocess, as %Y-%m-%d. The processing steps start
+            without state at the first row, like a download starting at that day.
+        enddate (str, optional): last day to reprocess, as %Y-%m-%d.
+        chunk_delta (int): days queried at once from the database.
+        chunk_rows (int): rows held in memory at once.
+
+    Returns:
+        dict: station name -> number of written rows
+    """
+    if raw_csv_folder is not None and csv_folder is not None:
+        if os.path.abspath(raw_csv_folder) == os.path.abspath(csv_folder):
+            raise ValueError(
+                f"raw data and reprocessed data can not be written to the same csv folder {csv_folder}"
+            )
+    if stations is None:
+        stations = raw_stations(
+            raw_database_engine, raw_csv_folder, db_schema, raw_table_prefix
+        )
+    logging.info(f"reprocessing {len(stations)} stations ...")
+
+    staging = None
+    if csv_folder is not None:
+        staging = os.path.join(csv_folder, REPROCESS_CSV_STAGING)
+        os.makedirs(staging, exist_ok=True)
+
+    stream_state = StreamState(processing_steps, datetime_column)
+    written = {}
+    for name in stations:
+        if raw_csv_folder is not None:
+            chunks = read_raw_csv(
+                raw_csv_folder,
+                name,
+                datetime_column,
+                startdate,
+                enddate,
+                chunk_rows,
+                float_dtype,
+            )
+        else:
+            chunks = read_raw_database(
+                raw_database_engine,
+                name,
+                db_schema,
+                raw_table_prefix,
+                datetime_column,
+                startdate,
+                enddate,
+                chunk_delta,
+                chunk_rows,
+                float_dtype,
+            )
+
+        if staging is not None and os.path.exists(os.path.join(staging, name + ".csv")):
+            os.remove(os.path.join(staging, name + ".csv"))
+        logging.info(f"reprocessing station {name} ...")
+        try:
+            written[name] = reprocess_station(
+                name,
+                chunks,
+                stream_state,
+                database_engine,
+                staging,
+                db_schema,
+                db_table_prefix,
+                datetime_column,
+                db_write_method,
+            )
+        except (sq.exc.NoSuchTableError, FileNotFoundError):
+            logging.error(f"no raw data of station {name} found, skipping ...")
+            continue
+        if staging is not None and written[name]:
+            os.replace(
+                os.path.join(staging, name + ".csv"),
+                os.path.join(csv_folder, name + ".csv"),
+            )
+        logging.info(f"reprocessed {written[name]} rows of station {name} ...")
+
+    # changelogs of the processing steps are written once per run
+    for step in processing_steps or []:
+        step.flush_change_log()
+    return written
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# stations polled at the same time, shared by all stations
+MAX_CONCURRENT_STATIONS = 4
+
+
+class StationSchedule(object):
+    """interval and run statistics of a single station"""
+
+    def __init__(self, station, interval):
+        self.station = station
+        self.interval = interval
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.missed_deadlines = 0
+        self.failures = 0
+        self.last_duration = None
+
+    def __str__(self):
+        return (
+            f"{self.station}: every {self.interval:g} s, {self.runs} runs, {self.skipped} skipped, "
+            f"{self.missed_deadlines} missed deadlines, {self.failures} failed, last run {self.last_duration or 0:.2f} s"
+        )
+
+
+def parse_station_intervals(values, stations, default_interval):
+    """
+    builds the interval of every station in seconds
+
+    :param values: list of "STATION[,STATION...]=MINUTES" strings, e.g. from the command line
+    :param stations: all stations, stations without an entry use default_interval
+    :param default_interval: interval in seconds
+    :raise ValueError: if an entry is malformed, names an unknown station or the interval is not positive
+    """
+    intervals = {station: default_interval for station in stations}
+    for value in values or []:
+        group, sep, minutes = value.partition("=")
+        if not sep:
+            raise ValueError(f"invalid station interval {value}, use STATION[,STATION...]=MINUTES")
+        try:
+            interval = float(minutes) * 60
+        except ValueError:
+            raise ValueError(f"invalid minutes of station interval {value}")
+        if not (0 < interval < math.inf):
+            raise ValueError(f"interval of {value} must be a positive number of minutes")
+        for station in group.split(","):
+            if station not in intervals:
+                raise ValueError(f"station {station} of interval {value} is not in the station list")
+            intervals[station] = interval
+    return intervals
+
+
+class StationScheduler(object):
+    """
+    Polls every station on its own interval with asyncio.
+
+    Runs of a station are started at fixed points in time (start + n * interval plus a random jitter),
+    so the period does not drift by the duration of the runs and a slow station does not delay the
+    others. A run which is still going at its next point in time is not started twice, the point is
+    skipped. Runs taking longer than the deadline are logged. At most max_concurrent stations are
+    polled at the same time, the polls run in a thread pool so the event loop only schedules.
+    """
+
+    def __init__(
+        self,
+        run_station,
+        intervals,
+        jitter=0.0,
+        deadline=None,
+        max_concurrent=MAX_CONCURRENT_STATIONS,
+    ):
+        """
+        :param run_station: callable polling a single station, called with the station name
+        :param intervals: dict of station -> interval in seconds
+        :param jitter: maximum random delay in seconds added to every point in time
+        :param deadline: seconds a run may take, defaults to the interval of the station
+        :param max_concurrent: number of stations polled at the same time
+        """
+        self.run_station = run_station
+        self.schedules = {
+            station: StationSchedule(station, interval)
+            for station, interval in intervals.items()
+        }
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_concurrent = max_concurrent
+        self._stopped = None
+        self._loop = None
+
+    async def _run_once(self, schedule, semaphore, executor):
+        loop = asyncio.get_running_loop()
+        deadline = self.deadline or schedule.interval
+        # the deadline includes the time waiting for a free slot
+        start = time.monotonic()
+        try:
+            async with semaphore:
+                await loop.run_in_executor(executor, self.run_station, schedule.station)
+            schedule.runs += 1
+        except Exception as e:
+            schedule.failures += 1
+            logging.error(f"polling station {schedule.station} failed: {e}")
+        finally:
+            schedule.running = False
+
+        schedule.last_duration = time.monotonic() - start
+        if schedule.last_duration > deadline:
+            schedule.missed_deadlines += 1
+            logging.warning(
+                f"polling station {schedule.station} took {schedule.last_duration:.1f} s, deadline is {deadline:.1f} s ..."
+            )
+
+    async def _station_loop(self, schedule, semaphore, executor):
+        loop = asyncio.get_running_loop()
+        anchor = loop.time()
+        tasks = set()
+        tick = 0
+        while not self._stopped.is_set():
+            # fixed points in time, jitter spreads the stations sharing an interval
+            at = anchor + tick * schedule.interval + random.uniform(0, self.jitter)
+            try:
+                await asyncio.wait_for(self._stopped.wait(), max(0, at - loop.time()))
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            if schedule.running:
+                schedule.skipped += 1
+                logging.warning(
+                    f"skipping poll of station {schedule.station}, previous poll is still running ..."
+                )
+            else:
+                schedule.running = True
+                task = loop.create_task(self._run_once(schedule, semaphore, executor))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            # skip points in time which already passed, e.g. after the machine was suspended
+            tick = max(tick + 1, math.ceil((loop.time() - anchor) / schedule.interval))
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run_async(self, duration=None):
+        """runs until stop is called or for duration seconds"""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrent, thread_name_prefix="logstar-scheduler"
+        ) as executor:
+            loops = [
+                asyncio.create_task(self._station_loop(schedule, semaphore, executor))
+                for schedule in self.schedules.values()
+            ]
+            if duration is not None:
+                asyncio.get_running_loop().call_later(duration, self._stopped.set)
+            try:
+                await asyncio.gather(*loops)
+            finally:
+                for schedule in self.schedules.values():
+                    logging.info(f"scheduled station {schedule}")
+
+    def run(self, duration=None):
+        """blocking variant of run_async"""
+        asyncio.run(self.run_async(duration))
+
+    def stop(self):
+        """stops starting new runs, running polls are finished, can be called from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
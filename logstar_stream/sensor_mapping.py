@@ -0,0 +1,155 @@
+import logging
+import re
+import threading
+
+FIELDS_TO_IGNORE = ["date", "time", "Datetime"]
+
+
+class MeasurementClass(object):
+    """precompiled entry of "measurement-classes" in the sensor mapping"""
+
+    def __init__(self, measurement_class):
+        self.pattern = (
+            re.compile(measurement_class["regex"])
+            if "regex" in measurement_class
+            else None
+        )
+        self.position = measurement_class.get("position", {})
+        # (mapped name, abbreviation, only_includes_abbreviation) in mapping order
+        self.abbreviations = [
+            (
+                name,
+                value["abbreviation"],
+                bool(value.get("only_includes_abbreviation", False)),
+            )
+            for name, value in measurement_class.get("mapping", {}).items()
+        ]
+
+    def map_column(self, c_name_remote):
+        """
+        maps a single remote column name, returns None if no abbreviation matches
+
+        the last matching abbreviation wins
+        """
+        c_name = None
+        match = None
+        for name, abbreviation, only_includes_abbreviation in self.abbreviations:
+            if abbreviation not in c_name_remote:
+                continue
+            if only_includes_abbreviation:
+                c_name = name
+                continue
+
+            if match is None:
+                match = self.pattern.match(c_name_remote)
+
+            # c_name_remote can differ a lot, the design of this names is not properly choosen by UP GmbH
+            # worst case is weather data which supports 3 different pattern:
+
+            # case 1: "WS1_LT_3 - °C
+            if match["number"] is not None:
+                c_name = "{}_{}_{}_cm".format(
+                    name,
+                    self.position[match["number"]]["side"],
+                    self.position[match["number"]]["depth"],
+                )
+            # case 2 "WS1_WG_x - m/s"
+            elif match["string"] is not None:
+                c_name = "{}_{}".format(name, match["string"])
+            # case 3 "WS1_WR - grad"
+            else:
+                c_name = "{}".format(name)
+        return c_name
+
+
+class SensorMapping(object):
+    """
+    sensor mapping json compiled into lookup structures
+
+    Built once at startup. The station lookup is a dict, the measurement class regexes are compiled once and
+    mapped headers are memoized per station and raw header, so repeated chunks and ongoing polls of a station
+    do no mapping work after the first download.
+    """
+
+    def __init__(self, mapping):
+        """
+        :param mapping: sensor mapping as loaded from the sensor mapping json file
+        """
+        self.mapping = mapping
+
+        # station -> name of the sensor-mapping entry, the first entry listing a station wins
+        self.mapping_names = {}
+        for key, value in mapping["sensor-mapping"].items():
+            for station in value["values"]:
+                self.mapping_names.setdefault(station, key)
+
+        self.measurement_classes = {
+            name: MeasurementClass(measurement_class)
+            for name, measurement_class in mapping.get(
+                "measurement-classes", {}
+            ).items()
+        }
+
+        self._headers = {}
+        self._headers_lock = threading.Lock()
+
+    def __getitem__(self, key):
+        return self.mapping[key]
+
+    def find_sensor_mapping(self, station):
+        """returns the name of the sensor-mapping entry listing the station or False"""
+        return self.mapping_names.get(station, False)
+
+    def station_name(self, station):
+        """readable name of the station or the station itself if it is not mapped"""
+        return self.mapping_names.get(station, station)
+
+    def column_names(self, station, header):
+        """
+        maps the column names of the header, see logstar.do_column_name_mapping
+
+        The result is memoized per station and header and must not be modified.
+        """
+        key = (station, tuple(header.items()))
+        with self._headers_lock:
+            if key in self._headers:
+                return self._headers[key]
+
+        new_header = self._map_header(station, header)
+        with self._headers_lock:
+            self._headers[key] = new_header
+        return new_header
+
+    def _map_header(self, station, header):
+        mapping_name = self.find_sensor_mapping(station)
+        if not mapping_name:
+            logging.info(
+                "could not provide measurement mapping for sensor {}, not found ...".format(
+                    station
+                )
+            )
+            return header
+
+        measurement_class_name = self.mapping["sensor-mapping"][mapping_name][
+            "measurement-class"
+        ]
+        measurement_class = self.measurement_classes[measurement_class_name]
+        if measurement_class.pattern is None:
+            return None
+
+        new_header = {}
+        for k, c_name_remote in header.items():
+            if c_name_remote in FIELDS_TO_IGNORE:
+                new_header[k] = c_name_remote
+                continue
+            c_name = measurement_class.map_column(c_name_remote)
+            if c_name is not None:
+                new_header[k] = c_name
+        return new_header
+
+
+def compile_sensor_mapping(mapping):
+    """returns mapping as SensorMapping, compiling it if it is still the plain json dict"""
+    if isinstance(mapping, SensorMapping):
+        return mapping
+    return SensorMapping(mapping)
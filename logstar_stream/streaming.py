@@ -0,0 +1,225 @@
+import copy
+import logging
+import os
+import pickle
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import logstar_stream.logstar as logstar
+from logstar_stream.processing_steps.ProcessingStep import ProcessingStep
+
+# suffix of the files holding the carry of a station
+STATE_SUFFIX = ".state.pkl"
+
+
+class Carry(object):
+    """
+    rows of a station carried over to the next chunk and the state of the processing steps before them
+
+    :param rows: unprocessed rows, the first `emitted` of them are already written and only context
+    :param emitted: number of rows which are context for the lookback of the processing steps
+    :param states: (ps_name, station state) of every processing step before rows
+    :param until: timestamp of the last processed row, later chunks are joined after it
+    """
+
+    def __init__(self, rows, emitted, states, until=None):
+        self.rows = rows
+        self.emitted = emitted
+        self.states = states
+        self.until = until
+
+
+def _changes_within(changes, first, last):
+    """keeps the columnar changes with a timestamp from first to last"""
+    kept = []
+    for change in changes:
+        timestamps = change["timestamp"]
+        mask = (timestamps >= first) & (timestamps <= last)
+        if mask.all():
+            kept.append(change)
+        elif mask.any():
+            kept.append(
+                dict(
+                    change,
+                    timestamp=timestamps[mask],
+                    old_value=change["old_value"][mask],
+                )
+            )
+    return kept
+
+
+class StreamState(object):
+    """
+    Processes the chunks of a station so the result is the same as processing all of them at once.
+
+    Processing steps keep state per station (see ProcessingStep.get_station_state), but the last rows
+    of a chunk may still change with the rows of the next chunk, e.g. a jump of JumpCheckPS which is
+    not closed yet. These rows (ProcessingStep.lookahead) are held back and processed again with the
+    next chunk, together with the rows the steps have to see again (ProcessingStep.lookback), starting
+    from the state of the steps before them. Only final rows are returned to be written, all rows are
+    returned with the last chunk of a run (final).
+
+    With a directory the carry of every station is stored in <directory>/<name>.state.pkl after every
+    chunk and read on the first chunk of the station, so a backfill or ongoing poll continues with
+    the held back rows and the state of the steps after a restart.
+
+    Columnar changelogs only get changes of returned rows. Text changelogs are written while a step
+    runs and list changes of held back rows again.
+    """
+
+    def __init__(self, processing_steps, datetime_column="Datetime", directory=None):
+        """
+        :param processing_steps: processing steps the chunks are run through
+        :param datetime_column: name of the datetime column, chunks are joined on it
+        :param directory: folder the carry of the stations is stored in, kept in memory only if None
+        """
+        self.processing_steps = processing_steps or []
+        self.datetime_column = datetime_column
+        self.directory = directory
+        self.lookback = sum(step.lookback for step in self.processing_steps)
+        self._carries = {}
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(
+            self.directory, re.sub(r"[^A-Za-z0-9_.-]", "_", name) + STATE_SUFFIX
+        )
+
+    def get(self, name):
+        """returns the carry of the station, None if nothing is carried over"""
+        with self._lock:
+            if name in self._carries:
+                return self._carries[name]
+        carry = None
+        if self.directory is not None and os.path.exists(self._path(name)):
+            with open(self._path(name), "rb") as f:
+                carry = pickle.load(f)
+            logging.debug(
+                f"restored {len(carry.rows)} carried rows of station {name} from {self.directory}"
+            )
+        with self._lock:
+            return self._carries.setdefault(name, carry)
+
+    def _store(self, name, carry):
+        with self._lock:
+            self._carries[name] = carry
+        if self.directory is None:
+            return
+        path = self._path(name)
+        if carry is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        # write and rename, a crash never leaves a broken state file
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(carry, f)
+        os.replace(path + ".tmp", path)
+
+    def _restore_states(self, name, carry):
+        names = [step.ps_name for step in self.processing_steps]
+        if carry is not None and [ps_name for ps_name, _ in carry.states] == names:
+            states = [copy.deepcopy(state) for _, state in carry.states]
+        else:
+            if carry is not None:
+                logging.warning(
+                    f"processing steps changed since the carry of station {name} was stored, starting with a new state ..."
+                )
+            states = [None] * len(self.processing_steps)
+        for step, state in zip(self.processing_steps, states):
+            step.set_station_state(name, state)
+
+    def _run(self, name, df, process_pool):
+        return logstar.run_processing_steps(
+            name, df, self.processing_steps, process_pool
+        )
+
+    def process(self, name, df, after=None, final=False, process_pool=None):
+        """
+        runs the processing steps on the next chunk of the station
+
+        :param name: mapped station name
+        :param df: next chunk as returned by logstar.prepare_station, may overlap the last chunk
+        :param after: rows up to this timestamp are already stored, they are only context
+        :param final: last chunk of the run, nothing is held back
+        :param process_pool: parallel.ProcessingPool of the processing steps
+        :return: processed rows which are final
+        """
+        if not self.processing_steps or df is None:
+            return df
+
+        dt = self.datetime_column
+        carry = self.get(name)
+        if carry is not None:
+            if carry.until is not None and dt in df.columns:
+                df = df[df[dt] > carry.until]
+            frame = (
+                pd.concat([carry.rows, df], ignore_index=True)
+                if len(carry.rows)
+                else df.reset_index(drop=True)
+            )
+            start = carry.emitted
+        else:
+            frame = df.reset_index(drop=True)
+            start = 0
+        # without a carry the rows which are already stored rebuild the state of the steps
+        if after is not None and dt in frame.columns:
+            start = max(start, int((frame[dt] <= after).sum()))
+
+        self._restore_states(name, carry)
+        earlier = [step.pop_change_log(name) for step in self.processing_steps]
+        out = self._run(name, frame.copy(), process_pool)
+
+        held = 0
+        if not final:
+            held = sum(step.lookahead(name) for step in self.processing_steps)
+        end = max(start, len(frame) - held)
+        carry_start = max(0, end - self.lookback)
+
+        # only changes of returned rows are logged, held back rows are logged with the next chunk
+        new = [step.pop_change_log(name) for step in self.processing_steps]
+        if end > start:
+            first, last = ProcessingStep.__change_timestamps__(
+                out, np.array([start, end - 1])
+            )
+            earlier = [
+                changes + _changes_within(changes_of_chunk, first, last)
+                for changes, changes_of_chunk in zip(earlier, new)
+            ]
+
+        if final:
+            self._store(name, None)
+        else:
+            if 0 < carry_start < len(frame):
+                # state before the carried rows, the steps run again on the rows before them
+                self._restore_states(name, carry)
+                self._run(name, frame.iloc[:carry_start].copy(), process_pool)
+                for step in self.processing_steps:
+                    step.pop_change_log(name)
+            elif carry_start == 0:
+                self._restore_states(name, carry)
+            states = [
+                (step.ps_name, copy.deepcopy(step.get_station_state(name)))
+                for step in self.processing_steps
+            ]
+            self._store(
+                name,
+                Carry(
+                    frame.iloc[carry_start:].reset_index(drop=True),
+                    end - carry_start,
+                    states,
+                    frame[dt].iloc[-1] if dt in frame.columns and len(frame) else None,
+                ),
+            )
+            if held:
+                logging.debug(
+                    f"holding back {len(frame) - end} rows of station {name} for the next chunk ..."
+                )
+
+        for step, changes in zip(self.processing_steps, earlier):
+            step.extend_change_log(name, changes)
+        return out.iloc[start:end].reset_index(drop=True)
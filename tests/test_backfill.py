@@ -0,0 +1,48 @@
+import pandas as pd
+
+import logstar_stream.backfill as backfill
+import logstar_stream.logstar as logstar
+
+CONF = {"stationlist": ["st1", "st2"], "startdate": "2021-01-01", "enddate": "2021-01-09"}
+
+
+def fake_downloads(monkeypatch, failing):
+    """serves a row per day, downloads of the windows in failing return None"""
+    requested = []
+
+    def download_data(conf, station, *args, **kwargs):
+        requested.append((station, conf["startdate"]))
+        if (station, conf["startdate"]) in failing:
+            return None
+        days = pd.date_range(conf["startdate"], conf["enddate"], freq="D")
+        return {
+            "header": {"0": "Datetime", "1": "value"},
+            "data": [
+                {"0": day.strftime(logstar.LOGSTAR_DATETIME_FORMAT), "1": str(i)}
+                for i, day in enumerate(days)
+            ],
+        }
+
+    monkeypatch.setattr(logstar, "download_data", download_data)
+    return requested
+
+
+def test_failed_window_postpones_later_windows(tmp_path, monkeypatch):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    requested = fake_downloads(monkeypatch, failing={("st1", "2021-01-04")})
+    counts = backfill.run_backfill(CONF, 2, checkpoint=checkpoint, csv_folder=str(tmp_path))
+    assert counts == {"completed": 4, "skipped": 0, "failed": 1, "postponed": 1}
+    assert [start for station, start in requested if station == "st1"] == [
+        "2021-01-01",
+        "2021-01-04",
+    ]
+
+    # the next run resumes at the failed window
+    requested = fake_downloads(monkeypatch, failing=set())
+    counts = backfill.run_backfill(CONF, 2, checkpoint=checkpoint, csv_folder=str(tmp_path))
+    assert counts == {"completed": 2, "skipped": 4, "failed": 0, "postponed": 0}
+    assert requested == [("st1", "2021-01-04"), ("st1", "2021-01-07")]
+
+    df = pd.read_csv(tmp_path / "st1.csv")
+    days = pd.to_datetime(df["Datetime"][df["Datetime"] != "Datetime"])
+    assert days.is_monotonic_increasing and len(days) == 9
@@ -0,0 +1,14 @@
+from logstar_stream.client import LogstarClient
+
+
+def test_report_failures_of_stations():
+    client = LogstarClient()
+    client.record_failure("st1", "2021-01-01", "2021-01-02", "timeout")
+    client.record_failure("st2", "2021-01-01", "2021-01-02", "503")
+
+    assert [f.station for f in client.report_failures(stations=["st1"])] == ["st1"]
+    # failures of other stations are kept for their own report
+    assert not client.has_failed("st1", "2021-01-01", "2021-01-02")
+    assert client.has_failed("st2", "2021-01-01", "2021-01-02")
+    assert [f.station for f in client.report_failures()] == ["st2"]
+    assert client.report_failures() == []
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+import logstar_stream.logstar as logstar
+from logstar_stream.fingerprint import UNCHANGED, FingerprintCache
+from logstar_stream.mock_api import MockLogstarServer
+
+CONF = {
+    "apikey": "key",
+    "startdate": "2021-01-01",
+    "enddate": "2021-01-02",
+    "datetime": 0,
+    "geodata": 0,
+}
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_unchanged_payload_is_not_parsed(monkeypatch, stream):
+    decoded = []
+    decode_stream = logstar.decode_stream
+    monkeypatch.setattr(
+        logstar, "decode_stream", lambda *a, **kw: decoded.append(1) or decode_stream(*a, **kw)
+    )
+    loads = logstar.json.loads
+    monkeypatch.setattr(logstar.json, "loads", lambda *a, **kw: decoded.append(1) or loads(*a, **kw))
+
+    fingerprints = FingerprintCache()
+    with MockLogstarServer(columns=3) as server:
+        monkeypatch.setattr(logstar, "LOGSTAR_API_URL", server.url)
+        data = logstar.download_data(CONF, "st1", stream=stream, fingerprints=fingerprints)
+        assert "columns" in data if stream else "data" in data
+        fingerprints.commit(logstar.fingerprint_key(CONF, "st1"))
+        assert logstar.download_data(CONF, "st1", stream=stream, fingerprints=fingerprints) is UNCHANGED
+    assert len(decoded) == 1
+
+
+def test_download_window_includes_consumed_payload(monkeypatch):
+    started = []
+    monkeypatch.setattr(
+        logstar, "download_data", lambda conf, station, *a, **kw: started.append(station) or {}
+    )
+    conf = dict(CONF, stationlist=[f"st{i}" for i in range(6)])
+    for i, (station, _) in enumerate(logstar.iter_station_downloads(conf, download_workers=2)):
+        time.sleep(0.05)
+        # the payload being consumed and at most one more download
+        assert len(started) - i <= 2
+    assert sorted(started) == conf["stationlist"]
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from logstar_stream.processing_steps.JumpCheckPS import EnvObject, JumpCheckPS
+
+STATION = "station"
+COLUMNS = JumpCheckPS.JUMP_CHECK_COLUMN_NAMES
+
+
+class LegacyJumpCheck(object):
+    """
+    JumpCheckPS.process and ProcessingStep.__do_change__ of the first release, with the two disclosed changes:
+    a new EnvObject is stored (the first release never stored it and never changed a value) and values of an
+    open jump which belong to an earlier dataframe are dropped
+    """
+
+    def __init__(self):
+        self.env = {}
+        self.changed = []
+
+    def do_change(self, df, row_num, column_name):
+        self.changed.append((column_name, df.at[row_num, column_name]))
+        df.at[row_num, column_name] = JumpCheckPS.ERROR_VALUE
+
+    def process(self, df, station):
+        for env in self.env.values():
+            env.to_change = []
+
+        for index, row in df.iterrows():
+            for column in COLUMNS:
+                if column not in row:
+                    continue
+
+                object_identifier = station + "_" + column
+                env = self.env.setdefault(object_identifier, EnvObject())
+                current_value = row[column]
+
+                if current_value is None or pd.isnull(current_value):
+                    env.jump_duration = 0
+                    env.to_change = []
+                    env.last_value = pd.NA
+                    continue
+
+                if pd.isnull(env.last_value):
+                    env.last_value = current_value
+                    continue
+
+                if env.last_value - current_value >= JumpCheckPS.MINIMUM_JUMP_DIFFER_VALUE:
+                    for row_num, column_name in env.to_change:
+                        self.do_change(df, row_num, column_name)
+                    env.jump_duration = 0
+                    env.to_change = []
+                elif (
+                    current_value - env.last_value >= JumpCheckPS.MINIMUM_JUMP_DIFFER_VALUE
+                    or env.jump_duration > 0
+                ):
+                    env.jump_duration += 1
+                    env.to_change.append((index, column))
+
+                if env.jump_duration >= JumpCheckPS.MAXIMUM_JUMP_DURATION:
+                    env.jump_duration = 0
+                    env.to_change = []
+
+                env.last_value = current_value
+        return df
+
+
+class TextLogJumpCheckPS(JumpCheckPS):
+    """keeps the text changelog in memory instead of writing it"""
+
+    def __init__(self, kwargs):
+        super().__init__(kwargs)
+        self.log = []
+
+    def write_log(self, station):
+        self.log.extend((d["messurement"], d["old_value"]) for d in self.changed)
+
+
+def random_frames(seed, rows=300, parts=4):
+    """dataframes of consecutive downloads with jumps up, jumps which last too long, gaps and missing columns"""
+    rng = np.random.default_rng(seed)
+    data = {"Datetime": pd.date_range("2021-01-01", periods=rows, freq="10min")}
+    for column in COLUMNS[:-1]:
+        values = rng.normal(25, 1, rows)
+        for start in rng.integers(0, rows - 14, 12):
+            values[start : start + rng.integers(1, 14)] += rng.choice([6, 12, -8])
+        values[rng.integers(0, rows, 6)] = np.nan
+        data[column] = values
+    df = pd.DataFrame(data)
+    bounds = [0] + sorted(rng.choice(np.arange(1, rows), parts - 1, replace=False)) + [rows]
+    return [
+        df.iloc[start:end].reset_index(drop=True)
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+@pytest.mark.parametrize("engine", JumpCheckPS.ENGINES)
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_legacy(engine, seed, tmp_path):
+    frames = random_frames(seed)
+    legacy = LegacyJumpCheck()
+    step = TextLogJumpCheckPS(
+        {"engine": engine, "changelog": "text", "PS_LOGGING_DIR": str(tmp_path)}
+    )
+    for frame in frames:
+        expected = legacy.process(frame.copy(), STATION)
+        result = step.process(frame.copy(), STATION)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    assert legacy.changed
+    assert step.log == legacy.changed
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_columnar_changelog_matches_legacy(seed, tmp_path):
+    legacy = LegacyJumpCheck()
+    step = JumpCheckPS({"PS_LOGGING_DIR": str(tmp_path), "changelog": "csv"})
+    for frame in random_frames(seed):
+        legacy.process(frame.copy(), STATION)
+        step.process(frame.copy(), STATION)
+
+    changes = [
+        (change["messurement"], old_value)
+        for change in step.change_log[STATION]
+        for old_value in change["old_value"]
+    ]
+    assert sorted(changes) == sorted(legacy.changed)
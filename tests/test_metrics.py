@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from logstar_stream.metrics import METRICS_PREFIX, Metrics
+from logstar_stream.profiling import StageProfiler
+
+
+def busy(n=20000):
+    return sum(i * i for i in range(n))
+
+
+def test_stage_aggregation():
+    metrics = Metrics()
+    for _ in range(3):
+        with metrics.stage("process", "st1", step="StepA"):
+            pass
+    with metrics.stage("process", "st2", step="StepA"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.stage("download", "st1"):
+            raise ValueError("failed")
+    metrics.inc("rows_in", 5, station="st1")
+    metrics.inc("rows_in", 2, station="st1")
+
+    summary = metrics.summary()
+    assert set(summary["totals"]) == {"process", "download"}
+    stages = {(s["stage"], s["station"]): s for s in summary["stages"]}
+    assert stages[("process", "st1")]["count"] == 3
+    assert stages[("process", "st1")]["step"] == "StepA"
+    assert stages[("process", "st2")]["count"] == 1
+    assert stages[("download", "st1")]["count"] == 1
+    assert summary["totals"]["process"] == pytest.approx(
+        stages[("process", "st1")]["seconds"] + stages[("process", "st2")]["seconds"]
+    )
+    counters = {(c["name"], c.get("station"), c.get("stage")): c["value"] for c in summary["counters"]}
+    assert counters[("rows_in", "st1", None)] == 7
+    assert counters[("errors", "st1", "download")] == 1
+
+
+def test_prometheus_exposition():
+    metrics = Metrics()
+    metrics.observe("download", 0.5, 'st"1')
+    metrics.observe("download", 1.5, 'st"1')
+    metrics.inc("rows_downloaded", 10, station="st1")
+    metrics.set("last_write_timestamp_seconds", 1600000000, station="st1")
+
+    text = metrics.to_prometheus()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    duration = METRICS_PREFIX + "stage_duration_seconds"
+    assert f"# TYPE {duration} summary" in lines
+    assert f'{duration}_sum{{stage="download",station="st\\"1"}} 2.0' in lines
+    assert f'{duration}_count{{stage="download",station="st\\"1"}} 2' in lines
+    assert f"# TYPE {METRICS_PREFIX}rows_downloaded_total counter" in lines
+    assert f'{METRICS_PREFIX}rows_downloaded_total{{station="st1"}} 10' in lines
+    assert f"# TYPE {METRICS_PREFIX}last_write_timestamp_seconds gauge" in lines
+    assert f'{METRICS_PREFIX}last_write_timestamp_seconds{{station="st1"}} 1600000000' in lines
+    # every sample belongs to a declared metric
+    declared = {line.split()[2] for line in lines if line.startswith("# TYPE")}
+    for line in lines:
+        if not line.startswith("#"):
+            name = line.split("{")[0].split()[0]
+            assert name in declared or name.rsplit("_", 1)[0] in declared
+
+
+def test_profiler_summaries(tmp_path):
+    metrics = Metrics()
+    metrics.profiler = StageProfiler(str(tmp_path), top_n=5)
+    for _ in range(2):
+        with metrics.stage("process", "st1", step="StepA"):
+            busy()
+            with metrics.stage("process", "st1", step="Nested"):
+                busy()
+    with metrics.stage("download", "st2"):
+        busy()
+
+    profiles = metrics.profiler.profiles
+    # nested stages are part of the outer stage
+    assert set(profiles) == {("process", "StepA", "st1"), ("download", None, "st2")}
+    assert profiles[("process", "StepA", "st1")].calls == 2
+    assert profiles[("download", None, "st2")].calls == 1
+
+    lines = metrics.profiler.write_reports()
+    assert lines[0] == "stages by time:"
+    assert any(line.endswith("process StepA st1") for line in lines)
+    assert any(line.endswith("download st2") for line in lines)
+    files = os.listdir(tmp_path)
+    assert "summary.txt" in files
+    assert "process-StepA-st1.alloc.txt" in files
+    if metrics.profiler.skipped == 0:
+        assert "process-StepA-st1.pstats" in files
+        assert "functions by own time:" in lines
@@ -0,0 +1,17 @@
+import urllib.request
+
+import logstar_stream.mock_api as mock_api
+
+
+def test_recent_paths_are_bounded_and_redacted(monkeypatch):
+    monkeypatch.setattr(mock_api, "RECENT_PATHS", 3)
+    with mock_api.MockLogstarServer(apikey="secret", columns=2) as server:
+        for day in range(1, 6):
+            url = f"{server.url}/secret/st1/2021-01-0{day}/2021-01-0{day}/0/0/0"
+            with urllib.request.urlopen(url) as response:
+                assert response.status == 200
+
+    assert server.requests == 5
+    assert len(server.paths) == 3
+    assert all("secret" not in path for path in server.paths)
+    assert list(server.paths)[-1].split("/")[2:4] == [mock_api.REDACTED, "st1"]
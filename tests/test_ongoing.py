@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from logstar_stream.ongoing import WatermarkStore
+
+
+def frame(*timestamps):
+    return pd.DataFrame({"Datetime": pd.to_datetime(list(timestamps)), "value": 1.0})
+
+
+def test_recovers_sidecar(tmp_path):
+    WatermarkStore(csv_folder=tmp_path).update("st", frame("2021-01-01", "2021-01-02"))
+    assert WatermarkStore(csv_folder=tmp_path).get("st") == pd.Timestamp("2021-01-02")
+    assert WatermarkStore(csv_folder=tmp_path).get("other") is None
+
+
+@pytest.mark.parametrize(
+    "database, sidecar, expected",
+    [
+        ("2021-01-05", "2021-01-02", "2021-01-02"),
+        ("2021-01-01", "2021-01-02", "2021-01-01"),
+        # one sink has no data of the station yet, it is filled from the watermark of the other
+        ("2021-01-05", None, "2021-01-05"),
+        (None, "2021-01-02", "2021-01-02"),
+        (None, None, None),
+    ],
+)
+def test_recovers_oldest_of_both_sinks(tmp_path, monkeypatch, database, sidecar, expected):
+    if sidecar is not None:
+        WatermarkStore(csv_folder=tmp_path).update("st", frame(sidecar))
+    store = WatermarkStore(database_engine=object(), csv_folder=tmp_path)
+    monkeypatch.setattr(
+        store, "_from_database", lambda name: database and pd.Timestamp(database)
+    )
+    assert store.get("st") == (expected and pd.Timestamp(expected))
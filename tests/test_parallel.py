@@ -0,0 +1,64 @@
+import pandas as pd
+
+import logstar_stream.logstar as logstar
+from logstar_stream.parallel import ProcessingPool
+from logstar_stream.processing_steps.WeatherStationPrecipitationPS import (
+    WeatherStationPrecipitationPS,
+)
+from test_streaming import chain, random_station
+
+STATIONS = WeatherStationPrecipitationPS.ALLOWED_STATIONS[:3] + ["soil_station"]
+
+
+def states(steps, station):
+    """station state of every step, EnvObjects of JumpCheckPS compared by their values"""
+    result = []
+    for step in steps:
+        state = step.get_station_state(station)
+        if isinstance(state, dict) and "env" in state:
+            state = dict(state, env={key: str(env) for key, env in state["env"].items()})
+        result.append(state)
+    return result
+
+
+def changes(steps, station):
+    return [
+        (step.ps_name, change["messurement"], list(change["timestamp"]), list(change["old_value"]))
+        for step in steps
+        for change in step.change_log.get(station, [])
+    ]
+
+
+def test_pool_matches_serial(tmp_path):
+    # every station is downloaded in three consecutive parts, the state is carried between them
+    parts = {
+        station: [
+            frame.iloc[start : start + 150].reset_index(drop=True)
+            for start in (0, 150, 300)
+        ]
+        for station, frame in (
+            (station, random_station(seed, rows=450)) for seed, station in enumerate(STATIONS)
+        )
+    }
+
+    serial_steps = chain(tmp_path / "serial")
+    pool_steps = chain(tmp_path / "pool")
+    pool = ProcessingPool(pool_steps, 2)
+    try:
+        for i in range(3):
+            futures = [
+                (station, pool.submit(station, parts[station][i].copy()))
+                for station in STATIONS
+            ]
+            for station, future in futures:
+                expected = logstar.run_processing_steps(
+                    station, parts[station][i].copy(), serial_steps
+                )
+                pd.testing.assert_frame_equal(pool.merge(station, future), expected)
+    finally:
+        pool.close()
+
+    for station in STATIONS:
+        assert states(pool_steps, station) == states(serial_steps, station)
+        assert changes(pool_steps, station) == changes(serial_steps, station)
+    assert any(changes(serial_steps, station) for station in STATIONS)
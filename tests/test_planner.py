@@ -0,0 +1,33 @@
+import logstar_stream.planner as planner
+from logstar_stream.processing_steps.JumpCheckPS import JumpCheckPS
+from logstar_stream.processing_steps.WeatherStationPrecipitationPS import (
+    WeatherStationPrecipitationPS,
+)
+
+STATION = WeatherStationPrecipitationPS.ALLOWED_STATIONS[0]
+COLUMNS = ["Datetime", JumpCheckPS.JUMP_CHECK_COLUMN_NAMES[0]]
+
+
+def test_station_plan_skips_steps_without_columns():
+    jump_check = JumpCheckPS({})
+    precipitation = WeatherStationPrecipitationPS({})
+    assert planner.station_plan([jump_check, precipitation], STATION, COLUMNS) == [jump_check]
+    assert planner.station_plan([precipitation], STATION, COLUMNS) == []
+
+
+def test_station_plans_belong_to_their_steps():
+    # plans are cached per step objects, other steps with the same columns get their own plan
+    for _ in range(3):
+        jump_check = JumpCheckPS({})
+        assert planner.station_plan([jump_check], STATION, COLUMNS) == [jump_check]
+        precipitation = WeatherStationPrecipitationPS({})
+        assert planner.station_plan([precipitation], STATION, COLUMNS) == []
+        del jump_check, precipitation
+
+
+def test_station_plans_are_bounded(monkeypatch):
+    monkeypatch.setattr(planner, "STATION_PLAN_CACHE_SIZE", 2)
+    steps = [JumpCheckPS({})]
+    for i in range(5):
+        planner.station_plan(steps, STATION, COLUMNS + [f"extra_{i}"])
+    assert len(planner._station_plans) == 2
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from logstar_stream.processing_steps.WeatherStationPrecipitationPS import (
+    WeatherStationPrecipitationPS,
+)
+
+STATION = WeatherStationPrecipitationPS.ALLOWED_STATIONS[0]
+COLUMN = WeatherStationPrecipitationPS.COLUMN_NAME
+
+
+def frame(start, values):
+    return pd.DataFrame(
+        {
+            "Datetime": pd.date_range(start, periods=len(values), freq="10min"),
+            COLUMN: np.array(values, dtype="float64"),
+        }
+    )
+
+
+def removed(step, df):
+    return int(step.process(df.copy(), STATION)[COLUMN].isna().sum())
+
+
+def test_overlapping_window_twice(tmp_path):
+    # the window ends and starts with a run of 0.2, downloading it again must not join both runs
+    df = frame("2021-01-01", [0.2, 0.2, 0.0, 0.4, 0.4, 0.4, 0.4, 0.0, 0.2, 0.2])
+    step = WeatherStationPrecipitationPS({"PS_LOGGING_DIR": str(tmp_path)})
+    assert removed(step, df) == 2
+    assert removed(step, df) == 2
+    assert removed(step, df.iloc[5:].reset_index(drop=True)) == 0
+
+
+def test_run_continues_in_next_window(tmp_path):
+    step = WeatherStationPrecipitationPS({"PS_LOGGING_DIR": str(tmp_path)})
+    assert removed(step, frame("2021-01-01 00:00", [0.0, 0.2, 0.2])) == 0
+    # the run of 0.2 is continued right after the last window, its second value was already written
+    assert removed(step, frame("2021-01-01 00:30", [0.2, 0.2, 0.0])) == 1
@@ -0,0 +1,98 @@
+import json
+
+import pandas as pd
+import pytest
+
+import logstar_stream.logstar as logstar
+from logstar_stream.decoder import decode_stream, rows_to_columns
+
+HEADER = {"0": "Datetime", "1": "temp", "2": "counter", "3": "raw", "4": "gaps", "5": "mixed"}
+
+
+def legacy_prepare_dataframe(data, datetime_column):
+    """prepare_dataframe of the first release, Datetime branch only"""
+    df = pd.DataFrame(data["data"])
+    df = df.rename(columns=data["header"])
+
+    df.rename(columns={"Datetime": datetime_column}, inplace=True)
+    cols = df.columns.tolist()
+    df[datetime_column] = pd.to_datetime(df[datetime_column], errors="raise")
+    cols.insert(0, cols.pop(cols.index(datetime_column)))
+    df = df[cols]
+    cols.remove(datetime_column)
+
+    df.replace("#", pd.NA, inplace=True)
+    for col in cols:
+        df[col] = pd.to_numeric(df[col], errors="raise")
+    return df
+
+
+def payload(rows=20):
+    """float strings, integer strings, json integers, integers with no-values and ints mixed with floats"""
+    timestamps = pd.date_range("2021-01-01", periods=rows, freq="10min").strftime(
+        logstar.LOGSTAR_DATETIME_FORMAT
+    )
+    data = []
+    for i, t in enumerate(timestamps):
+        data.append(
+            {
+                "0": t,
+                "1": f"{i * 0.25:.2f}",
+                "2": str(i - 5),
+                "3": i * 3,
+                "4": "#" if i % 7 == 3 else str(i),
+                "5": "1.5" if i == rows - 1 else str(i),
+            }
+        )
+    return {"header": HEADER, "data": data}
+
+
+def chunked(data, size=7):
+    raw = json.dumps(data).encode()
+    return (raw[i : i + size] for i in range(0, len(raw), size))
+
+
+@pytest.mark.parametrize("batch_size", [3, 1000])
+def test_matches_legacy(batch_size):
+    data = payload()
+    expected = legacy_prepare_dataframe(data, "Datetime")
+    assert expected["counter"].dtype == "int64"
+    assert expected["raw"].dtype == "int64"
+
+    columns = rows_to_columns(data["data"], batch_size=batch_size)
+    df = logstar.prepare_dataframe({"header": HEADER, "columns": columns}, "Datetime")
+    pd.testing.assert_frame_equal(df, expected, check_exact=True)
+
+
+def test_stream_matches_legacy():
+    data = payload()
+    expected = legacy_prepare_dataframe(data, "Datetime")
+    streamed = decode_stream(chunked(data), decoder="builtin")
+    df = logstar.prepare_dataframe(streamed, "Datetime")
+    pd.testing.assert_frame_equal(df, expected, check_exact=True)
+
+
+def test_missing_keys_are_float():
+    data = payload()
+    del data["data"][4]["2"]
+    expected = legacy_prepare_dataframe(data, "Datetime")
+    assert expected["counter"].dtype == "float64"
+
+    df = logstar.prepare_dataframe(data, "Datetime")
+    pd.testing.assert_frame_equal(df, expected, check_exact=True)
+    streamed = decode_stream(chunked(data), decoder="builtin")
+    df = logstar.prepare_dataframe(streamed, "Datetime")
+    pd.testing.assert_frame_equal(df, expected, check_exact=True)
+
+
+def test_datetime_format_per_station():
+    other = ["01.01.2021 00:10", "01.01.2021 00:20"]
+    default = ["2021-01-01 00:10:00", "2021-01-01 00:20:00"]
+    expected = pd.DatetimeIndex(["2021-01-01 00:10", "2021-01-01 00:20"])
+
+    assert logstar.parse_datetime(other, "st_other").equals(expected)
+    assert logstar._datetime_formats["st_other"] != logstar.LOGSTAR_DATETIME_FORMAT
+    # other stations keep the default format
+    assert "st_default" not in logstar._datetime_formats
+    assert logstar.parse_datetime(default, "st_default").equals(expected)
+    assert "st_default" not in logstar._datetime_formats
@@ -0,0 +1,55 @@
+import pytest
+
+import logstar_stream.processing_steps.ProcessingStep as ps
+from logstar_stream.projection import ALL_CHANNELS, ChannelProjection
+
+HEADER = {"0": "Datetime", "1": "a", "2": "y", "3": "z", "4": "w"}
+
+
+def rename_step(columns):
+    return ps.load_class(
+        ["SimpleRenameColumnsPS", f"columns={columns}", "seperator=;", "equal=:"]
+    )
+
+
+def projection(steps, columns):
+    projection = ChannelProjection(steps, columns=columns)
+    projection.learn("S", HEADER)
+    return projection
+
+
+def test_selected_columns():
+    assert projection([], ["y", "w"]).channels("S") == ["2", "4"]
+
+
+def test_all_columns_request_all_channels():
+    assert projection([], None).channels("S") == ALL_CHANNELS
+    assert projection([], ["a", "y", "z", "w"]).channels("S") == ALL_CHANNELS
+
+
+def test_renamed_column_requests_its_source_channel():
+    steps = [rename_step("a:x")]
+    assert projection(steps, ["x", "y"]).channels("S") == ["1", "2"]
+    assert projection(steps, ["x"]).channels("S") == ["1"]
+
+
+def test_renamed_chain():
+    steps = [rename_step("a:b"), rename_step("b:x")]
+    assert projection(steps, ["x"]).channels("S") == ["1"]
+
+
+def test_unknown_columns_request_all_channels():
+    assert projection([], ["unknown"]).channels("S") == ALL_CHANNELS
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        ["BlacklistFilterColumnsPS"],
+        ["WhitelistFilterColumnsPS"],
+        ["SimpleRenameColumnsPS", "columns=a:x", "equal=:"],
+    ],
+)
+def test_missing_arguments_raise(spec):
+    with pytest.raises(ValueError, match="missing in"):
+        ps.load_class(spec)
@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+import logstar_stream.reprocess as reprocess
+
+
+def test_read_raw_csv_keeps_dtypes(tmp_path):
+    df = pd.DataFrame(
+        {
+            "Datetime": pd.date_range("2021-01-01", periods=6, freq="10min"),
+            "temp": [1.5, 2.0, None, 3.25, 4.0, 5.0],
+            "counter": [1, 2, 3, 4, 5, 6],
+        }
+    )
+    df.to_csv(tmp_path / "station.csv", index=False)
+
+    chunks = list(reprocess.read_raw_csv(tmp_path, "station", chunk_rows=4))
+    result = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(result, df)
+    assert [c["counter"].dtype for c in chunks] == ["int64", "int64"]
+
+
+def test_date_time_layout_is_rejected(tmp_path):
+    pd.DataFrame(
+        {"Date": ["2021-01-01"], "Time": ["00:10:00"], "temp": [1.5]}
+    ).to_csv(tmp_path / "station.csv", index=False)
+
+    with pytest.raises(ValueError, match="Date and Time"):
+        next(reprocess.read_raw_csv(tmp_path, "station"))
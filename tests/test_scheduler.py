@@ -0,0 +1,19 @@
+import pytest
+
+from logstar_stream.scheduler import parse_station_intervals
+
+STATIONS = ["st1", "st2", "st3"]
+
+
+def test_parse_station_intervals():
+    intervals = parse_station_intervals(["st1,st2=5", "st3=0.5"], STATIONS, 1200)
+    assert intervals == {"st1": 300, "st2": 300, "st3": 30}
+    assert parse_station_intervals(None, STATIONS, 1200) == dict.fromkeys(STATIONS, 1200)
+
+
+@pytest.mark.parametrize(
+    "value", ["st1=0", "st1=-5", "st1=nan", "st1=inf", "st1=ten", "st1", "st4=5"]
+)
+def test_invalid_station_intervals(value):
+    with pytest.raises(ValueError):
+        parse_station_intervals([value], STATIONS, 1200)
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import logstar_stream.logstar as logstar
+from logstar_stream.processing_steps.BulkConductivityDriftPS import (
+    BulkConductivityDriftPS,
+)
+from logstar_stream.processing_steps.JumpCheckPS import JumpCheckPS
+from logstar_stream.processing_steps.WeatherStationPrecipitationPS import (
+    WeatherStationPrecipitationPS,
+)
+from logstar_stream.streaming import StreamState
+
+STATION = WeatherStationPrecipitationPS.ALLOWED_STATIONS[0]
+
+
+def random_station(seed, rows=400):
+    """random data with jumps, gaps, stuck precipitation values and drifting conductivity"""
+    rng = np.random.default_rng(seed)
+    data = {"Datetime": pd.date_range("2021-01-01", periods=rows, freq="10min")}
+    for column in JumpCheckPS.JUMP_CHECK_COLUMN_NAMES:
+        values = rng.normal(25, 1, rows)
+        for start in rng.integers(0, rows - 8, 10):
+            values[start : start + rng.integers(1, 8)] += 12
+        values[rng.integers(0, rows, 8)] = np.nan
+        data[column] = values
+    for column in (
+        BulkConductivityDriftPS.ELEMENT_ORDER_LEFT
+        + BulkConductivityDriftPS.ELEMENT_ORDER_RIGHT
+    ):
+        values = rng.normal(150, 40, rows)
+        values[rng.integers(0, rows, 10)] = 450
+        data[column] = values
+    # adjacent runs of identical values, separated by zeros or not
+    data[WeatherStationPrecipitationPS.COLUMN_NAME] = rng.choice(
+        [0.0, 0.2, 0.4, 1.0], size=rows, p=[0.4, 0.2, 0.2, 0.2]
+    ).repeat(rng.integers(1, 8, rows))[:rows]
+    return pd.DataFrame(data)
+
+
+def chain(tmp_path):
+    kwargs = {"PS_LOGGING_DIR": str(tmp_path), "changelog": "csv"}
+    return [
+        JumpCheckPS(dict(kwargs)),
+        WeatherStationPrecipitationPS(dict(kwargs)),
+        BulkConductivityDriftPS(dict(kwargs)),
+    ]
+
+
+def changes(steps):
+    """columnar changelog of all steps as sorted (step, column, timestamp, old value) tuples"""
+    rows = []
+    for step in steps:
+        for change in step.change_log.get(STATION, []):
+            for timestamp, old_value in zip(change["timestamp"], change["old_value"]):
+                rows.append(
+                    (step.ps_name, change["messurement"], timestamp, float(old_value))
+                )
+    return sorted(rows, key=lambda row: row[:3])
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_chunks_match_single_run(tmp_path, seed):
+    full = random_station(seed)
+
+    steps = chain(tmp_path)
+    expected = logstar.run_processing_steps(STATION, full.copy(), steps)
+
+    rng = np.random.default_rng(1000 + seed)
+    cuts = sorted(set(rng.integers(1, len(full), 12).tolist()))
+    bounds = [0] + cuts + [len(full)]
+    chunked_steps = chain(tmp_path)
+    stream_state = StreamState(chunked_steps)
+    parts = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # downloads overlap, rows of the previous chunk are sent again
+        chunk = full.iloc[max(0, start - 5) : end].reset_index(drop=True)
+        parts.append(
+            stream_state.process(STATION, chunk.copy(), final=end == len(full))
+        )
+
+    pd.testing.assert_frame_equal(
+        pd.concat(parts, ignore_index=True), expected.reset_index(drop=True)
+    )
+    assert changes(chunked_steps) == changes(steps)
+
+
+def test_steps_start_fresh_without_stream_state(tmp_path):
+    column = JumpCheckPS.JUMP_CHECK_COLUMN_NAMES[0]
+
+    def payload(start, values):
+        timestamps = pd.date_range(start, periods=len(values), freq="10min")
+        return {
+            "header": {"0": "Datetime", "1": column},
+            "data": [
+                {"0": t.strftime(logstar.LOGSTAR_DATETIME_FORMAT), "1": str(v)}
+                for t, v in zip(timestamps, values)
+            ],
+        }
+
+    later = [31.0, 31.0, 31.0, 24.0, 24.0]
+    steps = [JumpCheckPS({"PS_LOGGING_DIR": str(tmp_path)})]
+    _, expected = logstar.process_station("st", payload("2021-01-02", later), steps)
+
+    steps = [JumpCheckPS({"PS_LOGGING_DIR": str(tmp_path)})]
+    logstar.process_station("st", payload("2021-01-01", [25.0] * 5), steps)
+    # the last value of the earlier download is not compared with the first value of this one
+    _, df = logstar.process_station("st", payload("2021-01-02", later), steps)
+    pd.testing.assert_frame_equal(df, expected)
+    assert not df[column].isna().any()